@@ -19,7 +19,7 @@ import reimport as _to_reload
 importlib.reload(_to_reload)
 from reimport import reimport
 
-reimport(['p2ppcb_parts_resolver.resolver', 'f360_common', 'p2ppcb_parts_depot.depot',
+reimport(['p2ppcb_parts_resolver.resolver', 'p2ppcb_common', 'f360_common', 'p2ppcb_parts_depot.depot',
           'route.route'], ['mainboard', 'composer_test', 'p2ppcb_composer'])
 
 from composer_test.test_base import HANDLERS
@@ -58,7 +58,13 @@ def load_automated_tests(test_suite: unittest.TestSuite):
 
     from composer_test.test_cmd import TestMatrixRoute
     test_suite.addTest(TestMatrixRoute('test_generate_route'))  # this test is notoriously slow
+    test_suite.addTest(TestMatrixRoute('test_dubins_path_lengths'))
+    test_suite.addTest(TestMatrixRoute('test_solve_pin_route_dp'))
+    test_suite.addTest(TestMatrixRoute('test_heuristic_pin_route_milp_sparse'))
+    test_suite.addTest(TestMatrixRoute('test_solve_pin_route_anytime'))
+    test_suite.addTest(TestMatrixRoute('test_route_cache'))
     test_suite.addTest(TestMatrixRoute('test_draw_wire'))
+    test_suite.addTest(TestMatrixRoute('test_write_wire_svg'))
     test_suite.addTest(TestMatrixRoute('test_generate_keymap'))
 
     from composer_test.test_cmd import TestMoveKey
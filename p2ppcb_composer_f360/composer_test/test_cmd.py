@@ -42,6 +42,18 @@ def place_locators_from_prepare_parts_sync_cache(pi):
     return specs_ops_on_pn, min_xyu, max_xyu
 
 
+def _random_dist_map(rng, n_keys: int):
+    '''
+    dist_map of a pin with n_keys keys at random distances, for pin route solvers.
+    '''
+    from itertools import product
+    from route import route as rt
+    vs = list(product(range(n_keys), rt.TerminalDirection))
+    dist_map = {(v, w): rng.uniform(0., 10.) for v, w in product(vs, vs) if v[0] != w[0]}
+    dist_map.update({(rt.START, w): rng.uniform(0., 10.) for w in vs})
+    return dist_map
+
+
 class TestCmdCommon(unittest.TestCase):
     def test_check_key_placeholders(self):
         from p2ppcb_composer.cmd_common import _check_interference
@@ -454,7 +466,7 @@ class TestMatrixRoute(unittest.TestCase):
             matrix = pickle.load(f)
         flat_cable_placements = self.fcp()
         try:
-            result = rt.generate_route(matrix, flat_cable_placements)
+            result = rt.generate_route(matrix, flat_cable_placements, use_route_cache=False)
         except BadConditionException:
             # Apple Silicon Python-MIP problem
             doc.close(False)
@@ -466,6 +478,113 @@ class TestMatrixRoute(unittest.TestCase):
             self.assertTrue(oracle == result)
         doc.close(False)
 
+    def test_dubins_path_lengths(self):
+        import numpy as np
+        from route import dubins
+        rng = np.random.default_rng(0)
+        poses = rng.uniform(-5., 5., (200, 6))
+        oracle = [sum(dubins.dubins_path_planning(*p, 5.)[4]) for p in poses]
+        lengths = dubins.dubins_path_lengths(*poses.T, 5.)
+        self.assertTrue(np.allclose(lengths, oracle))
+
+    def test_solve_pin_route_dp(self):
+        import numpy as np
+        from route import route as rt
+
+        rng = np.random.default_rng(0)
+        for n_keys in [1, 2, 5, 7]:
+            dist_map = _random_dist_map(rng, n_keys)
+            line_dp = rt.solve_pin_route_dp(dist_map, n_keys)
+            line_milp = rt.solve_pin_route_milp(dist_map, n_keys)
+            self.assertEqual(sorted(n for n, _ in line_dp), list(range(n_keys)))
+            self.assertAlmostEqual(rt.pin_route_length(dist_map, line_dp), rt.pin_route_length(dist_map, line_milp))
+
+    def test_heuristic_pin_route_milp_sparse(self):
+        import numpy as np
+        from route import route as rt
+
+        rng = np.random.default_rng(0)
+        for n_keys in [5, 9]:
+            dist_map = _random_dist_map(rng, n_keys)
+            length_dp = rt.pin_route_length(dist_map, rt.solve_pin_route_dp(dist_map, n_keys))
+            lb = rt.pin_route_lower_bound(dist_map, n_keys)
+            for k in [1, 2, n_keys - 1]:
+                line = rt.heuristic_pin_route_milp_sparse(dist_map, n_keys, k)
+                self.assertEqual(sorted(n for n, _ in line), list(range(n_keys)))
+                length = rt.pin_route_length(dist_map, line)
+                self.assertLessEqual(lb, length_dp + 1e-9)
+                self.assertLessEqual(length_dp, length + 1e-9)
+                if k == n_keys - 1:
+                    self.assertAlmostEqual(length_dp, length)
+
+    def test_solve_pin_route_anytime(self):
+        import numpy as np
+        from route import route as rt
+
+        rng = np.random.default_rng(0)
+        for n_keys in [7, 14]:
+            dist_map = _random_dist_map(rng, n_keys)
+            line_h = rt.heuristic_pin_route(dist_map, n_keys)
+            self.assertEqual(sorted(n for n, _ in line_h), list(range(n_keys)))
+            for time_limit in [0., 5.]:
+                line, lb = rt.solve_pin_route_anytime(dist_map, n_keys, time_limit)
+                self.assertEqual(sorted(n for n, _ in line), list(range(n_keys)))
+                length = rt.pin_route_length(dist_map, line)
+                self.assertLessEqual(length, rt.pin_route_length(dist_map, line_h) + 1e-9)
+                if n_keys <= rt.DP_MAX_KEYS:
+                    self.assertAlmostEqual(lb, length)
+                elif time_limit == 0.:
+                    self.assertEqual(line, line_h)
+                    self.assertIsNone(lb)
+                if lb is not None:
+                    self.assertLessEqual(lb, length + 1e-9)
+                    self.assertLessEqual(rt.pin_route_lower_bound(dist_map, n_keys), lb + 1e-3)  # The bound of CBC is rounded.
+
+    def test_route_cache(self):
+        import tempfile
+        from route import route as rt
+        with open(TEST_PKL_DIR / 'route.pkl', 'rb') as f:
+            keys_rc, entries_rccp, route_rccp = pickle.load(f)
+        pins = [(rc, keys_rc[rc][i_cp, i_pin], entry, route_rccp[rc, i_cp][i_pin])
+                for (rc, i_cp), entries in entries_rccp.items() for i_pin, entry in entries.items() if i_pin in route_rccp[rc, i_cp]]
+        hashes = [rt.pin_route_hash(rc, keys, entry, rt.solve_pin_route) for rc, keys, entry, _ in pins]
+        self.assertEqual(len(set(hashes)), len(pins))
+        rc, keys, entry, _ = pins[0]
+        self.assertNotEqual(hashes[0], rt.pin_route_hash(rc, keys, entry, rt.solve_pin_route_milp))
+        with tempfile.TemporaryDirectory() as d:
+            path = pathlib.Path(d) / rt.ROUTE_CACHE_FILENAME
+            cache = rt.RouteCache(path)
+            for h, (_, _, _, line) in zip(hashes, pins):
+                cache.put(h, line)
+            cache.save()
+            cache = rt.RouteCache(path, 2)
+            for h, (_, _, _, line) in zip(hashes, pins):
+                self.assertEqual(cache.get(h), line)
+            cache.get(hashes[0])
+            cache.put('dummy', [])
+            self.assertEqual(list(cache.entries), [hashes[0], 'dummy'])
+
+            for broken in ['[1, 2]', '"x"', '{"a": 1, "b": [[0, "Up"]]}']:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(broken)
+                cache = rt.RouteCache(path)
+                self.assertIsNone(cache.get('a'))
+                self.assertIsNone(cache.get('b'))
+
+    def test_pin_route_stats(self):
+        from route import route as rt
+        with open(TEST_PKL_DIR / 'route.pkl', 'rb') as f:
+            keys_rc, entries_rccp, _ = pickle.load(f)
+        pins = [(rc, keys_rc[rc][i_cp, i_pin], entry) for (rc, i_cp), entries in entries_rccp.items()
+                for i_pin, entry in entries.items() if len(keys_rc[rc].get((i_cp, i_pin), [])) > 0]
+        for solver, exact in [(rt.solve_pin_route, True), (rt.heuristic_pin_route, False)]:
+            for rc, keys, entry in pins:
+                _, length, lb, _ = rt._route_pin(rc, keys, entry, solver)
+                if exact:
+                    self.assertEqual(lb, length)
+                else:
+                    self.assertIsNone(lb)
+
     def test_draw_wire(self):
         from PIL import Image, ImageChops
         from route import route as rt
@@ -481,6 +600,25 @@ class TestMatrixRoute(unittest.TestCase):
             self.assertIsNone(ImageChops.difference(img, oracle).getbbox())
         doc.close(False)
 
+    def test_write_wire_svg(self):
+        import tempfile
+        import xml.etree.ElementTree as ET
+        from route import route as rt
+        from mainboard.Alice import constants
+        with open(TEST_PKL_DIR / 'route.pkl', 'rb') as f:
+            keys_rc, entries_rccp, route_rccp = pickle.load(f)
+        n_wires = sum(len(line) for lines in route_rccp.values() for line in lines.values())
+        n_images = len({id(k.img) for ks in keys_rc[rt.RC.Row].values() for k in ks})
+        with tempfile.TemporaryDirectory() as d:
+            rt.save_wire_diagrams(pathlib.Path(d), keys_rc, entries_rccp, route_rccp, self.fcp(), constants(), 'svg')
+            for rc in ['S', 'D']:
+                root = ET.parse(pathlib.Path(d) / f'wiring_{rc}.svg').getroot()
+                ns = '{http://www.w3.org/2000/svg}'
+                self.assertEqual(len(root.findall(f'.//{ns}image')), n_images)
+                paths = root.findall(f'.//{ns}path')
+                self.assertEqual(len(paths), n_wires * 2)  # border and core
+                self.assertTrue(any(' A' in p.attrib['d'] for p in paths))
+
     def test_generate_keymap(self):
         from route import route as rt
         from mainboard.Alice import constants
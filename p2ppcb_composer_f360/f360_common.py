@@ -1,9 +1,12 @@
-from enum import Enum, auto
 import sys
+import os
+import re
 import base64
+import pickle
+import shutil
 import zlib
 import hashlib
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from dataclasses import dataclass
 import pathlib
 import traceback
@@ -20,6 +23,7 @@ if struct.unpack('<d', b'\1\0\0\0\0\0\0\0')[0] == 0.0:
 from pint import Quantity
 
 import p2ppcb_parts_resolver.resolver as parts_resolver
+from p2ppcb_common import CNP_KEY_LOCATOR, TwoOrientation, FourOrientation, BadCodeException, BadConditionException, key_locator_name  # noqa
 from p2ppcb_parts_resolver.resolver import SpecsOpsOnPn
 import f360_insert_decal_rpa
 import adsk.core as ac
@@ -54,7 +58,6 @@ CN_KEY_PLACEHOLDERS = 'Key Placeholders' + MAGIC
 CN_MISC_PLACEHOLDERS = 'Misc Placeholders' + MAGIC
 CN_FOOT_PLACEHOLDERS = 'Foot Placeholders' + MAGIC
 CN_DEPOT_KEY_ASSEMBLY = 'Depot Key Assembly' + MAGIC
-CNP_KEY_LOCATOR = '_KL'
 CNP_KEY_PLACEHOLDER = '_KP'
 CNP_KEY_ASSEMBLY = '_KA'
 CN_DEPOT_CAP_PLACEHOLDER = 'Depot Cap Placeholder' + MAGIC
@@ -126,18 +129,6 @@ def capture_position():
         con.des.snapshots.add()
 
 
-class TwoOrientation(Enum):
-    Front = auto()
-    Back = auto()
-
-
-class FourOrientation(Enum):
-    Front = auto()
-    Back = auto()
-    Left = auto()
-    Right = auto()
-
-
 class F3AttributeDict(ty.MutableMapping[str, str]):
     def __init__(self, raw_attrs: ac.Attributes) -> None:
         super().__init__()
@@ -757,23 +748,6 @@ class BodyFinder:
         return ret
 
 
-class BadCodeException(Exception):
-    '''
-    An exception to Pylance hinting. By explicitly removing forbidden code paths, Pylance does a good job.
-    '''
-    def __init__(self, message=''):
-        m = '' if len(message) == 0 else '\n' + message
-        super().__init__('Bad code. You need to debug.' + m)
-
-
-class BadConditionException(Exception):
-    '''
-    An exception for users.
-    '''
-    def __init__(self, message):
-        super().__init__(message)
-
-
 def catch_exception(func: ty.Callable):
     '''
     This attribute wraps handlers which are called from F360 message pump.
@@ -802,10 +776,6 @@ def cap_placeholder_name(i: int, cap_desc: str, specifier: str, legend: ty.List[
     return f'{cap_desc} {specifier} {i} {hex_str}{CNP_CAP_PLACEHOLDER}'
 
 
-def key_locator_name(i: int, pattern_name: str):
-    return f'{pattern_name} {i}{CNP_KEY_LOCATOR}'
-
-
 def key_placeholder_name(i: int, pattern_name: str):
     return f'{pattern_name} {i}{CNP_KEY_PLACEHOLDER}'
 
@@ -867,9 +837,97 @@ def prepare_tmp_dir(kle_hash: ty.Optional[str] = None):
 
 
 KLE_CACHE: ty.Dict[str, ty.Any] = {}
+KLE_DISK_CACHE_FILENAME = 'kle_resolution.pickle'
+KLE_DISK_CACHE_VERSION = 4  # Bump it when the KLE resolution of resolver.py or the layout of the cache changes.
+KLE_DISK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+_KLE_HASH_REGEX = re.compile(r'[0-9a-f]{32}')
+KLE_COLUMNS_CACHE: ty.OrderedDict[str, parts_resolver.KleColumns] = OrderedDict()  # By KLE hash, least recently used first. The baselines of incremental resolution.
+KLE_COLUMNS_CACHE_SIZE = 4  # The others are loaded from the disk cache.
+
 
+def _kle_disk_cache_signature(pi: parts_resolver.PartsInfo):
+    return hashlib.sha256(repr((KLE_DISK_CACHE_VERSION, pi.index.signature)).encode()).hexdigest()
 
-def load_kle(kle_file: pathlib.Path, pi: parts_resolver.PartsInfo) -> ty.Tuple[SpecsOpsOnPn, ty.Tuple[float, float], ty.Tuple[float, float]]:
+
+def _image_stats(kle_dir: pathlib.Path):
+    return sorted((p.name, p.stat().st_size, p.stat().st_mtime_ns) for p in kle_dir.glob('*.png'))
+
+
+def _load_kle_disk_cache(kle_dir: pathlib.Path, pi: parts_resolver.PartsInfo):
+    '''
+    The resolution (and the scraped images) of a former session in tmp/<kle hash>. None if it is missing, stale or broken.
+    '''
+    cache_path = kle_dir / KLE_DISK_CACHE_FILENAME
+    try:
+        with open(cache_path, 'rb') as f:
+            entry = pickle.load(f)
+        if entry['signature'] != _kle_disk_cache_signature(pi) or entry['images'] != _image_stats(kle_dir):
+            return None
+        columns: parts_resolver.KleColumns = entry['columns']
+    except Exception:
+        return None
+    columns.image_output_dir = kle_dir
+    os.utime(cache_path)  # The mtime is the last access time of LRU.
+    return columns, entry['min_xyu'], entry['max_xyu']
+
+
+def _save_kle_disk_cache(kle_dir: pathlib.Path, pi: parts_resolver.PartsInfo, columns: parts_resolver.KleColumns, min_xyu, max_xyu):
+    entry = {'signature': _kle_disk_cache_signature(pi), 'images': _image_stats(kle_dir), 'columns': columns, 'min_xyu': min_xyu, 'max_xyu': max_xyu}
+    tmp_path = kle_dir / (KLE_DISK_CACHE_FILENAME + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, kle_dir / KLE_DISK_CACHE_FILENAME)
+
+
+def _evict_kle_disk_cache(keep: pathlib.Path, max_bytes: int = KLE_DISK_CACHE_MAX_BYTES):
+    '''
+    Removes least recently used tmp/<kle hash> directories until the total size is under max_bytes.
+    '''
+    dirs: ty.List[ty.Tuple[float, int, pathlib.Path]] = []
+    for d in keep.parent.iterdir():
+        if not d.is_dir() or _KLE_HASH_REGEX.fullmatch(d.name) is None:
+            continue
+        files = [p for p in d.iterdir() if p.is_file()]
+        cache_path = d / KLE_DISK_CACHE_FILENAME
+        last_access = cache_path.stat().st_mtime if cache_path.exists() else 0.  # Without the cache, it is useless.
+        dirs.append((last_access, sum(p.stat().st_size for p in files), d))
+    total = sum(size for _, size, _ in dirs)
+    for _, size, d in sorted(dirs):
+        if total <= max_bytes:
+            break
+        if d == keep:
+            continue
+        shutil.rmtree(d, ignore_errors=True)
+        total -= size
+
+
+def kle_hash_by_b64(kle_b64: str):
+    return hashlib.md5(zlib.decompress(base64.b64decode(kle_b64))).hexdigest()
+
+
+def _cache_kle_columns(kle_hash: str, columns: parts_resolver.KleColumns):
+    KLE_COLUMNS_CACHE[kle_hash] = columns
+    KLE_COLUMNS_CACHE.move_to_end(kle_hash)
+    while len(KLE_COLUMNS_CACHE) > KLE_COLUMNS_CACHE_SIZE:
+        KLE_COLUMNS_CACHE.popitem(last=False)
+
+
+def _kle_columns_by_hash(kle_hash: str, pi: parts_resolver.PartsInfo):
+    if kle_hash in KLE_COLUMNS_CACHE:
+        KLE_COLUMNS_CACHE.move_to_end(kle_hash)
+        return KLE_COLUMNS_CACHE[kle_hash]
+    kle_dir = CURRENT_DIR / 'tmp' / kle_hash
+    if not kle_dir.is_dir():
+        return None
+    cached = _load_kle_disk_cache(kle_dir, pi)
+    return None if cached is None else cached[0]
+
+
+def load_kle(kle_file: pathlib.Path, pi: parts_resolver.PartsInfo, previous_kle_hash: ty.Optional[str] = None) -> ty.Tuple[SpecsOpsOnPn, ty.Tuple[float, float], ty.Tuple[float, float]]:
+    '''
+    previous_kle_hash: The KLE hash which the document had before this KLE file. Its resolution is the baseline of
+    incremental resolution, so only the edited keys are scraped again.
+    '''
     with open(kle_file, 'rb') as f:
         kle_file_content = f.read()
     kle_hash = hashlib.md5(kle_file_content).hexdigest()
@@ -877,11 +935,20 @@ def load_kle(kle_file: pathlib.Path, pi: parts_resolver.PartsInfo) -> ty.Tuple[S
         return KLE_CACHE[kle_hash]
 
     tmp = None if f360_insert_decal_rpa.FALLBACK_MODE else prepare_tmp_dir(kle_hash)
-
+    if tmp is not None:
+        cached = _load_kle_disk_cache(tmp, pi)
+        if cached is not None:
+            columns, min_xyu, max_xyu = cached
+            _cache_kle_columns(kle_hash, columns)
+            result = columns.to_specs_ops_on_pn(), min_xyu, max_xyu
+            KLE_CACHE[kle_hash] = result
+            return result
+
+    previous = None
+    if tmp is not None and previous_kle_hash is not None and previous_kle_hash != kle_hash:
+        previous = _kle_columns_by_hash(previous_kle_hash, pi)
     try:
-        result = pi.resolve_kle(kle_file, tmp)
-        KLE_CACHE[kle_hash] = result
-        specs_ops_on_pn, min_xyu, max_xyu = result
+        columns, min_xyu, max_xyu = pi.resolve_kle_columns(kle_file, tmp, previous)
     except Exception as e:
         msg = str(e)
         if msg.startswith('Failed to load'):
@@ -889,9 +956,19 @@ def load_kle(kle_file: pathlib.Path, pi: parts_resolver.PartsInfo) -> ty.Tuple[S
             pass
         else:
             print(f'parts_resolver.resolve_kle() Failed. The error message:\n{str(e)}\n\nRetrying...', file=sys.stderr)
-        specs_ops_on_pn, min_xyu, max_xyu = pi.resolve_kle(kle_file, tmp)
+        columns, min_xyu, max_xyu = pi.resolve_kle_columns(kle_file, tmp)
+    if tmp is not None:
+        _cache_kle_columns(kle_hash, columns)
+    result = columns.to_specs_ops_on_pn(), min_xyu, max_xyu
+    KLE_CACHE[kle_hash] = result
+    if tmp is not None:
+        try:
+            _save_kle_disk_cache(tmp, pi, columns, min_xyu, max_xyu)
+            _evict_kle_disk_cache(tmp)
+        except OSError:
+            traceback.print_exc()
 
-    return specs_ops_on_pn, min_xyu, max_xyu
+    return result
 
 
 def load_kle_by_b64(kle_b64: str, pi: parts_resolver.PartsInfo):
@@ -908,8 +985,8 @@ def get_parts_data_path():
     return pathlib.Path(get_context().child[CN_INTERNAL].comp_attr[AN_PARTS_DATA_PATH])
 
 
-def get_part_info():
-    return parts_resolver.PartsInfo(get_parts_data_path() / parts_resolver.PARTS_INFO_DIRNAME)
+def get_part_info(reload: bool = False):
+    return parts_resolver.get_parts_info(get_parts_data_path() / parts_resolver.PARTS_INFO_DIRNAME, reload)
 
 
 def get_inverted_m3d(m3d: ac.Matrix3D):
@@ -0,0 +1,42 @@
+'''
+Definitions which don't depend on F360. Don't import adsk here.
+f360_common re-exports all of them, so F360-dependent modules should import them from f360_common as before.
+F360-independent modules (route etc.) import them from here.
+'''
+from enum import Enum, auto
+
+
+CNP_KEY_LOCATOR = '_KL'
+
+
+class TwoOrientation(Enum):
+    Front = auto()
+    Back = auto()
+
+
+class FourOrientation(Enum):
+    Front = auto()
+    Back = auto()
+    Left = auto()
+    Right = auto()
+
+
+class BadCodeException(Exception):
+    '''
+    An exception to Pylance hinting. By explicitly removing forbidden code paths, Pylance does a good job.
+    '''
+    def __init__(self, message=''):
+        m = '' if len(message) == 0 else '\n' + message
+        super().__init__('Bad code. You need to debug.' + m)
+
+
+class BadConditionException(Exception):
+    '''
+    An exception for users.
+    '''
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def key_locator_name(i: int, pattern_name: str):
+    return f'{pattern_name} {i}{CNP_KEY_LOCATOR}'
@@ -276,7 +276,7 @@ class CheckKeyAssemblyCommandHandler(CommandHandlerBase):
         con.des.designType = af.DesignTypes.DirectDesignType
         inl_occ = con.child.get_real(CN_INTERNAL)
         pi_dir = CURRENT_DIR.parent / 'p2ppcb_parts_data_f360'
-        self.pi = parts_resolver.PartsInfo(pi_dir / parts_resolver.PARTS_INFO_DIRNAME)
+        self.pi = parts_resolver.get_parts_info(pi_dir / parts_resolver.PARTS_INFO_DIRNAME)
         inl_occ.comp_attr[AN_PARTS_DATA_PATH] = str(pi_dir)
         _ = self.inputs.addStringValueInput(INP_ID_PATTERN_NAME_STR, 'Pattern Name', '')
         _ = self.inputs.addStringValueInput(INP_ID_SPECIFIER_STR, 'Specifier', '')
@@ -354,7 +354,7 @@ class PartsCommandBlock:
     def set_parts_data_path(self, path: pathlib.Path):
         if self.parts_data_path == path and self.choose_path:
             return
-        self.pi = parts_resolver.PartsInfo(path / parts_resolver.PARTS_INFO_DIRNAME)
+        self.pi = parts_resolver.get_parts_info(path / parts_resolver.PARTS_INFO_DIRNAME)
         self.parts_data_path = path
         if self.choose_path:
             pi_in = self.get_parts_data_in()
@@ -400,6 +400,12 @@ class PartsCommandBlock:
             vo_in.isValueError = True
             event_args.areInputsValid = False
 
+        # Rejects the parts which cannot make any key, if the compatibility matrix has been compiled.
+        names = [None if inp.selectedItem is None else inp.selectedItem.name for inp in self.get_option_ins()]
+        cap_desc, stabilizer_desc, _, switch_desc, _, _ = names
+        if cap_desc and stabilizer_desc and switch_desc and self.pi.compatible_specifiers(cap_desc, stabilizer_desc, switch_desc) == []:
+            event_args.areInputsValid = False
+
     def b_notify_input_changed(self, changed_input: CommandInput):
         if changed_input.id == INP_ID_PARTS_DATA_PATH_BOOL:
             con = get_context()
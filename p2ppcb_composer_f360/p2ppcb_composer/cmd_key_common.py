@@ -276,14 +276,14 @@ def prepare_key_assembly(
         part_filename, part_parameters, part_placeholder, part_z_pos, switch_xya = pi.resolve_specifier(specifier, cap_desc, stabilizer_desc, switch_desc, align_to)
 
         if PN_USE_STABILIZER in part_parameters[Part.Stabilizer]:
-            if part_parameters[Part.Stabilizer][PN_USE_STABILIZER].m_as('mm') == 0:
+            if parts_resolver.magnitude_as(part_parameters[Part.Stabilizer][PN_USE_STABILIZER], 'mm') == 0:
                 del part_z_pos[Part.Stabilizer]
             del part_parameters[Part.Stabilizer][PN_USE_STABILIZER]
         else:
             del part_z_pos[Part.Stabilizer]
 
         part_trans = {
-            p: _create_part_trans(part_z_pos[p].m_as('cm'))
+            p: _create_part_trans(parts_resolver.magnitude_as(part_z_pos[p], 'cm'))
             for p in parts_resolver.PARTS_WITH_COMPONENT
             if p in part_z_pos
         }
@@ -292,11 +292,11 @@ def prepare_key_assembly(
             if p in part_trans:
                 t = EYE_M3D.copy()
                 spn_x, spn_y, spn_angle = (parts_resolver.SPN_STABILIZER_X, parts_resolver.SPN_STABILIZER_Y, parts_resolver.SPN_STABILIZER_ANGLE) if p == Part.Stabilizer else (parts_resolver.SPN_SWITCH_X, parts_resolver.SPN_SWITCH_Y, parts_resolver.SPN_SWITCH_ANGLE)
-                switch_angle = switch_xya[spn_angle].m_as('rad')
+                switch_angle = parts_resolver.magnitude_as(switch_xya[spn_angle], 'rad')
                 if switch_angle != 0.:
                     t.setToRotation(switch_angle, ZU_V3D, ORIGIN_P3D)
-                t.setCell(0, 3, switch_xya[spn_x].m_as('cm'))
-                t.setCell(1, 3, switch_xya[spn_y].m_as('cm'))
+                t.setCell(0, 3, parts_resolver.magnitude_as(switch_xya[spn_x], 'cm'))
+                t.setCell(1, 3, parts_resolver.magnitude_as(switch_xya[spn_y], 'cm'))
                 part_trans[p].transformBy(t)
 
         offset_trans = ac.Matrix3D.create()
@@ -13,7 +13,7 @@ from f360_common import AN_KEY_V_OFFSET, AN_LOCATORS_ENABLED, AN_LOCATORS_I, \
     AN_LOCATORS_LEGEND_PICKLED, AN_LOCATORS_PATTERN_NAME, AN_LOCATORS_SPECIFIER, ANS_OPTION, \
     CN_KEY_PLACEHOLDERS, DECAL_DESC_KEY_LOCATOR, BadConditionException, BadCodeException, SpecsOpsOnPn, \
     VirtualF3Occurrence, CURRENT_DIR, get_context, CN_INTERNAL, CN_KEY_LOCATORS, key_locator_name, \
-    ANS_KEY_PITCH, AN_KLE_B64, load_kle, get_part_info
+    ANS_KEY_PITCH, AN_KLE_B64, load_kle, get_part_info, kle_hash_by_b64
 import p2ppcb_parts_depot.depot as parts_depot
 from p2ppcb_composer.cmd_common import AN_MAIN_SURFACE, get_ci, AN_LOCATORS_PLANE_TOKEN, MoveComponentCommandBlock, \
     CommandHandlerBase, AN_MAIN_KEY_V_OFFSET, AN_MAIN_LAYOUT_PLANE, ANS_MAIN_OPTION, locator_notify_pre_select, has_sel_in, get_selected_locators
@@ -136,15 +136,16 @@ class LoadKleFileCommandHandler(CommandHandlerBase):
         if len(kle_b64.encode('utf-8')) > 2097152:
             raise BadConditionException('Sorry, the KLE file is too large.')
         inl_occ = con.child[CN_INTERNAL]
+        previous_kle_hash = kle_hash_by_b64(inl_occ.comp_attr[AN_KLE_B64]) if AN_KLE_B64 in inl_occ.comp_attr else None
         inl_occ.comp_attr[AN_KLE_B64] = kle_b64
 
-        pi = get_part_info()
+        pi = get_part_info(reload=True)  # Picks up the parts data edited in place.
 
         pb = con.ui.progressBar
         try:
             pb.show('Load KLE is processing %v of %m.', 1, 4)
             try:
-                place_locators_args = load_kle(kle_file_path, pi)
+                place_locators_args = load_kle(kle_file_path, pi, previous_kle_hash)
             except Exception:
                 raise BadConditionException('Internal Error: Please restart Fusion 360. If this error occurs again, something is corrupted.')
             pb.progressValue = 2
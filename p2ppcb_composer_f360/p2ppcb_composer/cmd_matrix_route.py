@@ -13,6 +13,7 @@ from p2ppcb_composer.cmd_key_common import INP_ID_KEY_LOCATOR_SEL, get_layout_pl
 INP_ID_LEDKEY_BOOL = 'ledKey'
 INP_ID_ROW_COL_RADIO = 'rowCol'
 INP_ID_WIRE_NAME_DD = 'wireName'
+ROUTE_TIME_BUDGET = rt.RouteTimeBudget(pin=60., total=300.)  # In seconds. Routing a large pin by MILP can take very long.
 
 
 def is_led_name(name):
@@ -314,8 +315,9 @@ class GenerateRouteCommandHandler(CommandHandlerBase):
         pb = con.ui.progressBar
         try:
             pb.show('Generating Route...', 0, 1, True)
-            keys_rc, entries_rccp, route_rccp = rt.generate_route(matrix, flat_cable_placements)
-            img_row, img_col = rt.draw_wire(keys_rc, entries_rccp, route_rccp, flat_cable_placements)
+            route_stats: ty.List[rt.PinRouteStat] = []
+            keys_rc, entries_rccp, route_rccp = rt.generate_route(matrix, flat_cable_placements, time_budget=ROUTE_TIME_BUDGET, stats=route_stats)
+            img_row, img_col = rt.draw_wire(keys_rc, entries_rccp, route_rccp, flat_cable_placements, mc)
             generated_snippet, via_json = rt.generate_keymap(keys_rc, mc)
         finally:
             pb.hide()
@@ -326,5 +328,10 @@ class GenerateRouteCommandHandler(CommandHandlerBase):
             f.write(via_json)
         img_row.save(str(output_dir_path / 'wiring_S.png'))
         img_col.save(str(output_dir_path / 'wiring_D.png'))
+        with open(output_dir_path / 'route_stats.txt', 'w') as f:
+            f.write(rt.format_pin_route_stats(route_stats))
 
-        con.ui.messageBox('QMK / VIA keymap and wiring diagrams have been generated.', 'P2PPCB')
+        msg = 'QMK / VIA keymap and wiring diagrams have been generated.'
+        if any(st.gap is None or st.gap > rt.GAP_TOLERANCE for st in route_stats):
+            msg += '\nSome wires may not be the shortest because of the time limit. See route_stats.txt.'
+        con.ui.messageBox(msg, 'P2PPCB')
@@ -9,6 +9,7 @@ import typing as ty
 from dataclasses import dataclass
 from pint import Quantity
 import numpy as np
+import p2ppcb_parts_resolver.resolver as parts_resolver
 from PIL import Image
 import adsk.core as ac
 import adsk.fusion as af
@@ -83,12 +84,10 @@ def open_a360_file(folder: ac.DataFolder, name: str) -> ac.DataFile:
 def convert_quantity_to_float(qs: ty.Dict[str, Quantity]):
     ret: ty.Dict[str, float] = {}
     for k, v in qs.items():
-        if v.is_compatible_with('rad'):
-            ret[k] = v.m_as('rad')  # dimensionless value too
-        elif v.is_compatible_with('cm'):
-            ret[k] = v.m_as('cm')
-        else:
+        f = parts_resolver.quantity_to_float(v)  # rad, dimensionless value too, or cm
+        if f is None:
             raise BadCodeException(f'Unknown dimension in part info: {str(v)}')
+        ret[k] = f
     return ret
 
 
@@ -158,7 +157,7 @@ def create_key_locator_surface_by_pattern(pattern: np.ndarray, pitch_wd: ty.Dict
     directions = np.array(directions_list) / 4
     sketch: af.Sketch = occ.comp.sketches.add(occ.comp.xYConstructionPlane)
     lines = sketch.sketchCurves.sketchLines
-    p: float = min([pitch_wd[an].m_as('cm') for an in ANS_KEY_PITCH])
+    p: float = min([parts_resolver.magnitude_as(pitch_wd[an], 'cm') for an in ANS_KEY_PITCH])
     # src_slc = CreateObjectCollectionT(af.SketchLine)
     src_slc: list[af.SketchCurve] = []
     for v, d in zip(vertices, directions):
@@ -372,12 +371,10 @@ class PartsDepot:
                 for k, v in pp.model_parameters.items():
                     for mp in comp.modelParameters:
                         if mp.name == k or mp.name.startswith(k + '_'):
-                            if v.is_compatible_with('rad'):
-                                mp.value = v.m_as('rad')
-                            elif v.is_compatible_with('cm'):
-                                mp.value = v.m_as('cm')
-                            else:
+                            f = parts_resolver.quantity_to_float(v)
+                            if f is None:
                                 raise BadCodeException(f'Unknown dimension in part info: {str(v)}')
+                            mp.value = f
                 if pp.cap_placeholder_parameters is not None:
                     for b in comp.bRepBodies:
                         a = b.attributes.itemByName(ATTR_GROUP, 'Placeholder')
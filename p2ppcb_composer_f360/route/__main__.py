@@ -0,0 +1,153 @@
+'''
+Batch router without F360. Run in p2ppcb_composer_f360 directory:
+
+    python -m route BUNDLES_DIR [-o OUT_DIR] [-j N_WORKERS] [--parts-data PARTS_DATA_DIR] [--sparse]
+        [--pin-time-limit SEC] [--time-limit SEC] [--format {png,svg}]
+
+Each subdirectory of BUNDLES_DIR which has bundle.json is a bundle. bundle.json is like:
+
+    {
+        "mainboard": "Alice",
+        "name": "My Keyboard",
+        "kle": "kle.json",
+        "matrix": "matrix.json",
+        "key_pitch": [1.9, 1.9],
+        "switch_desc": "MX",
+        "switch_orientation": "Front",
+        "key_switches": {"1u 3_KL": {"switch_desc": "Choc V1", "switch_orientation": "Back"}},
+        "cable_placements": [
+            {"start": [4.0, 0.0], "angle": 1.5708, "flip": false},
+            {"start": [0.0, 6.0], "angle": 0.0, "flip": false}
+        ]
+    }
+
+Only "mainboard" and "cable_placements" are mandatory. Others are defaults above, except "name" (the directory name).
+The i-th cable placement is for the i-th flat cable of the mainboard. Lengths are in cm, angles are in rad.
+"matrix" is {row wire name: {col wire name: key locator name}}, as Assign Matrix command does.
+Key locator name is like "1u 3_KL" (pattern name, index, "_KL"). The keys in the matrix are routed.
+
+Outputs qmk_keymap.txt, via_keymap.json, wiring_S.png (or .svg), wiring_D.png (or .svg) and route_stats.txt into OUT_DIR/<bundle directory name>
+(the bundle directory if OUT_DIR is omitted). route_cache.json there keeps solved pins for the next run.
+'''
+import argparse
+import json
+import pathlib
+import sys
+import traceback
+import typing as ty
+from concurrent.futures import ProcessPoolExecutor
+
+from p2ppcb_common import FourOrientation
+from p2ppcb_parts_resolver.resolver import PartsInfo, PARTS_INFO_DIRNAME, get_parts_info
+from route.route import ROUTE_CACHE_FILENAME, FlatCablePlacement, KeySwitch, PinRouteSolver, RouteCache, RouteTimeBudget, generate_route_data, \
+    load_mainboard_constants, solve_pin_route, heuristic_pin_route_sparse, format_pin_route_stats, save_wire_diagrams, WIRE_DIAGRAM_FORMATS
+
+
+BUNDLE_FILENAME = 'bundle.json'
+DEFAULT_PARTS_DATA_DIR = pathlib.Path(__file__).parent.parent.parent / 'p2ppcb_parts_data_f360'
+DEFAULT_KEY_PITCH = (1.9, 1.9)
+
+_PARTS_INFO: ty.Optional[PartsInfo] = None
+
+
+def _init_worker(parts_data_dir: pathlib.Path):
+    # Each worker keeps its PartsInfo (and its memoized resolutions) and wiring images warm across bundles.
+    global _PARTS_INFO
+    _PARTS_INFO = get_parts_info(parts_data_dir / PARTS_INFO_DIRNAME)
+
+
+def route_bundle(bundle_dir: pathlib.Path, out_dir: pathlib.Path, solver: PinRouteSolver = solve_pin_route, time_budget: ty.Optional[RouteTimeBudget] = None,
+                 fmt: str = 'png'):
+    if _PARTS_INFO is None:
+        raise Exception('Call _init_worker() first.')
+    with open(bundle_dir / BUNDLE_FILENAME, 'r', encoding='utf-8') as f:
+        bundle = json.load(f)
+    with open(bundle_dir / bundle.get('matrix', 'matrix.json'), 'r', encoding='utf-8') as f:
+        matrix: ty.Dict[str, ty.Dict[str, str]] = json.load(f)
+    with open(bundle_dir / bundle.get('kle', 'kle.json'), 'rb') as f:
+        kle_json = f.read()
+    mbc = load_mainboard_constants(bundle['mainboard'])
+    if len(bundle['cable_placements']) > len(mbc.flat_cables):
+        raise Exception(f'{bundle_dir.name}: {bundle["mainboard"]} has only {len(mbc.flat_cables)} flat cables.')
+    cable_placements = [FlatCablePlacement((float(cp['start'][0]), float(cp['start'][1])), float(cp['angle']), cable, bool(cp.get('flip', False)))
+                        for cp, cable in zip(bundle['cable_placements'], mbc.flat_cables)]
+
+    default_switch = KeySwitch(bundle.get('switch_desc', 'MX'), FourOrientation[bundle.get('switch_orientation', 'Front')])
+    overrides: ty.Dict[str, ty.Dict[str, str]] = bundle.get('key_switches', {})
+    key_switches: ty.Dict[str, KeySwitch] = {}
+    for col_dic in matrix.values():
+        for kl_name in col_dic.values():
+            if kl_name in overrides:
+                o = overrides[kl_name]
+                key_switches[kl_name] = KeySwitch(o.get('switch_desc', default_switch.switch_desc),
+                                                  FourOrientation[o.get('switch_orientation', default_switch.switch_orientation.name)])
+            else:
+                key_switches[kl_name] = default_switch
+    key_pitch = bundle.get('key_pitch', DEFAULT_KEY_PITCH)
+
+    rd = generate_route_data(kle_json, matrix, key_switches, (float(key_pitch[0]), float(key_pitch[1])), cable_placements,
+                             _PARTS_INFO, mbc, bundle.get('name', bundle_dir.name), solver, route_cache=RouteCache(out_dir / ROUTE_CACHE_FILENAME),
+                             time_budget=time_budget, draw_images=False)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / 'qmk_keymap.txt', 'w', encoding='utf-8') as f:
+        f.write(rd.qmk_keymap)
+    with open(out_dir / 'via_keymap.json', 'w', encoding='utf-8') as f:
+        f.write(rd.via_keymap)
+    save_wire_diagrams(out_dir, rd.keys_rc, rd.entries_rccp, rd.route_rccp, cable_placements, mbc, fmt)
+    with open(out_dir / 'route_stats.txt', 'w', encoding='utf-8') as f:
+        f.write(format_pin_route_stats(rd.stats))
+
+
+def _route_bundle_safe(bundle_dir: pathlib.Path, out_dir: pathlib.Path, solver: PinRouteSolver, time_budget: ty.Optional[RouteTimeBudget],
+                       fmt: str) -> ty.Optional[str]:
+    try:
+        route_bundle(bundle_dir, out_dir, solver, time_budget, fmt)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+def main(argv: ty.Optional[ty.List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m route', description='Generates route data (keymaps and wiring diagrams) of many bundles without F360.')
+    parser.add_argument('bundles_dir', type=pathlib.Path, help=f'Directory of bundles. A bundle is a directory which has {BUNDLE_FILENAME}.')
+    parser.add_argument('-o', '--out-dir', type=pathlib.Path, default=None, help='Output directory. Default: output into each bundle.')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Number of worker processes. Default: as many as CPU cores.')
+    parser.add_argument('--parts-data', type=pathlib.Path, default=DEFAULT_PARTS_DATA_DIR, help='Parts data directory.')
+    parser.add_argument('--sparse', action='store_true', help='Heuristic sparse MILP for large pins. Much faster, but not guaranteed to be optimal.')
+    parser.add_argument('--pin-time-limit', type=float, default=None, help='Time limit of each pin in seconds. The best route found is used.')
+    parser.add_argument('--format', choices=WIRE_DIAGRAM_FORMATS, default='png', help='Format of wiring diagrams. svg is vector.')
+    parser.add_argument('--time-limit', type=float, default=None, help='Time limit of all pins of a bundle in seconds. The best route found is used.')
+    args = parser.parse_args(argv)
+
+    bundle_dirs = sorted(p.parent for p in args.bundles_dir.glob(f'*/{BUNDLE_FILENAME}'))
+    if len(bundle_dirs) == 0:
+        print(f'No bundle in {args.bundles_dir}.', file=sys.stderr)
+        return 1
+    out_dirs = [bd if args.out_dir is None else args.out_dir / bd.name for bd in bundle_dirs]
+    solver = heuristic_pin_route_sparse if args.sparse else solve_pin_route
+    time_budget = None
+    if args.pin_time_limit is not None or args.time_limit is not None:
+        time_budget = RouteTimeBudget(args.pin_time_limit, args.time_limit)
+
+    if args.workers == 1:
+        _init_worker(args.parts_data)
+        errors = [_route_bundle_safe(bd, od, solver, time_budget, args.format) for bd, od in zip(bundle_dirs, out_dirs)]
+    else:
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(args.parts_data, )) as executor:
+            errors = list(executor.map(_route_bundle_safe, bundle_dirs, out_dirs, [solver] * len(bundle_dirs), [time_budget] * len(bundle_dirs),
+                                       [args.format] * len(bundle_dirs)))
+
+    n_failed = 0
+    for bd, e in zip(bundle_dirs, errors):
+        if e is None:
+            print(f'{bd.name}: OK')
+        else:
+            n_failed += 1
+            print(f'{bd.name}: FAILED\n{e}', file=sys.stderr)
+    print(f'{len(bundle_dirs) - n_failed} succeeded, {n_failed} failed.')
+    return 0 if n_failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -183,17 +183,7 @@ def left_right_left(alpha: float, beta: float, d: float):
     return t, p, q, mode
 
 
-def dubins_path_planning_from_origin(end_x, end_y, end_yaw, curvature: float,
-                                     step_size):
-    dx = end_x
-    dy = end_y
-    D = math.hypot(dx, dy)
-    d = D * curvature
-
-    theta = mod2pi(math.atan2(dy, dx))
-    alpha = mod2pi(- theta)
-    beta = mod2pi(end_yaw - theta)
-
+def _best_word(alpha: float, beta: float, d: float) -> ty.Tuple[ty.List[float], ty.List[str]]:
     planning_funcs = [left_straight_left, right_straight_right,
                       left_straight_right, right_straight_left,
                       right_left_right, left_right_left]
@@ -217,7 +207,54 @@ def dubins_path_planning_from_origin(end_x, end_y, end_yaw, curvature: float,
             best_cost = cost
     if best_mode is None or bt is None or bp is None or bq is None:
         raise Exception('Bad code.')
-    lengths = [bt, bp, bq]
+    return [bt, bp, bq], best_mode
+
+
+def dubins_path_segments(s_x, s_y, s_yaw, g_x, g_y, g_yaw, curvature) -> ty.List[ty.Tuple[str, float, ty.Tuple[float, float, float], ty.Tuple[float, float, float]]]:
+    """
+    The shortest path as segments, without sampling points. For vector drawing.
+
+    :return: list of (mode, length, start pose, end pose). mode is "L", "S" or "R". A pose is (x, y, yaw).
+    """
+    dx = g_x - s_x
+    dy = g_y - s_y
+    le_x = math.cos(s_yaw) * dx + math.sin(s_yaw) * dy
+    le_y = -math.sin(s_yaw) * dx + math.cos(s_yaw) * dy
+    theta = mod2pi(math.atan2(le_y, le_x))
+    alpha = mod2pi(- theta)
+    beta = mod2pi(g_yaw - s_yaw - theta)
+    lengths, modes = _best_word(alpha, beta, math.hypot(dx, dy) * curvature)
+
+    r = 1. / curvature
+    ret = []
+    x, y, yaw = s_x, s_y, s_yaw
+    for m, length in zip(modes, lengths):
+        if length == 0.:
+            continue
+        if m == "S":
+            nx, ny, nyaw = x + length * r * math.cos(yaw), y + length * r * math.sin(yaw), yaw
+        else:
+            sign = 1. if m == "L" else -1.
+            c_x, c_y = x - sign * r * math.sin(yaw), y + sign * r * math.cos(yaw)
+            nyaw = yaw + sign * length
+            nx, ny = c_x + sign * r * math.sin(nyaw), c_y - sign * r * math.cos(nyaw)
+        ret.append((m, length * r, (x, y, yaw), (nx, ny, nyaw)))
+        x, y, yaw = nx, ny, nyaw
+    return ret
+
+
+def dubins_path_planning_from_origin(end_x, end_y, end_yaw, curvature: float,
+                                     step_size):
+    dx = end_x
+    dy = end_y
+    D = math.hypot(dx, dy)
+    d = D * curvature
+
+    theta = mod2pi(math.atan2(dy, dx))
+    alpha = mod2pi(- theta)
+    beta = mod2pi(end_yaw - theta)
+
+    lengths, best_mode = _best_word(alpha, beta, d)
 
     x_list, y_list, yaw_list, directions = generate_local_course(sum(lengths),
                                                                  lengths,
@@ -230,6 +267,102 @@ def dubins_path_planning_from_origin(end_x, end_y, end_yaw, curvature: float,
     return x_list, y_list, yaw_list, best_mode, lengths
 
 
+def _mod2pi_array(theta: np.ndarray) -> np.ndarray:
+    return theta - 2.0 * np.pi * np.floor(theta / 2.0 / np.pi)
+
+
+def dubins_path_lengths(s_x, s_y, s_yaw, g_x, g_y, g_yaw, curvature: float) -> np.ndarray:
+    """
+    Length-only Dubins path planner for many poses at once
+
+    Arguments are broadcast against each other like NumPy ufuncs, so (N, 1) starts and (1, M) goals give
+    an (N, M) result. Gives the same value as sum(lengths) of dubins_path_planning(),
+    but no course is sampled. Use dubins_path_planning() when you need to draw the path.
+
+    :param s_x: x positions of start points [m]
+    :param s_y: y positions of start points [m]
+    :param s_yaw: yaw angles of start points [rad]
+    :param g_x: x positions of end points [m]
+    :param g_y: y positions of end points [m]
+    :param g_yaw: yaw angles of end points [rad]
+    :param curvature: curvature for curve [1/m]
+    :return: lengths of the shortest paths [m]
+    """
+    s_x, s_y, s_yaw, g_x, g_y, g_yaw = np.broadcast_arrays(
+        *[np.asarray(a, dtype=np.float64) for a in (s_x, s_y, s_yaw, g_x, g_y, g_yaw)])
+
+    # Same as dubins_path_planning(): goal in the local frame of start.
+    dx = g_x - s_x
+    dy = g_y - s_y
+    c_s = np.cos(s_yaw)
+    s_s = np.sin(s_yaw)
+    end_x = dx * c_s + dy * s_s
+    end_y = - dx * s_s + dy * c_s
+    end_yaw = g_yaw - s_yaw
+
+    d = np.hypot(end_x, end_y) * curvature
+    theta = _mod2pi_array(np.arctan2(end_y, end_x))
+    alpha = _mod2pi_array(- theta)
+    beta = _mod2pi_array(end_yaw - theta)
+
+    sa = np.sin(alpha)
+    sb = np.sin(beta)
+    ca = np.cos(alpha)
+    cb = np.cos(beta)
+    c_ab = np.cos(alpha - beta)
+
+    costs = []
+    with np.errstate(invalid='ignore'):
+        # LSL
+        p_squared = 2 + (d * d) - (2 * c_ab) + (2 * d * (sa - sb))
+        tmp1 = np.arctan2((cb - ca), d + sa - sb)
+        t = _mod2pi_array(- alpha + tmp1)
+        q = _mod2pi_array(beta - tmp1)
+        costs.append(np.where(p_squared < 0, np.inf, t + np.sqrt(p_squared) + q))
+
+        # RSR
+        p_squared = 2 + (d * d) - (2 * c_ab) + (2 * d * (sb - sa))
+        tmp1 = np.arctan2((ca - cb), d - sa + sb)
+        t = _mod2pi_array(alpha - tmp1)
+        q = _mod2pi_array(- beta + tmp1)
+        costs.append(np.where(p_squared < 0, np.inf, t + np.sqrt(p_squared) + q))
+
+        # LSR
+        p_squared = -2 + (d * d) + (2 * c_ab) + (2 * d * (sa + sb))
+        p = np.sqrt(p_squared)
+        tmp2 = np.arctan2((- ca - cb), (d + sa + sb)) - np.arctan2(-2.0, p)
+        t = _mod2pi_array(- alpha + tmp2)
+        q = _mod2pi_array(- _mod2pi_array(beta) + tmp2)
+        costs.append(np.where(p_squared < 0, np.inf, t + p + q))
+
+        # RSL
+        p_squared = (d * d) - 2 + (2 * c_ab) - (2 * d * (sa + sb))
+        p = np.sqrt(p_squared)
+        tmp2 = np.arctan2((ca + cb), (d - sa - sb)) - np.arctan2(2.0, p)
+        t = _mod2pi_array(alpha - tmp2)
+        q = _mod2pi_array(beta - tmp2)
+        costs.append(np.where(p_squared < 0, np.inf, t + p + q))
+
+        # RLR
+        tmp_rlr = (6.0 - d * d + 2.0 * c_ab + 2.0 * d * (sa - sb)) / 8.0
+        p = _mod2pi_array(2 * np.pi - np.arccos(tmp_rlr))
+        t = _mod2pi_array(alpha - np.arctan2(ca - cb, d - sa + sb) + _mod2pi_array(p / 2.0))
+        q = _mod2pi_array(alpha - beta - t + _mod2pi_array(p))
+        costs.append(np.where(np.abs(tmp_rlr) > 1.0, np.inf, t + p + q))
+
+        # LRL
+        tmp_lrl = (6.0 - d * d + 2.0 * c_ab + 2.0 * d * (- sa + sb)) / 8.0
+        p = _mod2pi_array(2 * np.pi - np.arccos(tmp_lrl))
+        t = _mod2pi_array(- alpha - np.arctan2(ca - cb, d + sa - sb) + p / 2.0)
+        q = _mod2pi_array(_mod2pi_array(beta) - alpha - t + _mod2pi_array(p))
+        costs.append(np.where(np.abs(tmp_lrl) > 1.0, np.inf, t + p + q))
+
+    best_cost = np.min(np.stack(costs), axis=0)
+    if not np.all(np.isfinite(best_cost)):
+        raise Exception('Bad code.')
+    return best_cost / curvature
+
+
 def interpolate(ind, length, mode, max_curvature, origin_x, origin_y,
                 origin_yaw, path_x, path_y, path_yaw, directions):
     if mode == "S":
@@ -1,30 +1,36 @@
 import base64
+import functools
+import hashlib
 import importlib
 import json5
 import json
+import pathlib
 import re
+import tempfile
+import time
 from itertools import product
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from enum import Enum, IntEnum, auto
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 import typing as ty
 import zlib
 
 from PIL import Image, ImageDraw, ImageOps, ImageFont
 from PIL.Image import Image as ImageType
 import numpy as np
-from p2ppcb_composer.cmd_common import AN_MAINBOARD
 from route import dubins
-from f360_common import AN_ROW_NAME, AN_SWITCH_DESC, AN_SWITCH_ORIENTATION, CN_INTERNAL, CN_KEY_LOCATORS, CNP_PARTS, BadCodeException, \
-    get_context, key_locator_name, load_kle_by_b64, get_part_info, get_parts_data_path, AN_KEY_PITCH_W, AN_KEY_PITCH_D, FourOrientation, AN_KLE_B64, \
-    CURRENT_DIR, AN_LOCATORS_ENABLED
-from p2ppcb_parts_resolver.resolver import SPN_SWITCH_ANGLE
+from p2ppcb_common import BadCodeException, FourOrientation, key_locator_name
+from p2ppcb_parts_resolver.resolver import SPN_SWITCH_ANGLE, OccurrenceParameter, PartsInfo, SpecsOpsOnPn
+
+# This module is independent of F360 except the F360 adapters, which import F360-dependent modules lazily.
+# Don't import f360_common or p2ppcb_composer at module level.
 
 
 I_CODE0_LABEL = 9
 N_CODES = 3
 N_QMK_LAYER = 4  # VIA supports 4 layers max.
 CURVATURE = 5
+FONT_PATH = pathlib.Path(__file__).parent.parent / 'font/UbuntuMono-R.ttf'
 
 
 ROT_RAD: ty.Dict[FourOrientation, float] = {
@@ -43,6 +49,7 @@ class TerminalDirection(Enum):
 VertexType = ty.Tuple[int, TerminalDirection]
 START: VertexType = (-1, TerminalDirection.Left)
 Line = ty.List[VertexType]
+DistMapType = ty.Dict[ty.Tuple[VertexType, VertexType], float]
 
 
 class RC(IntEnum):
@@ -76,6 +83,7 @@ class Key:
     i_logical_row: int
     i_logical_col: int
     i_kle: int
+    img_filename: str = field(default='', compare=False)  # in part_data/png. Empty in the keys pickled by former versions.
 
 
 KeysOnPinType = ty.Dict[ty.Tuple[int, int], ty.List[Key]]
@@ -168,6 +176,13 @@ def _get_key_angle(k: Key):
     return k.key_location[2] + k.switch_angle
 
 
+def _key_image_id(k: Key) -> ty.Union[str, int]:
+    '''
+    Keys with the same wiring image PNG share the id. Falls back to the identity of Key.img for old keys.
+    '''
+    return k.img_filename if k.img_filename else id(k.img)
+
+
 def _get_absolute_wire_path(key: Key, rc: RC, td: TerminalDirection, is_orig: bool) -> ty.Tuple[float, float, float]:
     wp = key.path[rc][td]
     key_angle = _get_key_angle(key)
@@ -180,107 +195,645 @@ def _get_absolute_wire_path(key: Key, rc: RC, td: TerminalDirection, is_orig: bo
 
 
 def _make_dist_map(keys: ty.List[Key], rc: RC, entry: Entry):
-    dist_map: ty.Dict[ty.Tuple[VertexType, VertexType], float] = {}
-    v = set(range(len(keys)))
-
-    for n, m in product(v, v):
-        if n != m:
-            for otd, dtd in product(TerminalDirection, TerminalDirection):
-                orig_wire_path = _get_absolute_wire_path(keys[n], rc, otd, True)
-                dest_wire_path = _get_absolute_wire_path(keys[m], rc, dtd, False)
-                _, _, _, _, lengths = dubins.dubins_path_planning(orig_wire_path[0], orig_wire_path[1], orig_wire_path[2], dest_wire_path[0], dest_wire_path[1], dest_wire_path[2], CURVATURE)
-                dist_map[(n, otd), (m, dtd)] = sum(lengths)
-
-    for n, td in product(v, TerminalDirection):
-        dest_wire_path = _get_absolute_wire_path(keys[n], rc, td, False)
-        _, _, _, _, lengths = dubins.dubins_path_planning(entry.x, entry.y, entry.angle, dest_wire_path[0], dest_wire_path[1], dest_wire_path[2], CURVATURE)
-        dist_map[START, (n, td)] = sum(lengths)
+    dist_map: DistMapType = {}
+    vs: ty.List[VertexType] = list(product(range(len(keys)), TerminalDirection))
+
+    # Only the lengths are required here. dubins.dubins_path_planning() is for drawing.
+    orig_wire_paths = np.array([_get_absolute_wire_path(keys[n], rc, td, True) for n, td in vs])
+    dest_wire_paths = np.array([_get_absolute_wire_path(keys[n], rc, td, False) for n, td in vs])
+    lengths = dubins.dubins_path_lengths(
+        orig_wire_paths[:, np.newaxis, 0], orig_wire_paths[:, np.newaxis, 1], orig_wire_paths[:, np.newaxis, 2],
+        dest_wire_paths[np.newaxis, :, 0], dest_wire_paths[np.newaxis, :, 1], dest_wire_paths[np.newaxis, :, 2], CURVATURE)
+    for (i, ov), (j, dv) in product(enumerate(vs), enumerate(vs)):
+        if ov[0] != dv[0]:
+            dist_map[ov, dv] = float(lengths[i, j])
+
+    start_lengths = dubins.dubins_path_lengths(
+        entry.x, entry.y, entry.angle, dest_wire_paths[:, 0], dest_wire_paths[:, 1], dest_wire_paths[:, 2], CURVATURE)
+    for j, dv in enumerate(vs):
+        dist_map[START, dv] = float(start_lengths[j])
 
     return dist_map
 
 
-def generate_route(matrix: ty.Dict[str, ty.Dict[str, str]], cable_placements: ty.List[FlatCablePlacement]):
+PinRouteSolver = ty.Callable[[DistMapType, int], Line]
+DP_MAX_KEYS = 12
+
+
+def _opposite(td: TerminalDirection):
+    return TerminalDirection.Left if td == TerminalDirection.Right else TerminalDirection.Right
+
+
+def solve_pin_route_dp(dist_map: DistMapType, n_keys: int) -> Line:
+    '''
+    Exact Held-Karp style dynamic programming over (visited keys, last key, exit terminal direction).
+    Time and memory are O(2^N N^2), so it is for small N only.
+    '''
+    N = n_keys
+    tds = list(TerminalDirection)
+    # Vertex index v = n * 2 + (index of td). Entering v leaves from v ^ 1, the opposite terminal of the key.
+    vs: ty.List[VertexType] = [(n, td) for n, td in product(range(N), tds)]
+    n_v = len(vs)
+    # d[i, j]: from exit vertex i to entry vertex j.
+    d = np.full((n_v, n_v), np.inf)
+    for (i, ov), (j, dv) in product(enumerate(vs), enumerate(vs)):
+        if ov[0] != dv[0]:
+            d[i, j] = dist_map[ov, dv]
+    i_vs = np.arange(n_v)
+    v_bits = 1 << (i_vs // 2)
+
+    # dp[mask, i]: the shortest length which visits the keys of mask and leaves from exit vertex i.
+    dp = np.full((1 << N, n_v), np.inf)
+    parent = np.full((1 << N, n_v), -1, dtype=np.int64)
+    for j, dv in enumerate(vs):
+        dp[v_bits[j], j ^ 1] = dist_map[START, dv]
+
+    for mask in range(1, 1 << N):
+        row = dp[mask]
+        if not np.any(np.isfinite(row)):
+            continue
+        costs = row[:, np.newaxis] + d
+        best_i = np.argmin(costs, axis=0)
+        best = costs[best_i, i_vs]
+        sel = (v_bits & mask) == 0
+        new_masks = mask | v_bits[sel]
+        new_exits = i_vs[sel] ^ 1
+        new_costs = best[sel]
+        better = new_costs < dp[new_masks, new_exits]
+        dp[new_masks[better], new_exits[better]] = new_costs[better]
+        parent[new_masks[better], new_exits[better]] = best_i[sel][better]
+
+    mask = (1 << N) - 1
+    i = int(np.argmin(dp[mask]))
+    if not np.isfinite(dp[mask, i]):
+        raise BadCodeException()
+    line: Line = []
+    while i != -1:
+        line.append(vs[i ^ 1])
+        prev_i = int(parent[mask, i])
+        mask ^= int(v_bits[i])
+        i = prev_i
+    if mask != 0:
+        raise BadCodeException()
+    line.reverse()
+    return line
+
+
+def _solve_pin_route_milp(dist_map: DistMapType, n_keys: int, arcs: ty.Optional[ty.Set[ty.Tuple[VertexType, VertexType]]] = None,
+                          time_limit: ty.Optional[float] = None, initial: ty.Optional[Line] = None) -> ty.Optional[ty.Tuple[Line, bool, ty.Optional[float]]]:
+    '''
+    arcs restricts the arcs between START / terminals. None means all arcs. Arcs to GOAL are always available.
+    initial is a warm start. It should be in arcs.
+    Returns the line, whether it is proven optimal, and the best bound of CBC (None if unknown; only with time_limit).
+    Returns None if the model is infeasible (only with arcs), or no solution is found in time_limit seconds.
+    '''
     import pulp
     from pulp import lpSum
 
+    N = n_keys
+    T = set(range(N))
+    V: ty.Set[VertexType] = {(n, td) for n, td in product(range(N), TerminalDirection)}
+    V_START = V | {START}
+    GOAL: VertexType = (N, TerminalDirection.Left)
+    V_GOAL = V | {GOAL}
+
+    model = pulp.LpProblem(sense=pulp.LpMinimize)
+    # binary variables indicating if arc (i,j) is used on the route or not
+    x = {
+        (i, j): pulp.LpVariable(f'x({i}, {j})', cat=pulp.LpBinary)
+        for i, j in product(V_START, V_GOAL)
+        if i[0] != j[0] and not (i == START and j == GOAL) and (arcs is None or j == GOAL or (i, j) in arcs)
+    }
+
+    # continuous variable to prevent subtours: each terminal will have a
+    # different sequential id in the planned route except the first one
+    y = {n: pulp.LpVariable(f'y({n})', cat=pulp.LpContinuous) for n in T}
+
+    # objective function: minimize the distance
+    model += (
+        lpSum(
+            dist_map[i, j] * x[i, j]
+            for i, j in product(V_START, V)
+            if (i, j) in x
+        )
+    )
+
+    # constraint: cannot use the same direction of a terminal for enter / leave both
+    for v in V:
+        model += (
+            lpSum(
+                x[v, j]
+                for j in V_GOAL
+                if (v, j) in x
+            ) + lpSum(
+                x[i, v]
+                for i in V_START
+                if (i, v) in x
+            ) <= 1
+        )
+
+    # constraint : leave each terminal only once except goal
+    model += (
+        lpSum(x[START, j] for j in V if (START, j) in x) == 1
+    )
+    for n in range(N):
+        model += (
+            lpSum(
+                x[(n, td), j]
+                for td, j in product(TerminalDirection, V_GOAL)
+                if ((n, td), j) in x
+            ) == 1
+        )
+
+    # constraint : enter each terminal only once except start
+    for m in range(N):
+        model += (
+            lpSum(
+                x[i, (m, td)]
+                for td, i in product(TerminalDirection, V_START)
+                if (i, (m, td)) in x
+            ) == 1
+        )
+    model += (
+        lpSum(x[i, GOAL] for i in V) == 1
+    )
+
+    # subtour elimination
+    for (n, m) in product(range(N), range(N)):
+        if n != m:
+            xs = [x[(n, td1), (m, td2)] for td1, td2 in product(TerminalDirection, TerminalDirection) if ((n, td1), (m, td2)) in x]
+            if len(xs) > 0:
+                model += (
+                    y[n] - (N + 1) * lpSum(xs) >= y[m] - N
+                )
+
+    if initial is not None:
+        used = {(START, initial[0]), ((initial[-1][0], _opposite(initial[-1][1])), GOAL)} | \
+            {((v[0], _opposite(v[1])), w) for v, w in zip(initial[:-1], initial[1:])}
+        for a, var in x.items():
+            var.setInitialValue(1 if a in used else 0)
+        for i_line, (n, _) in enumerate(initial):
+            y[n].setInitialValue(N - i_line)
+
+    # optimizing
+    best_bound: ty.Optional[float] = None
+    if time_limit is None and initial is None:
+        model.solve()
+    elif time_limit is None:
+        model.solve(pulp.PULP_CBC_CMD(warmStart=True))
+    else:
+        # PuLP doesn't tell the best bound of a stopped solve. Read it from the log of CBC.
+        with tempfile.TemporaryDirectory() as td:
+            log_path = pathlib.Path(td) / 'cbc.log'
+            model.solve(pulp.PULP_CBC_CMD(timeLimit=time_limit, warmStart=initial is not None, msg=False, logPath=str(log_path)))
+            best_bound = _read_cbc_best_bound(log_path)
+
+    # if model.num_solutions == 0:
+    if model.status != 1:
+        if arcs is not None or time_limit is not None:
+            return None
+        raise BadCodeException()
+    line: Line = []
+    i = START
+    while True:
+        js = [j for j in V_GOAL if (i, j) in x and pulp.value(x[i, j]) >= 0.99]  # type: ignore
+        if len(js) == 0:
+            raise BadCodeException()
+        j = js[0]
+        if j == GOAL:
+            break
+        line.append(j)
+        i = (j[0], _opposite(j[1]))
+    return line, model.sol_status == pulp.LpSolutionOptimal, best_bound
+
+
+_CBC_LOWER_BOUND_REGEX = re.compile(r'^Lower bound:\s*(\S+)\s*$', re.MULTILINE)
+
+
+def _read_cbc_best_bound(log_path: pathlib.Path) -> ty.Optional[float]:
+    try:
+        with open(log_path) as f:
+            m = _CBC_LOWER_BOUND_REGEX.search(f.read())
+        return None if m is None else float(m.group(1))
+    except (OSError, ValueError):
+        return None
+
+
+def solve_pin_route_milp(dist_map: DistMapType, n_keys: int) -> Line:
+    ret = _solve_pin_route_milp(dist_map, n_keys)
+    if ret is None:
+        raise BadCodeException()
+    return ret[0]
+
+
+def pin_route_length(dist_map: DistMapType, line: Line) -> float:
+    ret = dist_map[START, line[0]]
+    for v, w in zip(line[:-1], line[1:]):
+        ret += dist_map[(v[0], _opposite(v[1])), w]
+    return ret
+
+
+def pin_route_lower_bound(dist_map: DistMapType, n_keys: int) -> float:
+    '''
+    Each key is entered exactly once, so the sum of the shortest arcs into each key is a lower bound.
+    '''
+    min_in = [np.inf] * n_keys
+    for (_, j), d in dist_map.items():
+        if d < min_in[j[0]]:
+            min_in[j[0]] = d
+    return float(sum(min_in))
+
+
+SPARSE_K_NEAREST = 4
+GAP_TOLERANCE = 1e-6
+
+
+def _nearest_arcs(dist_map: DistMapType, n_keys: int, k: int):
+    '''
+    Arcs to the k nearest successor keys of each terminal, and from the k nearest predecessor keys of each terminal.
+    Returns the arcs and the arcs at the boundary, i.e. the k-th nearest ones of both sides.
+    '''
+    tds = list(TerminalDirection)
+    vs: ty.List[VertexType] = [(n, td) for n, td in product(range(n_keys), tds)]
+    d = np.full((n_keys * 2, n_keys * 2), np.inf)  # exit vertex, entry vertex
+    for iv, i in enumerate(vs):
+        for jv, j in enumerate(vs):
+            if i[0] != j[0]:
+                d[iv, jv] = dist_map[i, j]
+    d_key = d.reshape(n_keys * 2, n_keys, 2).min(axis=2)  # exit vertex -> key
+    rank_succ = np.argsort(np.argsort(d_key, axis=1), axis=1)  # rank of keys, nearest first. The key itself is the last.
+    d_key_in = d.reshape(n_keys, 2, n_keys * 2).min(axis=1)  # key -> entry vertex
+    rank_pred = np.argsort(np.argsort(d_key_in, axis=0), axis=0)
+
+    arcs: ty.Set[ty.Tuple[VertexType, VertexType]] = {(START, j) for j in vs}
+    boundary: ty.Set[ty.Tuple[VertexType, VertexType]] = set()
+    for iv, i in enumerate(vs):
+        for jv, j in enumerate(vs):
+            if i[0] == j[0]:
+                continue
+            rs = rank_succ[iv, j[0]]
+            rp = rank_pred[i[0], jv]
+            if rs < k or rp < k:
+                arcs.add((i, j))
+                if rs >= k - 1 and rp >= k - 1:
+                    boundary.add((i, j))
+    return arcs, boundary
+
+
+def heuristic_pin_route_milp_sparse(dist_map: DistMapType, n_keys: int, k: int = SPARSE_K_NEAREST) -> Line:
+    '''
+    Heuristic. MILP with the candidate arcs to / from the k nearest keys (by the Dubins distance map) only.
+    Fewer arcs and subtour constraints than solve_pin_route_milp(), so CBC is much faster for large pins.
+    k is doubled while the pruned model is infeasible, or its solution uses the boundary arcs.
+    It ends up with the full model at worst.
+    The result is optimal only if it reaches pin_route_lower_bound() or the full model. Not using the boundary arcs
+    doesn't prove it, because a shorter line can still need an arc outside of the candidates.
+    '''
+    lb = pin_route_lower_bound(dist_map, n_keys)
+    while k < n_keys - 1:
+        arcs, boundary = _nearest_arcs(dist_map, n_keys, k)
+        ret = _solve_pin_route_milp(dist_map, n_keys, arcs)
+        if ret is not None:
+            line = ret[0]
+            if pin_route_length(dist_map, line) <= lb * (1. + GAP_TOLERANCE):
+                return line
+            used = {(START, line[0])} | {((v[0], _opposite(v[1])), w) for v, w in zip(line[:-1], line[1:])}
+            if len(used & boundary) == 0:
+                return line
+        k *= 2
+    return solve_pin_route_milp(dist_map, n_keys)
+
+
+def solve_pin_route(dist_map: DistMapType, n_keys: int, dp_max_keys: int = DP_MAX_KEYS) -> Line:
+    '''
+    The default PinRouteSolver. Exact DP for small pins, MILP (PuLP + CBC) for large pins.
+    '''
+    if n_keys <= dp_max_keys:
+        return solve_pin_route_dp(dist_map, n_keys)
+    return solve_pin_route_milp(dist_map, n_keys)
+
+
+# Their lines are optimal, so the length is the lower bound. The others are heuristic.
+EXACT_PIN_ROUTE_SOLVERS: ty.List[PinRouteSolver] = [solve_pin_route, solve_pin_route_dp, solve_pin_route_milp]
+
+
+def heuristic_pin_route_sparse(dist_map: DistMapType, n_keys: int, dp_max_keys: int = DP_MAX_KEYS) -> Line:
+    '''
+    PinRouteSolver of exact DP for small pins and heuristic_pin_route_milp_sparse() for large pins.
+    For long chains on ergonomic / split layouts. Not guaranteed to be optimal, unlike solve_pin_route().
+    '''
+    if n_keys <= dp_max_keys:
+        return solve_pin_route_dp(dist_map, n_keys)
+    return heuristic_pin_route_milp_sparse(dist_map, n_keys)
+
+
+def heuristic_pin_route(dist_map: DistMapType, n_keys: int) -> Line:
+    '''
+    Nearest neighbour, then 2-opt with terminal flips until no improvement. Not optimal, but fast.
+    Reversing a part of the line flips the terminals of the keys in the part, because the wire goes backward.
+    '''
+    line: Line = []
+    unvisited = set(range(n_keys))
+    i = START
+    while len(unvisited) > 0:
+        j = min(((m, td) for m in sorted(unvisited) for td in TerminalDirection), key=lambda j: dist_map[i, j])
+        line.append(j)
+        unvisited.remove(j[0])
+        i = (j[0], _opposite(j[1]))
+
+    best = pin_route_length(dist_map, line)
+    improved = True
+    while improved:
+        improved = False
+        for a in range(n_keys):
+            for b in range(a, n_keys):  # a == b flips a key.
+                candidate = line[:a] + [(n, _opposite(td)) for n, td in reversed(line[a:b + 1])] + line[b + 1:]
+                length = pin_route_length(dist_map, candidate)
+                if length < best - 1e-9:
+                    line, best, improved = candidate, length, True
+    return line
+
+
+AnytimePinRouteSolver = ty.Callable[[DistMapType, int, ty.Optional[float]], ty.Tuple[Line, ty.Optional[float]]]
+
+
+def solve_pin_route_anytime(dist_map: DistMapType, n_keys: int, time_limit: ty.Optional[float],
+                            dp_max_keys: int = DP_MAX_KEYS) -> ty.Tuple[Line, ty.Optional[float]]:
+    '''
+    The default AnytimePinRouteSolver. Returns the best line found in time_limit seconds and its lower bound.
+    The lower bound is the best bound of CBC when time-limited, or None if CBC doesn't tell it.
+    Exact DP for small pins (fast enough to ignore time_limit). MILP seeded by heuristic_pin_route() for large pins.
+    '''
+    if n_keys <= dp_max_keys:
+        line = solve_pin_route_dp(dist_map, n_keys)
+        return line, pin_route_length(dist_map, line)
+    seed = heuristic_pin_route(dist_map, n_keys)
+    if time_limit is not None and time_limit <= 0.:
+        return seed, None
+    ret = _solve_pin_route_milp(dist_map, n_keys, time_limit=time_limit, initial=seed)
+    if ret is None:
+        return seed, None
+    line, optimal, best_bound = ret
+    length = pin_route_length(dist_map, line)
+    if optimal:
+        return line, length
+    if pin_route_length(dist_map, seed) < length:
+        line, length = seed, pin_route_length(dist_map, seed)
+    # The log rounds the bound.
+    return line, None if best_bound is None else min(best_bound, length)
+
+
+@dataclass
+class RouteTimeBudget:
+    '''
+    In seconds. None is unlimited. The pins after the total limit get heuristic_pin_route() results.
+    '''
+    pin: ty.Optional[float] = None
+    total: ty.Optional[float] = None
+    solver: AnytimePinRouteSolver = solve_pin_route_anytime
+
+
+@dataclass
+class PinRouteStat:
+    rc: RC
+    i_cp: int
+    i_pin: int
+    n_keys: int
+    objective: float  # Wire length in cm.
+    lower_bound: ty.Optional[float]  # None if the solver doesn't tell it.
+    elapsed: float  # In seconds. 0 if cached.
+    cached: bool
+
+    @property
+    def gap(self) -> ty.Optional[float]:
+        if self.lower_bound is None:
+            return None
+        return 0. if self.objective == 0. else max(0., (self.objective - self.lower_bound) / self.objective)
+
+
+def format_pin_route_stats(stats: ty.List[PinRouteStat]) -> str:
+    '''
+    Human-readable summary of route_keys() stats.
+    '''
+    RC_NAME = {RC.Row: 'S', RC.Col: 'D'}
+    lines = []
+    n_not_proven = 0
+    n_unknown = 0
+    for st in stats:
+        gap = st.gap
+        if gap is None:
+            n_unknown += 1
+        elif gap > GAP_TOLERANCE:
+            n_not_proven += 1
+        lb_str = '-' if st.lower_bound is None else f'{st.lower_bound:.3f} cm'
+        gap_str = '-' if gap is None else f'{gap * 100:.1f}%'
+        lines.append(f'{RC_NAME[st.rc]} cable {st.i_cp} pin {st.i_pin}: {st.n_keys} keys, length {st.objective:.3f} cm, '
+                     f'lower bound {lb_str}, gap {gap_str}, {"cached" if st.cached else f"{st.elapsed:.2f} s"}')
+    header = f'{len(stats)} pins, {n_not_proven} not proven optimal, {n_unknown} without lower bound, ' \
+        f'total length {sum(st.objective for st in stats):.3f} cm, {sum(st.elapsed for st in stats):.2f} s'
+    return '\n'.join([header] + lines) + '\n'
+
+
+def _route_pin(rc: RC, keys: ty.List[Key], entry: Entry, solver: PinRouteSolver,
+               time_budget: ty.Optional[RouteTimeBudget] = None, deadline: ty.Optional[float] = None) -> ty.Tuple[Line, float, ty.Optional[float], float]:
+    '''
+    Returns the line, its length, its lower bound (None if unknown), and the elapsed time.
+    deadline is time.time() based, so it works across processes.
+    '''
+    t0 = time.time()
+    dist_map = _make_dist_map(keys, rc, entry)
+    if time_budget is None:
+        line = solver(dist_map, len(keys))
+        lb = pin_route_length(dist_map, line) if solver in EXACT_PIN_ROUTE_SOLVERS else None
+    else:
+        time_limit = time_budget.pin
+        if deadline is not None:
+            remaining = max(0., deadline - time.time())
+            time_limit = remaining if time_limit is None else min(time_limit, remaining)
+        line, lb = time_budget.solver(dist_map, len(keys), time_limit)
+    return line, pin_route_length(dist_map, line), lb, time.time() - t0
+
+
+ROUTE_CACHE_FILENAME = 'route_cache.json'
+ROUTE_CACHE_MAX_ENTRIES = 4096
+ROUTE_CACHE_DIGITS = 6  # Poses are rounded to 1e-6 cm / rad.
+
+
+def pin_route_hash(rc: RC, keys: ty.List[Key], entry: Entry, solver: PinRouteSolver) -> str:
+    '''
+    Stable hash of a pin subproblem. Line is made of indices of keys, so the order of keys matters.
+    '''
+    def _r(v: float):
+        return round(float(v), ROUTE_CACHE_DIGITS) + 0.  # + 0. removes -0.
+
+    poses = [[_r(v) for v in _get_absolute_wire_path(k, rc, td, False)] for k, td in product(keys, TerminalDirection)]
+    solver_name = getattr(solver, '__module__', '') + '.' + getattr(solver, '__qualname__', repr(solver))
+    src = json.dumps([[_r(entry.x), _r(entry.y), _r(entry.angle)], poses, CURVATURE, solver_name])
+    return hashlib.sha256(src.encode('utf-8')).hexdigest()
+
+
+class RouteCache:
+    '''
+    On-disk cache of solved Lines keyed by pin_route_hash(). Evicts least recently used entries beyond max_entries.
+    Call save() to write back.
+    '''
+    def __init__(self, path: pathlib.Path, max_entries: int = ROUTE_CACHE_MAX_ENTRIES) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.entries: ty.OrderedDict[str, ty.List[ty.List]] = OrderedDict()  # Oldest first.
+        if path.is_file():
+            # Broken cache is just a cache miss.
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = None
+            if isinstance(data, dict):
+                self.entries.update(data)
+
+    def get(self, key: str) -> ty.Optional[Line]:
+        if key not in self.entries:
+            return None
+        try:
+            line = [(int(n), TerminalDirection[td]) for n, td in self.entries[key]]
+        except (TypeError, ValueError, KeyError):
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return line
+
+    def put(self, key: str, line: Line):
+        self.entries[key] = [[n, td.name] for n, td in line]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        tmp_path.replace(self.path)
+
+
+@dataclass
+class KeySwitch:
+    switch_desc: str
+    switch_orientation: FourOrientation
+
+
+KleResolution = ty.Tuple[SpecsOpsOnPn, ty.Tuple[float, float], ty.Tuple[float, float]]
+
+
+def resolve_kle_json(kle_json: bytes, pi: PartsInfo) -> KleResolution:
+    '''
+    Resolves KLE JSON content without key images. Routing doesn't require them.
+    '''
+    import tempfile
+    with tempfile.TemporaryDirectory() as d:
+        fp = pathlib.Path(d) / 'temp.json'
+        with open(fp, 'wb') as f:
+            f.write(kle_json)
+        return pi.resolve_kle(fp, None)
+
+
+@functools.lru_cache(maxsize=None)
+def load_wiring_image(path: pathlib.Path) -> ImageType:
+    '''
+    Process-wide cache. Don't modify the returned image.
+    '''
+    img = Image.open(str(path))
+    img.load()  # Releases the file.
+    return img
+
+
+def route_keys(kle_resolution: KleResolution, matrix: ty.Dict[str, ty.Dict[str, str]], key_switches: ty.Dict[str, KeySwitch],
+               pitch_wd: ty.Tuple[float, float], cable_placements: ty.List[FlatCablePlacement], pi: PartsInfo,
+               solver: PinRouteSolver = solve_pin_route, max_workers: ty.Optional[int] = 1, route_cache: ty.Optional[RouteCache] = None,
+               time_budget: ty.Optional[RouteTimeBudget] = None, stats: ty.Optional[ty.List[PinRouteStat]] = None):
+    '''
+    F360-independent core of generate_route(). key_switches is keyed by key locator name.
+    Keys without KeySwitch are disabled. pitch_wd is in cm.
+
+    Each (RC, cable, pin) route is independent. max_workers > 1 or None (as many as CPU cores) solves them in a process pool.
+    solver should be picklable in the case. Keep max_workers 1 in F360 because sys.executable of its embedded Python is not a Python interpreter.
+
+    If route_cache is given, pins solved before are taken from it, and newly solved pins are put and saved.
+
+    If time_budget is given, time_budget.solver is used instead of solver, and the routing ends in bounded time.
+    Only proven optimal lines are put to route_cache in the case.
+    If stats is given, PinRouteStat of each pin is appended. See format_pin_route_stats().
+    '''
     reverse_matrix: ty.Dict[str, ty.Tuple[str, str]] = {}
     for row_name, col_dic in matrix.items():
         for col_name, kl_name in col_dic.items():
             reverse_matrix[kl_name] = (row_name, col_name)
 
-    con = get_context()
-    inl_occ = con.child[CN_INTERNAL]
-    locators_occ = inl_occ.child[CN_KEY_LOCATORS]
-    part_data_path = get_parts_data_path()
-    pi = get_part_info()
-    kle_b64 = con.child[CN_INTERNAL].comp_attr[AN_KLE_B64]
-    specs_ops_on_pn, min_xyu, max_xyu = load_kle_by_b64(kle_b64, pi)
-    pitch_w = float(inl_occ.comp_attr[AN_KEY_PITCH_W])
-    pitch_d = float(inl_occ.comp_attr[AN_KEY_PITCH_D])
+    part_data_path = pi.parts_info_dir.parent
+    specs_ops_on_pn, min_xyu, max_xyu = kle_resolution
+    pitch_w, pitch_d = pitch_wd
     keys_row: KeysOnPinType = defaultdict(list)
     keys_col: KeysOnPinType = defaultdict(list)
-    image_cache = {}
+    enabled_keys: ty.List[ty.Tuple[OccurrenceParameter, KeySwitch, str, str]] = []
+    wiring_requests: ty.List[ty.Tuple[str, str]] = []
     for pattern_name, specs_ops in specs_ops_on_pn.items():
         for i, (specifier, op) in enumerate(specs_ops):
             if op is None:
                 raise BadCodeException()
             kl_name = key_locator_name(i, pattern_name)
-            kl_occ = locators_occ.child[kl_name]
-            if not bool(kl_occ.comp_attr[AN_LOCATORS_ENABLED]):
+            if kl_name not in key_switches:
                 continue
-            switch_desc = kl_occ.comp_attr[AN_SWITCH_DESC]
-            codes = op.legend[I_CODE0_LABEL:I_CODE0_LABEL + N_CODES]
-            if kl_occ.comp_attr[AN_ROW_NAME].startswith('LED'):
+            key_switch = key_switches[kl_name]
+            row_name, col_name = reverse_matrix[kl_name]
+            if row_name.startswith('LED'):
                 specifier += ' LED'
-            filename, wiring_parameters = pi.resolve_pcb_wiring(specifier, switch_desc)
-            switch_orientation = FourOrientation[kl_occ.comp_attr[AN_SWITCH_ORIENTATION]]
-            wp = {k: v.m_as('rad') if k.endswith('Angle') else v.m_as('cm') for k, v in wiring_parameters.items()}
-            switch_angle = ROT_RAD[switch_orientation] + wp[SPN_SWITCH_ANGLE]
-            if filename in image_cache:
-                img = image_cache[filename]
-            else:
-                img = Image.open(str(part_data_path / ('png/' + filename)))
-                image_cache[filename] = img
-            switch_path: SwitchPath = {
-                RC.Col: {
-                    TerminalDirection.Right: (wp['Col_R_X'], wp['Col_R_Y'], wp['Col_R_Angle']),
-                    TerminalDirection.Left: (wp['Col_L_X'], wp['Col_L_Y'], wp['Col_L_Angle']),
-                },
-                RC.Row: {
-                    TerminalDirection.Right: (wp['Row_R_X'], wp['Row_R_Y'], wp['Row_R_Angle']),
-                    TerminalDirection.Left: (wp['Row_L_X'], wp['Row_L_Y'], wp['Row_L_Angle']),
-                }
+            enabled_keys.append((op, key_switch, row_name, col_name))
+            wiring_requests.append((specifier, key_switch.switch_desc))
+    # Many keys share a specifier and a switch.
+    for (op, key_switch, row_name, col_name), (filename, wp) in zip(enabled_keys, pi.resolve_pcb_wiring_many(wiring_requests, True)):
+        codes = op.legend[I_CODE0_LABEL:I_CODE0_LABEL + N_CODES]
+        switch_angle = ROT_RAD[key_switch.switch_orientation] + wp[SPN_SWITCH_ANGLE]
+        img = load_wiring_image(part_data_path / ('png/' + filename))
+        switch_path: SwitchPath = {
+            RC.Col: {
+                TerminalDirection.Right: (wp['Col_R_X'], wp['Col_R_Y'], wp['Col_R_Angle']),
+                TerminalDirection.Left: (wp['Col_L_X'], wp['Col_L_Y'], wp['Col_L_Angle']),
+            },
+            RC.Row: {
+                TerminalDirection.Right: (wp['Row_R_X'], wp['Row_R_Y'], wp['Row_R_Angle']),
+                TerminalDirection.Left: (wp['Row_L_X'], wp['Row_L_Y'], wp['Row_L_Angle']),
             }
-            row_name, col_name = reverse_matrix[kl_name]
-            i_pin_row = None
-            i_logical_row = None
-            i_pin_col = None
-            i_logical_col = None
-            i_cp_row = -1
-            i_cp_col = -1
-            for i, cp in enumerate(cable_placements):
-                if i_pin_row is None:
-                    i_pin_row = cp.cable.get_pin_number(row_name, RC.Row)
-                    i_cp_row = i
-                if i_logical_row is None:
-                    i_logical_row = cp.cable.get_logical_number(row_name, RC.Row)
-                if i_pin_col is None:
-                    i_pin_col = cp.cable.get_pin_number(col_name, RC.Col)
-                    i_cp_col = i
-                if i_logical_col is None:
-                    i_logical_col = cp.cable.get_logical_number(col_name, RC.Col)
-            if i_pin_row is None or i_pin_col is None or i_logical_row is None or i_logical_col is None or i_cp_row == -1 or i_cp_col == -1:
-                raise BadCodeException()
-            k = Key((op.center_xyu[0] * pitch_w, op.center_xyu[1] * pitch_d, np.deg2rad(-op.angle)), switch_angle, switch_path,
-                    img,  # type: ignore
-                    codes, i_pin_row, i_pin_col, i_logical_row, i_logical_col, op.i_kle)
-            keys_row[i_cp_row, i_pin_row].append(k)
-            keys_col[i_cp_col, i_pin_col].append(k)
+        }
+        i_pin_row = None
+        i_logical_row = None
+        i_pin_col = None
+        i_logical_col = None
+        i_cp_row = -1
+        i_cp_col = -1
+        for i, cp in enumerate(cable_placements):
+            if i_pin_row is None:
+                i_pin_row = cp.cable.get_pin_number(row_name, RC.Row)
+                i_cp_row = i
+            if i_logical_row is None:
+                i_logical_row = cp.cable.get_logical_number(row_name, RC.Row)
+            if i_pin_col is None:
+                i_pin_col = cp.cable.get_pin_number(col_name, RC.Col)
+                i_cp_col = i
+            if i_logical_col is None:
+                i_logical_col = cp.cable.get_logical_number(col_name, RC.Col)
+        if i_pin_row is None or i_pin_col is None or i_logical_row is None or i_logical_col is None or i_cp_row == -1 or i_cp_col == -1:
+            raise BadCodeException()
+        k = Key((op.center_xyu[0] * pitch_w, op.center_xyu[1] * pitch_d, np.deg2rad(-op.angle)), switch_angle, switch_path,
+                img,  # type: ignore
+                codes, i_pin_row, i_pin_col, i_logical_row, i_logical_col, op.i_kle, filename)
+        keys_row[i_cp_row, i_pin_row].append(k)
+        keys_col[i_cp_col, i_pin_col].append(k)
 
     keys_rc: ty.Dict[RC, KeysOnPinType] = {RC.Row: keys_row, RC.Col: keys_col}
     route_rccp: ty.Dict[RC_CP, ty.Dict[int, Line]] = defaultdict(dict)
     entries_rccp: ty.Dict[RC_CP, ty.Dict[int, Entry]] = {}
     center_xy = ((min_xyu[0] + max_xyu[0]) * pitch_w / 2, (min_xyu[1] + max_xyu[1]) * pitch_d / 2)
+    pin_routes: ty.List[ty.Tuple[RC, int, int, ty.List[Key], Entry]] = []
     for rc, (i_cp, cp) in product(RC, enumerate(cable_placements)):
         entries = cp.cable.get_entries(cp.angle, cp.start, center_xy, rc, cp.flip)
         if len(entries) == 0:
@@ -290,114 +843,100 @@ def generate_route(matrix: ty.Dict[str, ty.Dict[str, str]], cable_placements: ty
             keys = keys_rc[rc][(i_cp, i_pin)]
             if len(keys) == 0:
                 continue
-            dist_map = _make_dist_map(keys, rc, entry)
-            N = len(keys)
-            T = set(range(N))
-            V: ty.Set[VertexType] = {(n, td) for n, td in product(range(N), TerminalDirection)}
-            V_START = V | {START}
-            GOAL: VertexType = (N, TerminalDirection.Left)
-            V_GOAL = V | {GOAL}
-
-            model = pulp.LpProblem(sense=pulp.LpMinimize)
-            # binary variables indicating if arc (i,j) is used on the route or not
-            x = {
-                (i, j): pulp.LpVariable(f'x({i}, {j})', cat=pulp.LpBinary)
-                for i, j in product(V_START, V_GOAL)
-                if i[0] != j[0] and not (i == START and j == GOAL)
-            }
-
-            # continuous variable to prevent subtours: each terminal will have a
-            # different sequential id in the planned route except the first one
-            y = {n: pulp.LpVariable(f'y({n})', cat=pulp.LpContinuous) for n in T}
-
-            # objective function: minimize the distance
-            model += (
-                lpSum(
-                    dist_map[i, j] * x[i, j]
-                    for i, j in product(V_START, V)
-                    if i[0] != j[0]
-                )
-            )
-
-            # constraint: cannot use the same direction of a terminal for enter / leave both
-            for v in V:
-                model += (
-                    lpSum(
-                        x[v, j]
-                        for j in V_GOAL
-                        if j[0] != v[0]
-                    ) + lpSum(
-                        x[i, v]
-                        for i in V_START
-                        if i[0] != v[0]
-                    ) <= 1
-                )
-
-            # constraint : leave each terminal only once except goal
-            model += (
-                lpSum(x[START, j] for j in V) == 1
-            )
-            for n in range(N):
-                model += (
-                    lpSum(
-                        x[(n, td), j]
-                        for td, j in product(TerminalDirection, V_GOAL)
-                        if n != j[0]
-                    ) == 1
-                )
-
-            # constraint : enter each terminal only once except start
-            for m in range(N):
-                model += (
-                    lpSum(
-                        x[i, (m, td)]
-                        for td, i in product(TerminalDirection, V_START)
-                        if m != i[0]
-                    ) == 1
-                )
-            model += (
-                lpSum(x[i, GOAL] for i in V) == 1
-            )
-
-            # subtour elimination
-            for (n, m) in product(range(N), range(N)):
-                if n != m:
-                    model += (
-                        y[n] - (N + 1) * lpSum(
-                            x[(n, td1), (m, td2)]
-                            for td1, td2 in product(TerminalDirection, TerminalDirection)
-                        ) >= y[m] - N
-                    )
-
-            # optimizing
-            model.solve()
-
-            # if model.num_solutions == 0:
-            if model.status != 1:
-                raise BadCodeException()
-            line: Line = []
-            i = START
-            while True:
-                js = [j for j in V_GOAL if (i, j) in x and pulp.value(x[i, j]) >= 0.99]  # type: ignore
-                if len(js) == 0:
-                    raise BadCodeException()
-                j = js[0]
-                if j == GOAL:
-                    break
-                line.append(j)
-                i = (j[0], TerminalDirection.Left if j[1] == TerminalDirection.Right else TerminalDirection.Right)
-            route_rccp[rc, i_cp][i_pin] = line
+            pin_routes.append((rc, i_cp, i_pin, keys, entry))
+
+    cache_keys: ty.List[str] = []
+    cached_lines: ty.List[ty.Optional[Line]] = [None] * len(pin_routes)
+    if route_cache is not None:
+        cache_solver = solver if time_budget is None else time_budget.solver
+        cache_keys = [pin_route_hash(rc, keys, entry, cache_solver) for rc, _, _, keys, entry in pin_routes]
+        cached_lines = [route_cache.get(ck) for ck in cache_keys]
+    to_solve = [pr for pr, cl in zip(pin_routes, cached_lines) if cl is None]
+
+    deadline = None if time_budget is None or time_budget.total is None else time.time() + time_budget.total
+    if max_workers == 1 or len(to_solve) <= 1:
+        results = [_route_pin(rc, keys, entry, solver, time_budget, deadline) for rc, _, _, keys, entry in to_solve]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        # Key.img is not required to route. Pickling it for each pin is a waste.
+        with ProcessPoolExecutor(max_workers) as executor:
+            results = list(executor.map(
+                _route_pin,
+                [rc for rc, _, _, _, _ in to_solve],
+                [[replace(k, img=None) for k in keys] for _, _, _, keys, _ in to_solve],
+                [entry for _, _, _, _, entry in to_solve],
+                [solver] * len(to_solve),
+                [time_budget] * len(to_solve),
+                [deadline] * len(to_solve)))
+    # executor.map() keeps the order, so the result is the same as serial.
+    i_solved = 0
+    for i, ((rc, i_cp, i_pin, keys, entry), cl) in enumerate(zip(pin_routes, cached_lines)):
+        if cl is None:
+            line, length, lb, elapsed = results[i_solved]
+            i_solved += 1
+            proven = time_budget is None or (lb is not None and lb >= length * (1. - GAP_TOLERANCE))
+            if route_cache is not None and proven:
+                route_cache.put(cache_keys[i], line)
+        else:
+            line = cl
+            elapsed = 0.
+            length = pin_route_length(_make_dist_map(keys, rc, entry), line) if stats is not None else 0.
+            # Only proven lines are cached with time_budget.
+            lb = length if time_budget is not None or solver in EXACT_PIN_ROUTE_SOLVERS else None
+        route_rccp[rc, i_cp][i_pin] = line
+        if stats is not None:
+            stats.append(PinRouteStat(rc, i_cp, i_pin, len(keys), length, lb, elapsed, cl is not None))
+    if route_cache is not None and len(to_solve) > 0:
+        route_cache.save()
 
     return keys_rc, entries_rccp, route_rccp
 
 
-def draw_wire(keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP, ty.Dict[int, Entry]], route_rccp: ty.Dict[RC_CP, ty.Dict[int, Line]], cable_placements: ty.List[FlatCablePlacement]):
-    MAG = 200
-    MARGIN = 200
-    FONT_SIZE = 30
-    WIRE_TABLE_ROW = 400
-    WIRE_TABLE_PITCH = 100
-    WIRE_TABLE_MARGIN = 100
+def generate_route(matrix: ty.Dict[str, ty.Dict[str, str]], cable_placements: ty.List[FlatCablePlacement], solver: PinRouteSolver = solve_pin_route,
+                   use_route_cache: bool = True, time_budget: ty.Optional[RouteTimeBudget] = None, stats: ty.Optional[ty.List[PinRouteStat]] = None):
+    '''
+    F360 adapter of route_keys(). Reads the KLE, key pitches and key locators from the context.
+    The route cache is in the tmp directory of the add-in.
+    '''
+    from f360_common import AN_SWITCH_DESC, AN_SWITCH_ORIENTATION, CN_INTERNAL, CN_KEY_LOCATORS, AN_KEY_PITCH_W, AN_KEY_PITCH_D, AN_KLE_B64, \
+        AN_LOCATORS_ENABLED, get_context, load_kle_by_b64, get_part_info, prepare_tmp_dir
+
+    con = get_context()
+    inl_occ = con.child[CN_INTERNAL]
+    locators_occ = inl_occ.child[CN_KEY_LOCATORS]
+    pi = get_part_info()
+    kle_resolution = load_kle_by_b64(inl_occ.comp_attr[AN_KLE_B64], pi)
+    key_switches: ty.Dict[str, KeySwitch] = {}
+    specs_ops_on_pn, _, _ = kle_resolution
+    for pattern_name, specs_ops in specs_ops_on_pn.items():
+        for i in range(len(specs_ops)):
+            kl_name = key_locator_name(i, pattern_name)
+            kl_occ = locators_occ.child[kl_name]
+            if not bool(kl_occ.comp_attr[AN_LOCATORS_ENABLED]):
+                continue
+            key_switches[kl_name] = KeySwitch(kl_occ.comp_attr[AN_SWITCH_DESC], FourOrientation[kl_occ.comp_attr[AN_SWITCH_ORIENTATION]])
+    pitch_wd = (float(inl_occ.comp_attr[AN_KEY_PITCH_W]), float(inl_occ.comp_attr[AN_KEY_PITCH_D]))
+    route_cache = RouteCache(prepare_tmp_dir() / ROUTE_CACHE_FILENAME) if use_route_cache else None
+    return route_keys(kle_resolution, matrix, key_switches, pitch_wd, cable_placements, pi, solver, route_cache=route_cache, time_budget=time_budget, stats=stats)
+
+
+# Wiring diagrams. Lengths are in px.
+DIAGRAM_MAG = 200  # px / cm
+DIAGRAM_MARGIN = 200
+DIAGRAM_FONT_SIZE = 30
+WIRE_TABLE_ROW = 400
+WIRE_TABLE_PITCH = 100
+WIRE_TABLE_MARGIN = 100
+RAINBOW_CABLE_COLORS = ['black', 'brown', 'red', 'orange', 'yellow', 'green', 'blue', 'violet', 'grey', 'white']
+
+
+def draw_wire(keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP, ty.Dict[int, Entry]], route_rccp: ty.Dict[RC_CP, ty.Dict[int, Line]], cable_placements: ty.List[FlatCablePlacement],
+              mbc: ty.Optional['MainboardConstants'] = None):
+    '''
+    mbc is read from the F360 context if None.
+    '''
+    if mbc is None:
+        mbc = get_mainboard_constants()
     xs: ty.Set[float] = set()
     ys: ty.Set[float] = set()
     wires_pn_rc: ty.Dict[RC, ty.Dict[int, ty.List[ty.Tuple[ty.List[ty.Tuple[float, float]], int]]]] = {RC.Col: {}, RC.Row: {}}
@@ -421,8 +960,7 @@ def draw_wire(keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP,
     size = np.array([max(xs) - min(xs) + 1, max(ys) - min(ys) + 1])
     offset = np.array([min(xs), min(ys)])
 
-    rainbow_cable_colors = [s for s in ['black', 'brown', 'red', 'orange', 'yellow', 'green', 'blue', 'violet', 'grey', 'white']]
-    font = ImageFont.truetype(str(CURRENT_DIR / 'font/UbuntuMono-R.ttf'), FONT_SIZE)
+    font = ImageFont.truetype(str(FONT_PATH), DIAGRAM_FONT_SIZE)
     wire_pitch_pnrc: ty.Dict[ty.Tuple[int, RC], float] = {}
     i_cp_pnrc: ty.Dict[ty.Tuple[int, RC], int] = {}
     for (rc, i_cp), entries in entries_rccp.items():
@@ -437,12 +975,26 @@ def draw_wire(keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP,
     wire_table_width = WIRE_TABLE_PITCH * (max([
         max([en.pin_number for en in entries.values()])
         for entries in entries_rccp.values()
-    ]) + 1) + MARGIN * 2
+    ]) + 1) + DIAGRAM_MARGIN * 2
 
     def _width(pn, rc, bold_rc):
-        return int(wire_pitch_pnrc[pn, rc] * MAG) - 8 if bold_rc == rc else 3, int(wire_pitch_pnrc[pn, rc] * MAG) if bold_rc == rc else 7
+        return int(wire_pitch_pnrc[pn, rc] * DIAGRAM_MAG) - 8 if bold_rc == rc else 3, int(wire_pitch_pnrc[pn, rc] * DIAGRAM_MAG) if bold_rc == rc else 7
+
+    # The key layer is common. Rotated key images are memoized because many keys share the same image and angle.
+    key_layer = Image.new('RGB', (int(size[0] * DIAGRAM_MAG) + DIAGRAM_MARGIN * 2, int(size[1] * DIAGRAM_MAG) + DIAGRAM_MARGIN * 2), (255, ) * 3)  # type: ignore
+    rotated_images: ty.Dict[ty.Tuple[ty.Union[str, int], float], ImageType] = {}
+    for ks in keys_rc[RC.Row].values():
+        for k in ks:
+            angle = float(np.rad2deg(_get_key_angle(k)))
+            rik = (_key_image_id(k), round(angle, 6))
+            if rik not in rotated_images:
+                rotated_images[rik] = k.img.rotate(angle, expand=True)  # type: ignore
+            k_img = rotated_images[rik]
+            k_img_size = np.array(k_img.size)
+            key_layer.paste(k_img, tuple((np.array(k.key_location[:2] - offset) * DIAGRAM_MAG - k_img_size / 2 + DIAGRAM_MARGIN).astype(int)), mask=k_img)  # type: ignore
+    rotated_images.clear()
 
-    def _draw_selective(bold_rc: RC, rcs: ty.List[RC]):
+    def _draw_selective(bold_rc: RC, rcs: ty.List[RC], img: ImageType):
         img_wt = Image.new('RGB', (wire_table_width, wire_table_height), (255, ) * 3)  # type: ignore
         draw_wt = ImageDraw.Draw(img_wt)
         for (rc, i_cp), entries in entries_rccp.items():
@@ -452,60 +1004,52 @@ def draw_wire(keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP,
             for i_pin, _ in route_rccp[rc, i_cp].items():
                 pn = entries[i_pin].pin_number
                 wt_y = i_cp_pnrc[pn, rc] * WIRE_TABLE_ROW
-                color = rainbow_cable_colors[(pn + 1) % 10]  # Wire number always starts from 1.
+                color = RAINBOW_CABLE_COLORS[(pn + 1) % 10]  # Wire number always starts from 1.
                 border_color = 'black' if color == 'grey' else 'grey'
                 width, border_width = _width(pn, rc, bold_rc)
                 draw_wt.line(
                     (
-                        (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_MARGIN + FONT_SIZE + 7),
-                        (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_ROW - WIRE_TABLE_MARGIN - FONT_SIZE - 7)),
+                        (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_MARGIN + DIAGRAM_FONT_SIZE + 7),
+                        (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_ROW - WIRE_TABLE_MARGIN - DIAGRAM_FONT_SIZE - 7)),
                     border_color, width=border_width)  # type: ignore
                 draw_wt.line(
                     (
-                        (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_MARGIN + FONT_SIZE + 7),
-                        (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_ROW - WIRE_TABLE_MARGIN - FONT_SIZE - 7)),
+                        (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_MARGIN + DIAGRAM_FONT_SIZE + 7),
+                        (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_ROW - WIRE_TABLE_MARGIN - DIAGRAM_FONT_SIZE - 7)),
                     color, width=width)  # type: ignore
                 draw_wt.text(
                     (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_MARGIN),
                     str(pn + 1),
                     fill='black', font=font, anchor='mt', stroke_width=2, stroke_fill='white'
                 )
-                for wn in get_mainboard_constants().wire_names_rc[rc]:
+                for wn in mbc.wire_names_rc[rc]:
                     if cp.cable.get_pin_number(wn, rc) == pn:
                         draw_wt.text(
-                            (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_ROW - WIRE_TABLE_MARGIN - FONT_SIZE),
+                            (WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn, wt_y + WIRE_TABLE_ROW - WIRE_TABLE_MARGIN - DIAGRAM_FONT_SIZE),
                             str(wn),
                             fill='black', font=font, anchor='mt', stroke_width=2, stroke_fill='white'
                         )
                         break
         img_wt = img_wt.crop(ImageOps.invert(img_wt).getbbox())
 
-        img = Image.new('RGB', (int(size[0] * MAG) + MARGIN * 2, int(size[1] * MAG) + MARGIN * 2), (255, ) * 3)  # type: ignore
-        keys: ty.List[Key] = []
-        for ks in keys_rc[RC.Row].values():
-            keys.extend(ks)
-        for k in keys:
-            k_img = k.img.rotate(np.rad2deg(_get_key_angle(k)), expand=True)  # type: ignore
-            k_img_size = np.array(k_img.size)
-            img.paste(k_img, tuple((np.array(k.key_location[:2] - offset) * MAG - k_img_size / 2 + MARGIN).astype(int)), mask=k_img)  # type: ignore
         draw = ImageDraw.Draw(img)
         for rc in rcs:
             for pn, wires in wires_pn_rc[rc].items():
                 last_loc = None
-                color = rainbow_cable_colors[(pn + 1) % 10]
+                color = RAINBOW_CABLE_COLORS[(pn + 1) % 10]
                 border_color = 'black' if color == 'grey' else 'grey'
                 for wire in wires:
-                    locs = (np.array(wire[0] - offset) * MAG).astype(int)
+                    locs = (np.array(wire[0] - offset) * DIAGRAM_MAG).astype(int)
                     if last_loc is None:
                         pass
                     else:
-                        draw.line((tuple(last_loc + MARGIN), tuple(locs[0] + MARGIN)), 'black', width=7)  # type: ignore
-                        draw.line((tuple(last_loc + MARGIN), tuple(locs[0] + MARGIN)), color, width=3)  # type: ignore
+                        draw.line((tuple(last_loc + DIAGRAM_MARGIN), tuple(locs[0] + DIAGRAM_MARGIN)), 'black', width=7)  # type: ignore
+                        draw.line((tuple(last_loc + DIAGRAM_MARGIN), tuple(locs[0] + DIAGRAM_MARGIN)), color, width=3)  # type: ignore
                     last_loc = locs[-1]
                     if len(locs) > 1:
                         width, border_width = _width(pn, rc, bold_rc)
-                        draw.line(tuple(tuple(i) for i in (locs + MARGIN).tolist()), border_color, width=border_width, joint='curve')  # type: ignore
-                        draw.line(tuple(tuple(i) for i in (locs + MARGIN).tolist()), color, width=width, joint='curve')  # type: ignore
+                        draw.line(tuple(tuple(i) for i in (locs + DIAGRAM_MARGIN).tolist()), border_color, width=border_width, joint='curve')  # type: ignore
+                        draw.line(tuple(tuple(i) for i in (locs + DIAGRAM_MARGIN).tolist()), color, width=width, joint='curve')  # type: ignore
         img = ImageOps.mirror(img)
         img_w = img.size[0]
         draw = ImageDraw.Draw(img)
@@ -521,7 +1065,7 @@ def draw_wire(keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP,
                 last_pn = pn1
                 last_printed = True
                 wire = wires[0]
-                locs = (np.array(wire[0] - offset) * MAG).astype(int)
+                locs = (np.array(wire[0] - offset) * DIAGRAM_MAG).astype(int)
                 bbox = draw.textbbox((0, 0), str(pn1), font=font)
                 legend_w = int(bbox[2] - bbox[0])
                 legend_h = int(bbox[3] - bbox[1])
@@ -537,7 +1081,7 @@ def draw_wire(keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP,
                         legend_offset = [-legend_w // 2, -legend_h]
                     else:
                         legend_offset = [-legend_w // 2, 0]
-                mirrored_xy = locs[0] + MARGIN
+                mirrored_xy = locs[0] + DIAGRAM_MARGIN
                 draw.multiline_text((img_w - mirrored_xy[0] + legend_offset[0], mirrored_xy[1] + legend_offset[1]), str(pn1), fill='black', font=font,
                                     stroke_width=2, stroke_fill='white')
         img = img.crop(ImageOps.invert(img).getbbox())
@@ -546,7 +1090,206 @@ def draw_wire(keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP,
         ret.paste(img_wt, (0, img.size[1] + WIRE_TABLE_MARGIN))
         return ret
 
-    return _draw_selective(RC.Row, [RC.Col, RC.Row]), _draw_selective(RC.Col, [RC.Row, RC.Col])
+    img_row = _draw_selective(RC.Row, [RC.Col, RC.Row], key_layer.copy())
+    # The last one can draw on the key layer itself.
+    return img_row, _draw_selective(RC.Col, [RC.Row, RC.Col], key_layer)
+
+
+def _svg_num(v: float) -> str:
+    return f'{v:.2f}'.rstrip('0').rstrip('.')
+
+
+def write_wire_svg(path: pathlib.Path, bold_rc: RC, keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP, ty.Dict[int, Entry]],
+                   route_rccp: ty.Dict[RC_CP, ty.Dict[int, Line]], cable_placements: ty.List[FlatCablePlacement], mbc: ty.Optional['MainboardConstants'] = None):
+    '''
+    Vector version of draw_wire(). Writes the diagram of bold_rc (RC.Row: S, RC.Col: D) as SVG.
+    Dubins arcs are SVG arcs. Each key image is embedded once. Elements are streamed to the file.
+    The coordinates are the same px as draw_wire(), and the physical size is in cm.
+    '''
+    import base64 as b64
+    from io import BytesIO
+    from xml.sax.saxutils import escape
+
+    if mbc is None:
+        mbc = get_mainboard_constants()
+    n = _svg_num
+    radius = DIAGRAM_MAG / CURVATURE
+
+    # Each wire is (segments, start pose). The last one has no segments: the start is the exit terminal of the last key.
+    wires_pn_rc: ty.Dict[RC, ty.Dict[int, ty.List[ty.Tuple[ty.List, ty.Tuple[float, float, float]]]]] = {RC.Col: {}, RC.Row: {}}
+    xs: ty.List[float] = []
+    ys: ty.List[float] = []
+    for (rc, i_cp), entries in entries_rccp.items():
+        if len(entries) == 0:
+            continue
+        for i_pin, line in route_rccp[rc, i_cp].items():
+            ep = entries[i_pin]
+            keys = keys_rc[rc][i_cp, i_pin]
+            orig_wire_path = (ep.x, ep.y, ep.angle)
+            wires = []
+            for j in line:
+                dest_wire_path = _get_absolute_wire_path(keys[j[0]], rc, j[1], False)
+                segments = dubins.dubins_path_segments(*orig_wire_path, *dest_wire_path, CURVATURE)
+                for m, length, (x, y, yaw), _ in segments:
+                    xs.append(x)
+                    ys.append(y)
+                    if m != 'S':
+                        # Enough points to bound an arc.
+                        sign = 1. if m == 'L' else -1.
+                        r = 1. / CURVATURE
+                        for phi in yaw + sign * np.linspace(0., length * CURVATURE, 9)[1:]:
+                            xs.append(x - sign * r * np.sin(yaw) + sign * r * np.sin(phi))
+                            ys.append(y + sign * r * np.cos(yaw) - sign * r * np.cos(phi))
+                xs.append(dest_wire_path[0])
+                ys.append(dest_wire_path[1])
+                wires.append((segments, orig_wire_path))
+                orig_wire_path = _get_absolute_wire_path(keys[j[0]], rc, TerminalDirection.Left if j[1] == TerminalDirection.Right else TerminalDirection.Right, True)
+            wires.append(([], orig_wire_path))
+            wires_pn_rc[rc][ep.pin_number] = wires
+    offset = np.array([min(xs), min(ys)])
+    size = np.array([max(xs), max(ys)]) - offset + 1
+    img_w = int(size[0] * DIAGRAM_MAG) + DIAGRAM_MARGIN * 2
+    img_h = int(size[1] * DIAGRAM_MAG) + DIAGRAM_MARGIN * 2
+
+    def _px(x: float, y: float):
+        return (x - offset[0]) * DIAGRAM_MAG + DIAGRAM_MARGIN, (y - offset[1]) * DIAGRAM_MAG + DIAGRAM_MARGIN
+
+    wire_pitch_pnrc: ty.Dict[ty.Tuple[int, RC], float] = {}
+    for (rc, i_cp), entries in entries_rccp.items():
+        for i_pin in route_rccp[rc, i_cp].keys():
+            wire_pitch_pnrc[entries[i_pin].pin_number, rc] = cable_placements[i_cp].cable.wire_pitch
+
+    def _width(pn, rc):
+        return int(wire_pitch_pnrc[pn, rc] * DIAGRAM_MAG) - 8 if bold_rc == rc else 3, int(wire_pitch_pnrc[pn, rc] * DIAGRAM_MAG) if bold_rc == rc else 7
+
+    wire_table_height = WIRE_TABLE_ROW * (max([i_cp for (_, i_cp), entries in entries_rccp.items() if len(entries) > 0]) + 1)
+    wire_table_width = WIRE_TABLE_PITCH * (max([
+        max([en.pin_number for en in entries.values()])
+        for entries in entries_rccp.values()
+    ]) + 1) + DIAGRAM_MARGIN * 2
+    total_w = max(img_w, wire_table_width)
+    total_h = img_h + WIRE_TABLE_MARGIN + wire_table_height
+    font_attrs = f'font-family="Ubuntu Mono, monospace" font-size="{DIAGRAM_FONT_SIZE}" fill="black" stroke="white" stroke-width="4" paint-order="stroke"'
+    rcs = [RC.Col, RC.Row] if bold_rc == RC.Row else [RC.Row, RC.Col]
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                f'width="{n(total_w / DIAGRAM_MAG)}cm" height="{n(total_h / DIAGRAM_MAG)}cm" viewBox="0 0 {total_w} {total_h}">\n')
+        f.write(f'<rect width="{total_w}" height="{total_h}" fill="white"/>\n')
+
+        # Mirrored like draw_wire(), because we see the PCB from the back side.
+        f.write(f'<g transform="translate({img_w} 0) scale(-1 1)">\n')
+        image_ids: ty.Dict[ty.Union[str, int], str] = {}
+        for ks in keys_rc[RC.Row].values():
+            for k in ks:
+                kii = _key_image_id(k)
+                if kii not in image_ids:
+                    image_ids[kii] = f'k{len(image_ids)}'
+                    buf = BytesIO()
+                    k.img.copy().save(buf, 'PNG')  # type: ignore  # Unpickled PngImageFile cannot save() itself.
+                    f.write(f'<defs><image id="{image_ids[kii]}" width="{k.img.size[0]}" height="{k.img.size[1]}" '  # type: ignore
+                            f'xlink:href="data:image/png;base64,{b64.b64encode(buf.getvalue()).decode("ascii")}"/></defs>\n')
+                x, y = _px(*k.key_location[:2])
+                f.write(f'<use xlink:href="#{image_ids[kii]}" transform="translate({n(x)} {n(y)}) rotate({n(-np.rad2deg(_get_key_angle(k)))}) '
+                        f'translate({n(-k.img.size[0] / 2)} {n(-k.img.size[1] / 2)})"/>\n')  # type: ignore
+        for rc in rcs:
+            for pn, wires in wires_pn_rc[rc].items():
+                color = RAINBOW_CABLE_COLORS[(pn + 1) % 10]
+                border_color = 'black' if color == 'grey' else 'grey'
+                width, border_width = _width(pn, rc)
+                last_xy = None
+                for segments, start in wires:
+                    sx, sy = _px(*start[:2])
+                    if last_xy is not None:
+                        jumper = f'x1="{n(last_xy[0])}" y1="{n(last_xy[1])}" x2="{n(sx)}" y2="{n(sy)}"'
+                        f.write(f'<line {jumper} stroke="black" stroke-width="7"/><line {jumper} stroke="{color}" stroke-width="3"/>\n')
+                    if len(segments) == 0:
+                        break
+                    d = f'M{n(sx)} {n(sy)}'
+                    ex, ey = sx, sy
+                    for m, length, (x0, y0, yaw0), _ in segments:
+                        if m == 'S':
+                            ex, ey = _px(x0 + length * np.cos(yaw0), y0 + length * np.sin(yaw0))
+                            d += f' L{n(ex)} {n(ey)}'
+                            continue
+                        # An SVG arc cannot be a full circle, so split it into quarters at most.
+                        sign = 1. if m == 'L' else -1.
+                        turn = length * CURVATURE
+                        n_split = int(np.ceil(turn / (np.pi / 2)))
+                        r = 1. / CURVATURE
+                        c_x, c_y = x0 - sign * r * np.sin(yaw0), y0 + sign * r * np.cos(yaw0)
+                        for i_split in range(1, n_split + 1):
+                            phi = yaw0 + sign * turn * i_split / n_split
+                            ex, ey = _px(c_x + sign * r * np.sin(phi), c_y - sign * r * np.cos(phi))
+                            # y axis is downward, so the positive angle direction (sweep-flag 1) is left turn.
+                            d += f' A{n(radius)} {n(radius)} 0 0 {1 if m == "L" else 0} {n(ex)} {n(ey)}'
+                    f.write(f'<path d="{d}" fill="none" stroke="{border_color}" stroke-width="{border_width}" stroke-linejoin="round"/>'
+                            f'<path d="{d}" fill="none" stroke="{color}" stroke-width="{width}" stroke-linejoin="round"/>\n')
+                    last_xy = ex, ey
+        f.write('</g>\n')
+
+        for rc in rcs:
+            last_pn = -1
+            last_printed = False
+            for pn, wires in wires_pn_rc[rc].items():
+                pn1 = pn + 1  # Wire number always starts from 1.
+                if last_pn == pn1 - 1 and pn1 > 8 and ((pn1 % 5) != 0 or last_printed):
+                    last_pn = pn1
+                    last_printed = False
+                    continue
+                last_pn = pn1
+                last_printed = True
+                _, start = wires[0]
+                x, y = np.cos(start[2]), np.sin(start[2])
+                if abs(x) > abs(y):
+                    anchor, baseline = ('start' if x > 0. else 'end'), 'central'
+                else:
+                    anchor, baseline = 'middle', ('text-after-edge' if y > 0. else 'hanging')
+                sx, sy = _px(*start[:2])
+                f.write(f'<text x="{n(img_w - sx)}" y="{n(sy)}" text-anchor="{anchor}" dominant-baseline="{baseline}" {font_attrs}>{pn1}</text>\n')
+
+        f.write(f'<g transform="translate(0 {img_h + WIRE_TABLE_MARGIN})">\n')
+        for (rc, i_cp), entries in entries_rccp.items():
+            if len(entries) == 0:
+                continue
+            cp = cable_placements[i_cp]
+            for i_pin in route_rccp[rc, i_cp].keys():
+                pn = entries[i_pin].pin_number
+                wt_x = WIRE_TABLE_MARGIN + WIRE_TABLE_PITCH * pn
+                wt_y = i_cp * WIRE_TABLE_ROW
+                color = RAINBOW_CABLE_COLORS[(pn + 1) % 10]
+                border_color = 'black' if color == 'grey' else 'grey'
+                width, border_width = _width(pn, rc)
+                bar = f'x1="{wt_x}" y1="{wt_y + WIRE_TABLE_MARGIN + DIAGRAM_FONT_SIZE + 7}" x2="{wt_x}" y2="{wt_y + WIRE_TABLE_ROW - WIRE_TABLE_MARGIN - DIAGRAM_FONT_SIZE - 7}"'
+                f.write(f'<line {bar} stroke="{border_color}" stroke-width="{border_width}"/><line {bar} stroke="{color}" stroke-width="{width}"/>\n')
+                f.write(f'<text x="{wt_x}" y="{wt_y + WIRE_TABLE_MARGIN}" text-anchor="middle" dominant-baseline="hanging" {font_attrs}>{pn + 1}</text>\n')
+                for wn in mbc.wire_names_rc[rc]:
+                    if cp.cable.get_pin_number(wn, rc) == pn:
+                        f.write(f'<text x="{wt_x}" y="{wt_y + WIRE_TABLE_ROW - WIRE_TABLE_MARGIN - DIAGRAM_FONT_SIZE}" text-anchor="middle" '
+                                f'dominant-baseline="hanging" {font_attrs}>{escape(wn)}</text>\n')
+                        break
+        f.write('</g>\n</svg>\n')
+
+
+WIRE_DIAGRAM_FORMATS = ['png', 'svg']
+
+
+def save_wire_diagrams(out_dir: pathlib.Path, keys_rc: ty.Dict[RC, KeysOnPinType], entries_rccp: ty.Dict[RC_CP, ty.Dict[int, Entry]],
+                       route_rccp: ty.Dict[RC_CP, ty.Dict[int, Line]], cable_placements: ty.List[FlatCablePlacement], mbc: ty.Optional['MainboardConstants'] = None,
+                       fmt: str = 'png'):
+    '''
+    Writes wiring_S.<fmt> and wiring_D.<fmt>. fmt is one of WIRE_DIAGRAM_FORMATS.
+    '''
+    if fmt == 'png':
+        img_row, img_col = draw_wire(keys_rc, entries_rccp, route_rccp, cable_placements, mbc)
+        img_row.save(str(out_dir / 'wiring_S.png'))
+        img_col.save(str(out_dir / 'wiring_D.png'))
+    elif fmt == 'svg':
+        write_wire_svg(out_dir / 'wiring_S.svg', RC.Row, keys_rc, entries_rccp, route_rccp, cable_placements, mbc)
+        write_wire_svg(out_dir / 'wiring_D.svg', RC.Col, keys_rc, entries_rccp, route_rccp, cable_placements, mbc)
+    else:
+        raise BadCodeException(f'Unknown format: {fmt}')
 
 
 def read_json_by_b64(json_b64: str) -> ty.Any:
@@ -554,17 +1297,19 @@ def read_json_by_b64(json_b64: str) -> ty.Any:
     return json5.loads(content.decode('utf-8'))
 
 
-def generate_keymap(keys_rc: ty.Dict[RC, KeysOnPinType], mbc: 'MainboardConstants'):
-    con = get_context()
+def make_keymap(keys_rc: ty.Dict[RC, KeysOnPinType], mbc: 'MainboardConstants', kle_json: ty.Any, name: str):
+    '''
+    F360-independent core of generate_keymap(). kle_json is the parsed KLE JSON. name is the keyboard name for VIA.
+    '''
     matrix_code: ty.Dict[int, ty.Dict[int, ty.List[str]]] = defaultdict(dict)
     keys: ty.Dict[int, Key] = {}
     for k in sum(keys_rc[RC.Row].values(), []):
         keys[k.i_kle] = k
         matrix_code[k.i_logical_row][k.i_logical_col] = k.codes
 
-    kle_json = []
+    via_layout = []
     i_kle = 0
-    for r in read_json_by_b64(con.child[CN_INTERNAL].comp_attr[AN_KLE_B64]):
+    for r in kle_json:
         nr = []
         for e in r:
             if isinstance(e, str):
@@ -580,17 +1325,16 @@ def generate_keymap(keys_rc: ty.Dict[RC, KeysOnPinType], mbc: 'MainboardConstant
                 nr.append(ne)
             else:
                 nr.append(e)
-        kle_json.append(nr)
-    mbc = get_mainboard_constants()
+        via_layout.append(nr)
     via_dic = {
-        'name': con.des.parentDocument.name,
+        'name': name,
         'vendorId': 'FEED',  # https://github.com/tmk/tmk_keyboard/issues/150
         'productId': mbc.product_id,
         'matrix': {
             'rows': mbc.n_logical_rc[RC.Row], 'cols': mbc.n_logical_rc[RC.Col]
         },
         'layouts': {
-            'keymap': kle_json
+            'keymap': via_layout
         }
     }
     
@@ -624,11 +1368,56 @@ class MainboardConstants:
     product_id: str
 
 
-def get_mainboard_constants() -> MainboardConstants:
-    mb = get_context().child[CN_INTERNAL].comp_attr[AN_MAINBOARD]
-    mod = importlib.import_module(f'mainboard.{mb}')
+def generate_keymap(keys_rc: ty.Dict[RC, KeysOnPinType], mbc: MainboardConstants):
+    '''
+    F360 adapter of make_keymap(). Reads the KLE and the document name from the context.
+    '''
+    from f360_common import CN_INTERNAL, AN_KLE_B64, get_context
+    con = get_context()
+    return make_keymap(keys_rc, mbc, read_json_by_b64(con.child[CN_INTERNAL].comp_attr[AN_KLE_B64]), con.des.parentDocument.name)
+
+
+@dataclass
+class RouteData:
+    keys_rc: ty.Dict[RC, KeysOnPinType]
+    entries_rccp: ty.Dict[RC_CP, ty.Dict[int, Entry]]
+    route_rccp: ty.Dict[RC_CP, ty.Dict[int, Line]]
+    img_row: ty.Optional[ImageType]  # None if draw_images is False.
+    img_col: ty.Optional[ImageType]
+    qmk_keymap: str
+    via_keymap: str
+    stats: ty.List[PinRouteStat]
+
+
+def generate_route_data(kle_json: bytes, matrix: ty.Dict[str, ty.Dict[str, str]], key_switches: ty.Dict[str, KeySwitch], pitch_wd: ty.Tuple[float, float],
+                        cable_placements: ty.List[FlatCablePlacement], pi: PartsInfo, mbc: MainboardConstants, name: str,
+                        solver: PinRouteSolver = solve_pin_route, max_workers: ty.Optional[int] = 1, route_cache: ty.Optional[RouteCache] = None,
+                        time_budget: ty.Optional[RouteTimeBudget] = None, draw_images: bool = True):
+    '''
+    Does what Generate Route command does, without F360. kle_json is the content of a KLE file.
+    See route_keys() about the other arguments.
+    '''
+    kle_resolution = resolve_kle_json(kle_json, pi)
+    stats: ty.List[PinRouteStat] = []
+    keys_rc, entries_rccp, route_rccp = route_keys(kle_resolution, matrix, key_switches, pitch_wd, cable_placements, pi, solver, max_workers, route_cache,
+                                                   time_budget, stats)
+    img_row, img_col = draw_wire(keys_rc, entries_rccp, route_rccp, cable_placements, mbc) if draw_images else (None, None)
+    qmk_keymap, via_keymap = make_keymap(keys_rc, mbc, json5.loads(kle_json.decode('utf-8')), name)
+    return RouteData(keys_rc, entries_rccp, route_rccp, img_row, img_col, qmk_keymap, via_keymap, stats)
+
+
+def load_mainboard_constants(mainboard_name: str) -> MainboardConstants:
+    mod = importlib.import_module(f'mainboard.{mainboard_name}')
     return mod.constants()
 
 
+def get_mainboard_constants() -> MainboardConstants:
+    from f360_common import CN_INTERNAL, get_context
+    from p2ppcb_composer.cmd_common import AN_MAINBOARD
+    return load_mainboard_constants(get_context().child[CN_INTERNAL].comp_attr[AN_MAINBOARD])
+
+
 def get_cn_mainboard():
+    from f360_common import CN_INTERNAL, CNP_PARTS, get_context
+    from p2ppcb_composer.cmd_common import AN_MAINBOARD
     return get_context().child[CN_INTERNAL].comp_attr[AN_MAINBOARD] + CNP_PARTS
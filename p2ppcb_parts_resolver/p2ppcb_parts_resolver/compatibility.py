@@ -0,0 +1,239 @@
+'''
+Offline compatibility matrix of caps, stabilizers, switches and specifiers. Run:
+
+    python -m p2ppcb_parts_resolver.compatibility PARTS_INFO_DIR [-j N_WORKERS]
+
+It writes compatibility_matrix.pickle into PARTS_INFO_DIR. PartsInfo looks up the matrix instead of resolving,
+while the parts info has not been changed after compiling.
+'''
+import argparse
+import itertools
+import os
+import pathlib
+import pickle
+import re
+import sys
+import typing as ty
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+import p2ppcb_parts_resolver.resolver as parts_resolver
+from p2ppcb_parts_resolver.resolver import AlignTo, Part
+
+# No public API to parse a regex. Without the private parser, available.txt is not expanded and the matrix covers no specifier.
+try:
+    import re._parser as sre_parse  # Python 3.11 or later
+except ImportError:
+    try:
+        import sre_parse  # type: ignore
+    except ImportError:
+        sre_parse = None  # type: ignore
+
+COMPATIBILITY_FILENAME = 'compatibility_matrix.pickle'
+COMPATIBILITY_VERSION = 2  # Bump it when the resolution of resolver.py or the layout of the matrix changes.
+MAX_EXPANSION = 1024  # of a line of available.txt
+
+FloatResolution = ty.Tuple[ty.Dict[Part, str], ty.Dict[Part, ty.Dict[str, float]], ty.Dict[Part, str], ty.Dict[Part, float], ty.Dict[str, float]]
+
+
+def _expand(sub_pattern) -> ty.Optional[ty.List[str]]:
+    results = ['']
+    for op, av in sub_pattern:
+        if op is sre_parse.LITERAL:
+            alts = [chr(av)]
+        elif op is sre_parse.IN:
+            alts = []
+            for in_op, in_av in av:
+                if in_op is sre_parse.LITERAL:
+                    alts.append(chr(in_av))
+                elif in_op is sre_parse.RANGE:
+                    alts.extend(chr(c) for c in range(in_av[0], in_av[1] + 1))
+                else:
+                    return None
+        elif op is sre_parse.BRANCH:
+            alts = []
+            for b in av[1]:
+                b_alts = _expand(b)
+                if b_alts is None:
+                    return None
+                alts.extend(b_alts)
+        elif op is sre_parse.SUBPATTERN:
+            alts = _expand(av[-1])
+        elif op is sre_parse.MAX_REPEAT or op is sre_parse.MIN_REPEAT:
+            lo, hi, sub = av
+            sub_alts = _expand(sub)
+            if sub_alts is None or hi == sre_parse.MAXREPEAT or hi - lo > MAX_EXPANSION or len(sub_alts) ** hi > MAX_EXPANSION:
+                return None
+            alts = [''.join(p) for n in range(lo, hi + 1) for p in itertools.product(sub_alts, repeat=n)]
+        else:
+            return None
+        if alts is None:
+            return None
+        results = [r + a for r in results for a in alts]
+        if len(results) > MAX_EXPANSION:
+            return None
+    return results
+
+
+def expand_available(line: str) -> ty.Optional[ty.List[str]]:
+    '''
+    All specifiers which a line of available.txt matches. None if they are infinite or too many,
+    or the private regex parser of Python is unavailable.
+    '''
+    if sre_parse is None:
+        return None
+    try:
+        return _expand(sre_parse.parse(line))
+    except Exception:  # re.error, OverflowError, or the internals of the parser changed.
+        return None
+
+
+@dataclass
+class CompatibilityMatrix:
+    '''
+    bitmap is packed bits of (cap, stabilizer, switch, specifier) in C order. 1 means resolve_specifier() succeeds.
+    resolutions are resolve_specifier_float() of the valid ones, keyed by (the flat index of bitmap, AlignTo).
+    Specifiers are expanded from available.txt. The lines which match infinite specifiers are not covered.
+    '''
+    version: int
+    signature: ty.Tuple[ty.Tuple[str, int, int], ...]  # of the parts info
+    cap_descs: ty.List[str]
+    stabilizer_descs: ty.List[str]
+    switch_descs: ty.List[str]
+    specifiers: ty.List[str]
+    bitmap: np.ndarray
+    resolutions: ty.Dict[ty.Tuple[int, AlignTo], FloatResolution]
+
+    def _flat_index(self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str) -> ty.Optional[int]:
+        try:
+            ii = (self.cap_descs.index(cap_desc), self.stabilizer_descs.index(stabilizer_desc), self.switch_descs.index(switch_desc),
+                  self.specifiers.index(specifier))
+        except ValueError:
+            return None
+        shape = (len(self.cap_descs), len(self.stabilizer_descs), len(self.switch_descs), len(self.specifiers))
+        return int(np.ravel_multi_index(ii, shape))
+
+    def _bit(self, flat_index: int):
+        return bool((self.bitmap[flat_index >> 3] >> (7 - (flat_index & 7))) & 1)
+
+    def is_compatible(self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str) -> ty.Optional[bool]:
+        '''
+        None if the combination is not covered.
+        '''
+        fi = self._flat_index(specifier, cap_desc, stabilizer_desc, switch_desc)
+        return None if fi is None else self._bit(fi)
+
+    def resolution(self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str, align_to: AlignTo) -> ty.Optional[FloatResolution]:
+        '''
+        None if the combination is not covered or invalid. Don't modify the result.
+        '''
+        fi = self._flat_index(specifier, cap_desc, stabilizer_desc, switch_desc)
+        return None if fi is None else self.resolutions.get((fi, align_to))
+
+    def compatible_specifiers(self, cap_desc: str, stabilizer_desc: str, switch_desc: str) -> ty.Optional[ty.List[str]]:
+        '''
+        None if the descriptions are not covered.
+        '''
+        fi = self._flat_index(self.specifiers[0], cap_desc, stabilizer_desc, switch_desc) if len(self.specifiers) > 0 else None
+        if fi is None:
+            return None
+        return [s for i, s in enumerate(self.specifiers) if self._bit(fi + i)]
+
+
+def _available_specifiers(pi: parts_resolver.PartsInfo) -> ty.List[str]:
+    specifiers: ty.Dict[str, None] = {}
+    for lines in pi.index.availables.values():
+        for line in lines:
+            for s in expand_available(line) or []:
+                specifiers[s] = None
+    return list(specifiers.keys())
+
+
+def _resolve_cap(parts_info_dir: pathlib.Path, cap_desc: str, stabilizer_descs: ty.List[str], switch_descs: ty.List[str], specifiers: ty.List[str]):
+    pi = parts_resolver.get_parts_info(parts_info_dir)
+    bits = np.zeros((len(stabilizer_descs), len(switch_descs), len(specifiers)), np.bool_)
+    resolutions: ty.Dict[ty.Tuple[int, AlignTo], FloatResolution] = {}
+    for i, (stabilizer_desc, switch_desc, specifier) in enumerate(itertools.product(stabilizer_descs, switch_descs, specifiers)):
+        ars: ty.Dict[ty.Tuple[int, AlignTo], FloatResolution] = {}
+        try:
+            for align_to in AlignTo:
+                ars[(i, align_to)] = pi._resolve_specifier_float(specifier, cap_desc, stabilizer_desc, switch_desc, align_to)
+        except Exception:
+            continue  # SpecifierException, or the parts don't fit.
+        bits.flat[i] = True
+        resolutions.update(ars)
+    return bits, resolutions
+
+
+def compile_compatibility_matrix(parts_info_dir: ty.Union[os.PathLike, str], n_workers: ty.Optional[int] = None,
+                                 specifiers: ty.Optional[ty.List[str]] = None):
+    '''
+    Resolves all combinations of descriptions and specifiers, a process per cap.
+    specifiers are all of available.txt if None.
+    '''
+    parts_info_dir = pathlib.Path(parts_info_dir)
+    pi = parts_resolver.get_parts_info(parts_info_dir)
+    cap_descs = pi.enumerate_description(Part.Cap)
+    stabilizer_descs = pi.enumerate_description(Part.Stabilizer)
+    switch_descs = pi.enumerate_description(Part.Switch)
+    if specifiers is None:
+        specifiers = _available_specifiers(pi)
+    n_caps = len(cap_descs)
+    args = ([parts_info_dir] * n_caps, cap_descs, [stabilizer_descs] * n_caps, [switch_descs] * n_caps, [specifiers] * n_caps)
+    if n_workers == 1:
+        results = list(map(_resolve_cap, *args))
+    else:
+        with ProcessPoolExecutor(n_workers) as executor:
+            results = list(executor.map(_resolve_cap, *args))
+
+    n_per_cap = len(stabilizer_descs) * len(switch_descs) * len(specifiers)
+    resolutions: ty.Dict[ty.Tuple[int, AlignTo], FloatResolution] = {}
+    for i_cap, (_, rs) in enumerate(results):
+        for (i, align_to), r in rs.items():
+            resolutions[(i_cap * n_per_cap + i, align_to)] = r
+    bits = np.stack([b for b, _ in results]) if n_caps > 0 else np.zeros((0, ), np.bool_)
+    return CompatibilityMatrix(COMPATIBILITY_VERSION, pi.index.signature, cap_descs, stabilizer_descs, switch_descs, specifiers,
+                               np.packbits(bits.ravel()), resolutions)
+
+
+def save_compatibility_matrix(matrix: CompatibilityMatrix, parts_info_dir: ty.Union[os.PathLike, str]):
+    path = pathlib.Path(parts_info_dir) / COMPATIBILITY_FILENAME
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(matrix, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_compatibility_matrix(parts_info_dir: ty.Union[os.PathLike, str], signature) -> ty.Optional[CompatibilityMatrix]:
+    '''
+    None if the file is missing, or compiled from other parts info or of other COMPATIBILITY_VERSION.
+    '''
+    try:
+        with open(pathlib.Path(parts_info_dir) / COMPATIBILITY_FILENAME, 'rb') as f:
+            matrix = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if not isinstance(matrix, CompatibilityMatrix) or matrix.version != COMPATIBILITY_VERSION or matrix.signature != signature:
+        return None
+    return matrix
+
+
+def main(argv: ty.Optional[ty.List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m p2ppcb_parts_resolver.compatibility',
+                                     description=f'Compiles {COMPATIBILITY_FILENAME} of a parts info directory.')
+    parser.add_argument('parts_info_dir', type=pathlib.Path, help='Parts info directory, which has description.csv.')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Number of worker processes. Default: as many as CPU cores.')
+    args = parser.parse_args(argv)
+
+    matrix = compile_compatibility_matrix(args.parts_info_dir, args.workers)
+    save_compatibility_matrix(matrix, args.parts_info_dir)
+    n_valid = int(np.unpackbits(matrix.bitmap).sum())
+    print(f'{n_valid} valid of {len(matrix.cap_descs) * len(matrix.stabilizer_descs) * len(matrix.switch_descs) * len(matrix.specifiers)} combinations, '
+          f'{len(matrix.specifiers)} specifiers.')
+    return 0
+
+
+if __name__ == '__main__':
+    # Not main() of __main__, to pickle CompatibilityMatrix as p2ppcb_parts_resolver.compatibility's.
+    from p2ppcb_parts_resolver.compatibility import main as _main
+    sys.exit(_main())
@@ -1,22 +1,51 @@
+from __future__ import annotations
+import copy
 import functools
+import importlib
+import json
+import math
 from collections import defaultdict
+import mmap
 import os
 import pathlib
+import pickle
 import re
+import time
+import types
 from enum import Enum, auto
 import csv
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import typing as ty
-import numpy as np
-from numpy.lib.stride_tricks import sliding_window_view
-import pint.errors
-from pint import Quantity
-from PIL import Image
+
+
+class _LazyModule(types.ModuleType):
+    '''
+    Imports the module at the first attribute access. The add-in reimports this module on every start, so it should be light.
+    '''
+    def __getattr__(self, name: str):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+if ty.TYPE_CHECKING:
+    import numpy as np
+    import pint
+    from pint import Quantity
+    from PIL import Image
+else:
+    np = _LazyModule('numpy')
+    pint = _LazyModule('pint')
+    Image = _LazyModule('PIL.Image')
 
 DESCRIPTION_FILENAME = 'description.csv'
 MAPPING_FILENAME = 'mapping.csv'
 AVAILABLE_FILENAME = 'available.txt'
 PARTS_INFO_DIRNAME = 'parameters'
+INDEX_FILENAME = 'parts_info_index.pickle'
+INDEX_VERSION = 4
+PARTS_INFO_CACHE_SIZE = 4096  # Of each memoized method of PartsInfo
+PARTS_INFO_CHECK_INTERVAL = 2.  # Seconds. get_parts_info() checks the directories at most once in it.
 
 # SPN: Special Parameter Name
 SPN_SWITCH_ANGLE = 'SwitchAngle'
@@ -34,6 +63,17 @@ SPN_SWITCH_SB_HEIGHT = 'SwitchStemBottomHeight'
 SPN_STABILIZER_SB_HEIGHT = 'StabilizerStemBottomHeight'
 SPN_SWITCH_BOTTOM_HEIGHT = 'SwitchBottomHeight'
 
+# Canonical units of float values are cm and rad, as F360 API. Dimensionless values are as they are.
+_UNIT_FACTORS = {'mm': 0.1, 'cm': 1., 'm': 100., 'deg': math.pi / 180, 'rad': 1., '': 1.}
+_NUMBER_UNIT_REGEX = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*(mm|cm|m|deg|rad|)\s*')
+
+_V = ty.TypeVar('_V', 'Quantity', float)
+
+# (specifier, cap_desc, stabilizer_desc, switch_desc, align_to), the arguments of resolve_specifier()
+SpecifierRequest = ty.Tuple[str, str, str, str, 'AlignTo']
+_R = ty.TypeVar('_R', bound=ty.Hashable)
+_K = ty.TypeVar('_K')
+
 SpecsOpsOnPn = ty.Dict[str, ty.List[ty.Tuple[str, ty.Optional['OccurrenceParameter']]]]
 
 # import traceback
@@ -98,33 +138,100 @@ def width_u_to_str(f: float):
     return _TRAILING_ZEROS_REGEX.sub(r'\1\2', str(f)) + 'u'
 
 
-KEY_AREA_PATTERN_DIC = {
-    'ISO_Enter': _key_area_pattern([
-        [0b111111],
-        [0b111111],
-        [0b111111],
-        [0b111111],
-        [0b011111],
-        [0b011111],
-        [0b011111],
-        [0b011111],
-    ]),
-    'Bigass_Enter': _key_area_pattern([
-        [0b000111111],
-        [0b000111111],
-        [0b000111111],
-        [0b000111111],
-        [0b111111111],
-        [0b111111111],
-        [0b111111111],
-        [0b111111111],
-    ]),
-}
-KEY_AREA_PATTERN_DIC.update({
-    width_u_to_str(w / 4):
-        _key_area_pattern([[(1 << w) - 1]] * 4)
-        for w in list(range(4, 49))
-})
+@functools.lru_cache(maxsize=None)
+def _key_area_pattern_dic() -> ty.Dict[str, np.ndarray]:
+    '''
+    KEY_AREA_PATTERN_DIC. Built at the first use, not at import.
+    '''
+    dic = {
+        'ISO_Enter': _key_area_pattern([
+            [0b111111],
+            [0b111111],
+            [0b111111],
+            [0b111111],
+            [0b011111],
+            [0b011111],
+            [0b011111],
+            [0b011111],
+        ]),
+        'Bigass_Enter': _key_area_pattern([
+            [0b000111111],
+            [0b000111111],
+            [0b000111111],
+            [0b000111111],
+            [0b111111111],
+            [0b111111111],
+            [0b111111111],
+            [0b111111111],
+        ]),
+    }
+    dic.update({
+        width_u_to_str(w / 4):
+            _key_area_pattern([[(1 << w) - 1]] * 4)
+            for w in list(range(4, 49))
+    })
+    return dic
+
+
+@functools.lru_cache(maxsize=None)
+def _key_shape_index() -> ty.Dict[ty.Tuple[ty.Tuple[int, int], bytes], ty.Tuple[str, ty.Optional[Image.Transpose]]]:
+    '''
+    {(shape, packed bits): (pattern name, rotation)} of KEY_AREA_PATTERN_DIC in all rotations.
+    A key area cropped to its bounding box is looked up by this. The first pattern and rotation win, as the former sliding window search.
+    '''
+    index: ty.Dict[ty.Tuple[ty.Tuple[int, int], bytes], ty.Tuple[str, ty.Optional[Image.Transpose]]] = {}
+    for pattern_name, pattern in _key_area_pattern_dic().items():
+        rp = pattern
+        for r in [None, Image.Transpose.ROTATE_270, Image.Transpose.ROTATE_180, Image.Transpose.ROTATE_90]:
+            index.setdefault((rp.shape, np.packbits(rp).tobytes()), (pattern_name, r))
+            rp = np.rot90(rp)
+    return index
+
+
+@functools.lru_cache(maxsize=PARTS_INFO_CACHE_SIZE)
+def _key_pattern(profile: str, stepped: bool, nub: bool, width: float, height: float, width2: float, height2: float, x2: float, y2: float):
+    '''
+    (specifier, pattern name, rotation, pattern xy, pattern wh) of a KLE key. None if the key form is invalid.
+    Pattern xy and wh are the rectangle of the pattern relative to (k.x, k.y), or None if it is the key itself.
+    Memoized because a layout has a lot of same keys, and an edited layout has a lot of same keys as before.
+    '''
+    specs: ty.List[str] = []
+    pattern_rotation = None
+    if len(profile) > 0:
+        specs.append(profile)
+    if stepped:
+        specs.append('Stepped')
+    wh = sorted([width, height])
+    if wh[0] == 1 and width2 == width and height == height2 and x2 == 0 and y2 == 0:
+        if height > width:
+            pattern_rotation = Image.Transpose.ROTATE_90
+        w = wh[1]
+        if w == 1:
+            if nub:
+                specs.append('Homing')
+        if w >= 5:
+            specs.append('Spacebar')
+        pattern_name = width_u_to_str(w)
+        specs.append(pattern_name)
+        return ' '.join(specs), pattern_name, pattern_rotation, None, None
+
+    AREA_SIZE = 64
+    AREA_CENTER = AREA_SIZE // 2
+    area = np.zeros([AREA_SIZE, AREA_SIZE], np.bool_)
+    area[AREA_CENTER: AREA_CENTER + round(height * 4), AREA_CENTER:AREA_CENTER + round(width * 4)] = True
+    area[AREA_CENTER + round(y2 * 4): AREA_CENTER + round((height2 + y2) * 4),
+         AREA_CENTER + round(x2 * 4):AREA_CENTER + round((width2 + x2) * 4)] = True
+
+    ys, xs = np.nonzero(area)
+    if len(ys) == 0:
+        return None
+    hit_iy, hit_ix = ys.min(), xs.min()
+    crop = area[hit_iy:ys.max() + 1, hit_ix:xs.max() + 1]
+    shape = _key_shape_index().get((crop.shape, np.packbits(crop).tobytes()))
+    if shape is None:
+        return None
+    pattern_name, pattern_rotation = shape
+    return pattern_name, pattern_name, pattern_rotation, ((hit_ix - AREA_CENTER) / 4, (hit_iy - AREA_CENTER) / 4), (crop.shape[1] / 4, crop.shape[0] / 4)
 
 
 class Part(Enum):
@@ -157,6 +264,222 @@ class OccurrenceParameter:
     i_kle: int
 
 
+@functools.lru_cache(maxsize=None)
+def _kle_key_dtype() -> np.dtype:
+    '''
+    KLE_KEY_DTYPE. Built at the first use, not at import.
+    '''
+    return np.dtype([
+        ('i_kle', np.int64),
+        ('center_xyu', np.float64, (2, )),
+        ('image_center_offset_u', np.float64, (2, )),
+        ('image_whu', np.float64, (2, )),
+        ('angle', np.float64),  # clockwise
+    ])
+
+
+@dataclass
+class KleColumns:
+    '''
+    Columnar result of resolve_kle_columns(). The fields of KLE_KEY_DTYPE are the same as OccurrenceParameter.
+    Keys are grouped by pattern name in the order of appearance, and sorted by i_kle in each group.
+    specifiers and legends are in the same order as keys. kle_keys are pykle_serial's keys in the order of i_kle.
+    kle_meta is the keyboard metadata of the KLE file as it is.
+    '''
+    keys: np.ndarray
+    specifiers: ty.List[str]
+    legends: ty.List[ty.List[str]]
+    pattern_slices: ty.Dict[str, slice]
+    image_output_dir: ty.Optional[pathlib.Path]
+    kle_keys: ty.List[ty.Any] = field(default_factory=list)
+    kle_meta: ty.Dict[str, ty.Any] = field(default_factory=dict)
+
+    def on_pattern(self, pattern_name: str) -> np.ndarray:
+        '''
+        A view of keys, not a copy.
+        '''
+        return self.keys[self.pattern_slices[pattern_name]]
+
+    def image_file_path(self, i_kle: int):
+        return None if self.image_output_dir is None else self.image_output_dir / f'{i_kle}.png'
+
+    def to_specs_ops_on_pn(self) -> SpecsOpsOnPn:
+        specs_ops_on_pn: SpecsOpsOnPn = defaultdict(list)
+        for pattern_name, sl in self.pattern_slices.items():
+            for j in range(sl.start, sl.stop):
+                key = self.keys[j]
+                i_kle = int(key['i_kle'])
+                op = OccurrenceParameter(
+                    ty.cast(ty.Tuple[float, float], tuple(key['center_xyu'].tolist())),
+                    ty.cast(ty.Tuple[float, float], tuple(key['image_center_offset_u'].tolist())),
+                    ty.cast(ty.Tuple[float, float], tuple(key['image_whu'].tolist())),
+                    float(key['angle']), self.legends[j], self.image_file_path(i_kle), i_kle)
+                specs_ops_on_pn[pattern_name].append((self.specifiers[j], op))
+        return specs_ops_on_pn
+
+
+@dataclass
+class KleKeyDiff:
+    '''
+    Keys of a new KLE layout against an old one, by i_kle. moved and unchanged are (old i_kle, new i_kle).
+    A moved key has the same form and legends as the old one, but a different position or rotation.
+    '''
+    added: ty.List[int]
+    removed: ty.List[int]
+    moved: ty.List[ty.Tuple[int, int]]
+    unchanged: ty.List[ty.Tuple[int, int]]
+
+
+def _kle_key_appearance(k) -> tuple:
+    return (k.color, tuple(k.labels), tuple(k.textColor), tuple(k.textSize), k.default.textColor, k.default.textSize,
+            k.width, k.height, k.x2, k.y2, k.width2, k.height2, k.decal, k.ghost, k.stepped, k.nub, k.profile, k.sm, k.sb, k.st)
+
+
+def _kle_key_position(k) -> tuple:
+    return (k.x, k.y, k.rotation_x, k.rotation_y, k.rotation_angle)
+
+
+def diff_kle_keys(old_keys: ty.List[ty.Any], new_keys: ty.List[ty.Any]):
+    '''
+    old_keys and new_keys are pykle_serial's keys. Same keys are paired in the order of i_kle.
+    The keyboard metadata is not compared. Keys of layouts with different metadata can look different.
+    '''
+    old_on_ap: ty.Dict[tuple, ty.List[int]] = defaultdict(list)
+    for i, k in enumerate(old_keys):
+        old_on_ap[(_kle_key_appearance(k), _kle_key_position(k))].append(i)
+    unchanged: ty.List[ty.Tuple[int, int]] = []
+    rest: ty.List[int] = []
+    for j, k in enumerate(new_keys):
+        ii = old_on_ap.get((_kle_key_appearance(k), _kle_key_position(k)))
+        if ii:
+            unchanged.append((ii.pop(0), j))
+        else:
+            rest.append(j)
+
+    old_on_a: ty.Dict[tuple, ty.List[int]] = defaultdict(list)
+    for (a, _), ii in old_on_ap.items():
+        old_on_a[a].extend(ii)
+    for ii in old_on_a.values():
+        ii.sort()
+    moved: ty.List[ty.Tuple[int, int]] = []
+    added: ty.List[int] = []
+    for j in rest:
+        ii = old_on_a.get(_kle_key_appearance(new_keys[j]))
+        if ii:
+            moved.append((ii.pop(0), j))
+        else:
+            added.append(j)
+    removed = sorted(i for ii in old_on_a.values() for i in ii)
+    return KleKeyDiff(added, removed, moved, unchanged)
+
+
+# Reset after each key by KLE. The others are inherited by the following keys.
+_KLE_PER_KEY_PROPERTIES = frozenset(['w', 'h', 'x2', 'y2', 'w2', 'h2', 'n', 'l', 'd'])
+
+
+def _kle_meta(rows: list) -> ty.Dict[str, ty.Any]:
+    return rows[0] if len(rows) > 0 and isinstance(rows[0], dict) else {}
+
+
+def _reduced_kle_rows(rows: list, keys: ty.List[ty.Any], ii: ty.List[int]) -> ty.Tuple[ty.List[int], list]:
+    '''
+    rows (the original KLE file as JSON) with keys[i] for i in ii only, and ii in the order of the file.
+    The property objects are the original ones, so the remaining keys render exactly as in the original layout.
+    A removed key leaves its property objects without _KLE_PER_KEY_PROPERTIES, and advances x by its width as KLE does.
+    '''
+    selected = set(ii)
+    reduced: list = []
+    i = 0
+    for row in rows:
+        if not isinstance(row, list):
+            reduced.append(row)  # The metadata
+            continue
+        reduced_row: list = []
+        props: ty.List[ty.Dict[str, ty.Any]] = []  # Since the last key
+        for item in row:
+            if not isinstance(item, str):
+                props.append(item)
+                continue
+            if i in selected:
+                reduced_row.extend(props)
+                reduced_row.append(item)
+            else:
+                reduced_row.extend({n: v for n, v in p.items() if n not in _KLE_PER_KEY_PROPERTIES} for p in props)
+                reduced_row.append({'x': keys[i].width})
+            props = []
+            i += 1
+        reduced_row.extend(props)
+        reduced.append(reduced_row)
+    return sorted(selected), reduced
+
+
+def _scrape_keys(rows: list, keys: ty.List[ty.Any], ii: ty.List[int], image_output_dir: pathlib.Path):
+    '''
+    Scrapes the images of keys[i] for i in ii only, by the original KLE file (rows, as JSON) without the other keys.
+    '''
+    import tempfile
+    from kle_scraper import scrape
+    ii, reduced_rows = _reduced_kle_rows(rows, keys, ii)
+    with tempfile.TemporaryDirectory(dir=image_output_dir) as tmp_dir:
+        kle_json_path = pathlib.Path(tmp_dir) / 'keys.json'
+        with open(kle_json_path, 'w', encoding='utf-8') as f:
+            json.dump(reduced_rows, f)
+        scraped_dir = pathlib.Path(tmp_dir) / 'images'
+        scraped_dir.mkdir()
+        if scrape(kle_json_path, scraped_dir) is None:
+            raise Exception('Bad KLE file or image_output_dir.')
+        for j, i in enumerate(ii):
+            os.replace(scraped_dir / f'{j}.png', image_output_dir / f'{i}.png')
+
+
+def _transpose_image(image_path: pathlib.Path, rotation: Image.Transpose):
+    with Image.open(image_path) as image:
+        transposed = image.transpose(rotation)
+    transposed.save(image_path)
+
+
+def _transpose_images(works: ty.List[ty.Tuple[pathlib.Path, Image.Transpose]]):
+    '''
+    Transposes the key images in place on a thread pool. PIL releases the GIL during decoding, transposing and encoding.
+    '''
+    if len(works) == 0:
+        return
+    if len(works) == 1:
+        _transpose_image(*works[0])
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(min(len(works), os.cpu_count() or 1)) as executor:
+        for _ in executor.map(lambda w: _transpose_image(*w), works):
+            pass  # to raise exceptions
+
+
+def _scrape_kle_incrementally(rows: list, image_output_dir: pathlib.Path, previous: KleColumns):
+    '''
+    Copies the images of unchanged and moved keys of previous, and scrapes the rest only.
+    rows is the KLE file (as JSON). Its metadata should be the same as previous.
+    Returns the keyboard and i_kle of the scraped keys.
+    '''
+    import pykle_serial as kle_serial
+    keyboard = kle_serial.deserialize(rows)
+    diff = diff_kle_keys(previous.kle_keys, keyboard.keys)
+    scraped = list(diff.added)
+    images: ty.Dict[int, bytes] = {}
+    for i_old, i_new in diff.unchanged + diff.moved:
+        old_image_path = previous.image_file_path(i_old)
+        try:
+            if old_image_path is None:
+                raise OSError()
+            images[i_new] = old_image_path.read_bytes()
+        except OSError:
+            scraped.append(i_new)
+    image_output_dir.mkdir(parents=True, exist_ok=True)
+    for i_new, image in images.items():
+        (image_output_dir / f'{i_new}.png').write_bytes(image)
+    if len(scraped) > 0:
+        _scrape_keys(rows, keyboard.keys, scraped, image_output_dir)
+    return keyboard, set(scraped)
+
+
 class AlignTo(Enum):
     StemBottom = auto()
     TravelBottom = auto()
@@ -164,7 +487,7 @@ class AlignTo(Enum):
 
 @dataclass
 class _MappingRow:
-    specifier_pattern: re.Pattern
+    specifier_pattern: str  # Compiled by re.search() at the first use, and cached by re module.
     filename: str
     parameter_names: ty.List[str]
 
@@ -182,24 +505,414 @@ class ResolveParameterException(Exception):
         self.path = path
 
 
+_BACKREFERENCE_REGEX = re.compile(r'\\[1-9]|\(\?P=')
+
+
+class _SpecifierMatcher:
+    '''
+    Specifier patterns of a CSV file compiled into a regex. Finds the first row whose pattern is found in a specifier.
+    Pickled as the pattern sources, because unpickling a re.Pattern compiles it again anyway.
+    The patterns are compiled at the first match in each process.
+    '''
+    def __init__(self, sources: ty.List[str]) -> None:
+        self.sources = sources
+        self.patterns: ty.Optional[ty.List[re.Pattern]] = None
+        self.combined: ty.Optional[re.Pattern] = None
+
+    def __getstate__(self):
+        return {'sources': self.sources}
+
+    def __setstate__(self, state):
+        self.__init__(state['sources'])
+
+    def _compile(self):
+        self.patterns = [re.compile(r'\b' + p + r'\b') for p in self.sources]
+        # Each row is a lookahead from the beginning, followed by an empty named group to tell the row.
+        # Alternation tries the rows in order, so the first row wins wherever it is found in the specifier.
+        if not any(_BACKREFERENCE_REGEX.search(p) for p in self.sources):
+            try:
+                self.combined = re.compile('|'.join(f'(?=[\\s\\S]*?(?:\\b{p}\\b))(?P<_r{i}>)' for i, p in enumerate(self.sources)))
+            except re.error:
+                pass  # Named groups in patterns collide. Try the rows one by one.
+
+    def first_match(self, specifier: str) -> ty.Optional[int]:
+        if self.patterns is None:
+            self._compile()
+        if self.combined is not None:
+            m = self.combined.match(specifier)
+            return None if m is None or m.lastgroup is None else int(m.lastgroup[2:])
+        for i, p in enumerate(self.patterns):  # type: ignore
+            if p.search(specifier) is not None:
+                return i
+        return None
+
+
+class _AvailableMatcher:
+    '''
+    Lines of available.txt compiled into an anchored alternation. A specifier is available if r'^' + line + r'$' matches it.
+    '''
+    def __init__(self, lines: ty.List[str]):
+        self.lines = lines
+        # Each line keeps its own anchors, so a top-level | in a line means the same as before.
+        self.combined: ty.Optional[re.Pattern] = None
+        if len(lines) > 0 and not any(_BACKREFERENCE_REGEX.search(line) for line in lines):
+            try:
+                self.combined = re.compile('|'.join(f'(?:^{line}$)' for line in lines))
+            except re.error:
+                pass  # Groups in lines collide. Try the lines one by one.
+
+    def match(self, specifier: str) -> bool:
+        if self.combined is not None:
+            return self.combined.match(specifier) is not None
+        return any(re.match(r'^' + line + r'$', specifier) is not None for line in self.lines)
+
+
+@functools.lru_cache(maxsize=None)
+def unit_registry() -> pint.UnitRegistry:
+    '''
+    The unit registry of all quantities of the parts info. It is pint's application registry, so pint.Quantity() is compatible.
+    '''
+    return pint.get_application_registry().get()
+
+
+@functools.lru_cache(maxsize=PARTS_INFO_CACHE_SIZE)
+def _quantity(value: str) -> Quantity:
+    '''
+    Memoized by the string, so the result is shared. Public APIs return copies of it.
+    '''
+    return unit_registry().Quantity(value)
+
+
+def quantity(value: str) -> Quantity:
+    '''
+    Parses a parameter value string. An identical string is parsed only once.
+    '''
+    return copy.copy(_quantity(value))
+
+
+def _copy_quantities(quantities: ty.Dict[_K, Quantity]) -> ty.Dict[_K, Quantity]:
+    return {n: copy.copy(q) for n, q in quantities.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def _conversion_factor(units, unit: str) -> ty.Optional[float]:
+    '''
+    magnitude * factor is the magnitude in unit. None if units has an offset (degC etc.), which has no factor.
+    Raises pint.DimensionalityError if units is not convertible to unit. lru_cache doesn't memoize it.
+    '''
+    reg = unit_registry()
+    if not reg.Unit(units).is_compatible_with(unit):
+        raise pint.DimensionalityError(units, unit)
+    try:
+        if reg.Quantity(0., units).m_as(unit) != 0.:
+            return None
+    except pint.OffsetUnitCalculusError:
+        return None
+    return reg.Quantity(1., units).m_as(unit)
+
+
+def magnitude_as(q: Quantity, unit: str):
+    '''
+    Same as q.m_as(unit), but by a conversion factor memoized by the units of q and unit.
+    The magnitude of q can be a NumPy array.
+    '''
+    factor = _conversion_factor(q.units, unit)
+    if factor is None:
+        return q.m_as(unit)
+    return q.magnitude * factor
+
+
+@functools.lru_cache(maxsize=None)
+def _float_unit(units) -> ty.Optional[str]:
+    u = unit_registry().Unit(units)
+    for unit in ['rad', 'cm']:
+        if u.is_compatible_with(unit):
+            return unit
+    return None
+
+
+def quantity_to_float(q: Quantity) -> ty.Optional[float]:
+    '''
+    Quantity to float in cm, rad or dimensionless. None if it is not a length, an angle or a number.
+    '''
+    unit = _float_unit(q.units)
+    return None if unit is None else magnitude_as(q, unit)
+
+
+def parameter_to_float(value: str) -> ty.Optional[float]:
+    '''
+    Parameter value string to float in cm, rad or dimensionless. None if the value is not a length, an angle or a number.
+    '''
+    m = _NUMBER_UNIT_REGEX.fullmatch(value)
+    if m is not None:
+        return float(m.group(1)) * _UNIT_FACTORS[m.group(2)]
+    try:
+        q = _quantity(value)
+    except Exception:
+        return None
+    if not isinstance(q, pint.Quantity):
+        return None
+    return quantity_to_float(q)
+
+
+@dataclass
+class _ParameterTable:
+    filename: str
+    parameter_names: ty.List[str]
+    rows: ty.List[ty.List[str]]  # Without the header and the Specifier column
+    float_rows: ty.List[ty.List[ty.Optional[float]]]  # parameter_to_float() of rows
+    matcher: _SpecifierMatcher
+
+
+def _index_key(path: str):
+    k = pathlib.PurePath(path).as_posix()
+    return '' if k == '.' else k
+
+
+def _read_csv(file: os.PathLike) -> ty.List[ty.List[str]]:
+    with open(file, newline='') as f:
+        return [list(row) for row in csv.reader(f, delimiter=",", doublequote=True, quotechar='"', skipinitialspace=True)]
+
+
+# ((name, mtime_ns, size) of the entries of the root, (path, mtime_ns) of the other directories)
+_QuickSignature = ty.Tuple[ty.Tuple[ty.Tuple[str, int, int], ...], ty.Tuple[ty.Tuple[str, int], ...]]
+
+
+@dataclass
+class PartsInfoIndex:
+    '''
+    The whole parts info directory in one object. Keys of the dicts are POSIX paths relative to the directory ('' is the root).
+    '''
+    version: int
+    signature: ty.Tuple[ty.Tuple[str, int, int], ...]  # (path, mtime_ns, size) of every source file
+    quick_signature: _QuickSignature  # At the beginning of the compilation
+    description_dict: ty.Dict[Part, ty.List[ty.Tuple[str, str]]]
+    mappings: ty.Dict[str, ty.List[_MappingRow]]
+    csv_files: ty.Dict[str, ty.List[_ParameterTable]]
+    availables: ty.Dict[str, ty.List[str]]
+
+
+def _is_source_file(filename: str):
+    return filename.endswith('.csv') or filename == AVAILABLE_FILENAME
+
+
+def _source_signature(parts_info_dir: pathlib.Path) -> ty.Tuple[ty.Tuple[str, int, int], ...]:
+    signature: ty.List[ty.Tuple[str, int, int]] = []
+    for dirpath, _, filenames in os.walk(parts_info_dir):
+        for fn in filenames:
+            if _is_source_file(fn):
+                p = pathlib.Path(dirpath) / fn
+                st = p.stat()
+                signature.append((p.relative_to(parts_info_dir).as_posix(), st.st_mtime_ns, st.st_size))
+    return tuple(sorted(signature))
+
+
+def _quick_signature(parts_info_dir: pathlib.Path, directories: ty.Iterable[str]) -> _QuickSignature:
+    '''
+    Much cheaper than _source_signature(): lists the root only, and stats the other directories instead of the files in them.
+    Adding, removing or renaming a file (most editors save a file by renaming) changes the mtime of its directory,
+    but modifying a file in place doesn't. The root is listed because the index and the compatibility matrix are written there.
+    '''
+    root: ty.List[ty.Tuple[str, int, int]] = []
+    with os.scandir(parts_info_dir) as it:
+        for e in it:
+            if e.is_dir():
+                root.append((e.name, -1, -1))
+            elif _is_source_file(e.name):
+                st = e.stat()
+                root.append((e.name, st.st_mtime_ns, st.st_size))
+    mtimes: ty.List[ty.Tuple[str, int]] = []
+    for d in directories:
+        try:
+            mtimes.append((d, (parts_info_dir / d).stat().st_mtime_ns))
+        except OSError:
+            mtimes.append((d, -1))
+    return tuple(sorted(root)), tuple(mtimes)
+
+
+def _index_directories(index: PartsInfoIndex):
+    return [d for d, _ in index.quick_signature[1]]
+
+
+def compile_parts_info(parts_info_dir: ty.Union[os.PathLike, str], signature: ty.Optional[ty.Tuple[ty.Tuple[str, int, int], ...]] = None):
+    parts_info_dir = pathlib.Path(parts_info_dir)
+    directories = sorted(_index_key(str(d.relative_to(parts_info_dir))) for d in parts_info_dir.rglob('*') if d.is_dir())
+    quick_signature = _quick_signature(parts_info_dir, directories)
+    if signature is None:
+        signature = _source_signature(parts_info_dir)
+
+    description_dict: ty.Dict[Part, ty.List[ty.Tuple[str, str]]] = defaultdict(list)  # {Part.Cap: [], Part.Stabilizer: [], Part.Switch: [], Part.PCB: [], Part.Decal: [], Part.Wiring: []}
+    for i, row in enumerate(_read_csv(parts_info_dir / DESCRIPTION_FILENAME)):
+        if i == 0:
+            if ','.join(row) != 'Part,Description,Path':
+                raise Exception(f'Wrong file: {DESCRIPTION_FILENAME} has wrong header.')
+        else:
+            p = part_from_name(row[0])
+            description_dict[p].append((row[1], row[2]))
+
+    mappings: ty.Dict[str, ty.List[_MappingRow]] = {}
+    csv_files: ty.Dict[str, ty.List[_ParameterTable]] = {}
+    availables: ty.Dict[str, ty.List[str]] = {}
+    for k in [''] + directories:
+        d = parts_info_dir / k
+        csv_files[k] = []
+        # The order of iterdir() matters. The first CSV file wins when two files have the same parameter.
+        for p in d.iterdir():
+            if not p.is_file():
+                continue
+            if p.name == MAPPING_FILENAME:
+                mapping: ty.List[_MappingRow] = []
+                for i, row in enumerate(_read_csv(p)):
+                    if i == 0:
+                        if ','.join(row) != 'Specifier,filename,Parameter':
+                            raise Exception(f'Wrong file: {p} has wrong header.')
+                    else:
+                        mapping.append(_MappingRow(row[0], row[1], row[2].split()))
+                mappings[k] = mapping
+            elif p.name == AVAILABLE_FILENAME:
+                with open(p) as f:
+                    availables[k] = list(f.read().splitlines())
+            elif p.suffix == '.csv' and p.name != DESCRIPTION_FILENAME:
+                rows = _read_csv(p)
+                if len(rows) == 0 or rows[0][0] != 'Specifier':
+                    raise Exception(f'Wrong file: {p} has wrong header.')
+                parameter_names = rows[0][1:]
+                float_rows = [[None if n == 'Placeholder' else parameter_to_float(v) for n, v in zip(parameter_names, r[1:])] for r in rows[1:]]
+                csv_files[k].append(_ParameterTable(p.name, parameter_names, [r[1:] for r in rows[1:]], float_rows, _SpecifierMatcher([r[0] for r in rows[1:]])))
+
+    return PartsInfoIndex(INDEX_VERSION, signature, quick_signature, description_dict, mappings, csv_files, availables)
+
+
+def load_parts_info_index(parts_info_dir: ty.Union[os.PathLike, str], index_path: ty.Optional[os.PathLike] = None, check_files: bool = False):
+    '''
+    Loads the index file by a single read. If the file is missing, broken or stale, compiles the directory and rewrites the file.
+    Staleness is checked by _quick_signature(), so a file modified in place is not noticed. If check_files,
+    every source file is checked too (it walks the whole directory).
+    The index is a pickle, so it is as trusted as the parts data directory itself. Don't load parts data from untrusted sources.
+    '''
+    parts_info_dir = pathlib.Path(parts_info_dir)
+    index_path = parts_info_dir / INDEX_FILENAME if index_path is None else pathlib.Path(index_path)
+    signature = _source_signature(parts_info_dir) if check_files else None
+    try:
+        with open(index_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            index = pickle.loads(mm)
+        if isinstance(index, PartsInfoIndex) and index.version == INDEX_VERSION \
+                and index.quick_signature == _quick_signature(parts_info_dir, _index_directories(index)) \
+                and (signature is None or index.signature == signature):
+            return index
+    except Exception:
+        pass
+
+    index = compile_parts_info(parts_info_dir, signature)
+    import tempfile
+    # A temporary file per process. Processes can compile the same directory at once.
+    try:
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=index_path.name + '.', dir=index_path.parent)
+    except OSError:
+        return index  # Read-only parts data works too, only slower.
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return index
+
+
+def _dedup(requests: ty.Sequence[_R]) -> ty.Tuple[ty.List[_R], ty.List[int]]:
+    unique: ty.Dict[_R, int] = {}
+    inverse = [unique.setdefault(r, len(unique)) for r in requests]
+    return list(unique.keys()), inverse
+
+
+def _copy_resolution(resolution: ty.Tuple[ty.Dict, ty.Dict[Part, ty.Dict], ty.Dict, ty.Dict, ty.Dict]):
+    part_filename, part_parameters, part_placeholder, part_z_pos, switch_xya = resolution
+    return dict(part_filename), {p: dict(ps) for p, ps in part_parameters.items()}, dict(part_placeholder), dict(part_z_pos), dict(switch_xya)
+
+
+def _copy_quantity_resolution(resolution: ty.Tuple[ty.Dict, ty.Dict[Part, ty.Dict], ty.Dict, ty.Dict, ty.Dict]):
+    '''
+    Same as _copy_resolution(), but the Quantity values are copied too. Memoized quantities are shared.
+    '''
+    part_filename, part_parameters, part_placeholder, part_z_pos, switch_xya = resolution
+    return dict(part_filename), {p: _copy_quantities(ps) for p, ps in part_parameters.items()}, dict(part_placeholder), \
+        _copy_quantities(part_z_pos), _copy_quantities(switch_xya)
+
+
+@dataclass
+class ResolvedColumns:
+    '''
+    resolve_specifier_float() of many requests in columns. Index i of each list or array is of the i-th request.
+    NaN means that the part doesn't have the parameter for the request.
+    '''
+    part_filename: ty.Dict[Part, ty.List[str]]
+    part_parameters: ty.Dict[Part, ty.Dict[str, np.ndarray]]
+    part_placeholder: ty.Dict[Part, ty.List[str]]
+    part_z_pos: ty.Dict[Part, np.ndarray]  # NaN if the part is not placed
+    switch_xya: ty.Dict[str, np.ndarray]
+    unique_index: np.ndarray  # Requests with the same unique_index are the same.
+
+
 class PartsInfo:
-    def __init__(self, parts_info_dir: ty.Union[os.PathLike, str]):
+    _MEMOIZED_METHODS = ['read_splitlines_file', '_resolve_parameters', '_collect_parameters_rec', 'compatibility_matrix', '_available_matcher', '_is_available',
+                         '_resolve_specifier_quantities']
+
+    def __init__(self, parts_info_dir: ty.Union[os.PathLike, str], index_path: ty.Optional[os.PathLike] = None):
         self.parts_info_dir = pathlib.Path(parts_info_dir)
         if not self.parts_info_dir.is_dir():
             raise Exception(f'Wrong path: {parts_info_dir} is not a directory.')
         if not (self.parts_info_dir / DESCRIPTION_FILENAME).exists():
             raise Exception(f'Wrong path: {parts_info_dir} doesn\'t have {DESCRIPTION_FILENAME}.')
 
-        self.description_dict: ty.Dict[Part, ty.List[ty.Tuple[str, str]]] = defaultdict(list)  # {Part.Cap: [], Part.Stabilizer: [], Part.Switch: [], Part.PCB: [], Part.Decal: [], Part.Wiring: []}
-        with open(self.parts_info_dir / DESCRIPTION_FILENAME, newline='') as f:
-            d = csv.reader(f, delimiter=",", doublequote=True, quotechar='"', skipinitialspace=True)
-            for i, row in enumerate(d):
-                if i == 0:
-                    if ','.join(row) != 'Part,Description,Path':
-                        raise Exception(f'Wrong file: {DESCRIPTION_FILENAME} has wrong header.')
-                else:
-                    p = part_from_name(row[0])
-                    self.description_dict[p].append((row[1], row[2]))
+        self.index_path = index_path
+        self.index = load_parts_info_index(self.parts_info_dir, index_path)
+        self.description_dict = self.index.description_dict
+        # Per instance and bounded. lru_cache decorators on methods are keyed by self, and keep every instance alive.
+        for name in self._MEMOIZED_METHODS:
+            setattr(self, name, functools.lru_cache(maxsize=PARTS_INFO_CACHE_SIZE)(getattr(self, name)))
+
+    def is_changed(self, check_files: bool = True):
+        '''
+        True if a source file has been added, removed or modified after loading. It walks the whole directory.
+        If not check_files, only the directories are checked, so a file modified in place is not noticed. See _quick_signature().
+        '''
+        if check_files:
+            return _source_signature(self.parts_info_dir) != self.index.signature
+        return _quick_signature(self.parts_info_dir, _index_directories(self.index)) != self.index.quick_signature
+
+    def invalidate(self):
+        '''
+        Reloads the parts info directory, checking every source file, and clears all memoized results.
+        '''
+        self.index = load_parts_info_index(self.parts_info_dir, self.index_path, True)
+        self.description_dict = self.index.description_dict
+        for name in self._MEMOIZED_METHODS:
+            getattr(self, name).cache_clear()
+
+    def compatibility_matrix(self):
+        '''
+        The compatibility matrix of the directory, or None if it is not compiled for the current parts info.
+        See p2ppcb_parts_resolver.compatibility.
+        '''
+        from p2ppcb_parts_resolver.compatibility import load_compatibility_matrix
+        return load_compatibility_matrix(self.parts_info_dir, self.index.signature)
+
+    def is_compatible(self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str) -> ty.Optional[bool]:
+        '''
+        Whether resolve_specifier() succeeds, by the compatibility matrix. None if the matrix doesn't cover it.
+        '''
+        matrix = self.compatibility_matrix()
+        return None if matrix is None else matrix.is_compatible(specifier, cap_desc, stabilizer_desc, switch_desc)
+
+    def compatible_specifiers(self, cap_desc: str, stabilizer_desc: str, switch_desc: str) -> ty.Optional[ty.List[str]]:
+        '''
+        Specifiers which resolve_specifier() succeeds with, by the compatibility matrix. None if the matrix doesn't cover them.
+        '''
+        matrix = self.compatibility_matrix()
+        return None if matrix is None else matrix.compatible_specifiers(cap_desc, stabilizer_desc, switch_desc)
 
     def enumerate_description(self, part: Part):
         ret: ty.List[str] = []
@@ -207,31 +920,71 @@ class PartsInfo:
             ret.append(d)
         return ret
 
-    def resolve_decal(self, specifier: str, decal_desc: str):
-        _, decal_parameter_names, path = self._resolve_parameters(specifier, decal_desc, Part.Decal)
-        ps, _ = self._collect_parameters(specifier, path, {})
+    def _collect_quantities(self, specifier: str, path: str) -> ty.Tuple[ty.Dict[str, Quantity], str]:
+        ps, ph = self._collect_parameters(specifier, path)
         try:
-            parameters: ty.Dict[str, Quantity] = {n: Quantity(v) for n, v in ps.items()}  # type: ignore
+            return {n: _quantity(v) for n, v in ps.items()}, ph
         except pint.errors.UndefinedUnitError as pe:
             raise Exception('Bad value in parts info:' + str(pe))
-        decal_parameters: ty.Dict[str, Quantity] = {}
+
+    def _collect_floats(self, specifier: str, path: str) -> ty.Tuple[ty.Dict[str, float], str]:
+        parameters: ty.Dict[str, float] = {}
+        ph = 'Placeholder'
+        for n, (v, fv) in self._collect_parameters_rec(specifier, path).items():
+            if n == 'Placeholder':
+                ph = v
+            elif fv is None:
+                raise Exception(f'Bad value in parts info: {n} is {v}')
+            else:
+                parameters[n] = fv
+        return parameters, ph
+
+    def _resolve_decal(self, specifier: str, decal_desc: str, collect: ty.Callable[[str, str], ty.Tuple[ty.Dict[str, _V], str]]):
+        _, decal_parameter_names, path = self._resolve_parameters(specifier, decal_desc, Part.Decal)
+        parameters, _ = collect(specifier, path)
+        decal_parameters: ty.Dict[str, _V] = {}
         for n in set(decal_parameter_names) & set(parameters.keys()):
             decal_parameters[n] = parameters[n]
         return decal_parameters
 
-    def resolve_pcb_wiring(self, specifier: str, switch_desc: str):
+    def resolve_decal(self, specifier: str, decal_desc: str):
+        return _copy_quantities(self._resolve_decal(specifier, decal_desc, self._collect_quantities))
+
+    def resolve_decal_float(self, specifier: str, decal_desc: str):
+        '''
+        Same as resolve_decal(), but the values are float in cm, rad or dimensionless.
+        '''
+        return self._resolve_decal(specifier, decal_desc, self._collect_floats)
+
+    def _resolve_pcb_wiring(self, specifier: str, switch_desc: str, collect: ty.Callable[[str, str], ty.Tuple[ty.Dict[str, _V], str]]):
         filename, parameter_names, path = self._resolve_parameters(specifier, switch_desc, Part.Wiring)
-        ps, _ = self._collect_parameters(specifier, path, {})
-        try:
-            parameters: ty.Dict[str, Quantity] = {n: Quantity(v) for n, v in ps.items()}  # type: ignore
-        except pint.errors.UndefinedUnitError as pe:
-            raise Exception('Bad value in parts info:' + str(pe))
-        wiring_parameters: ty.Dict[str, Quantity] = {}
+        parameters, _ = collect(specifier, path)
+        wiring_parameters: ty.Dict[str, _V] = {}
         for n in set(parameter_names) & set(parameters.keys()):
             wiring_parameters[n] = parameters[n]
         return filename, wiring_parameters
 
-    @functools.lru_cache(maxsize=None)
+    def resolve_pcb_wiring(self, specifier: str, switch_desc: str):
+        filename, wiring_parameters = self._resolve_pcb_wiring(specifier, switch_desc, self._collect_quantities)
+        return filename, _copy_quantities(wiring_parameters)
+
+    def resolve_pcb_wiring_float(self, specifier: str, switch_desc: str):
+        '''
+        Same as resolve_pcb_wiring(), but the values are float in cm, rad or dimensionless.
+        '''
+        return self._resolve_pcb_wiring(specifier, switch_desc, self._collect_floats)
+
+    def resolve_pcb_wiring_many(self, requests: ty.Sequence[ty.Tuple[str, str]], as_float: bool = False):
+        '''
+        resolve_pcb_wiring() (resolve_pcb_wiring_float() if as_float) of each (specifier, switch_desc), in the order of requests.
+        Same requests are resolved only once. The results don't share dicts nor quantities.
+        '''
+        unique, inverse = _dedup(requests)
+        resolve = self.resolve_pcb_wiring_float if as_float else self.resolve_pcb_wiring
+        copy_parameters = dict if as_float else _copy_quantities
+        results = [resolve(*r) for r in unique]
+        return [(results[i][0], copy_parameters(results[i][1])) for i in inverse]
+
     def read_splitlines_file(self, file: os.PathLike) -> ty.List[str]:
         with open(file) as f:
             return list(f.read().splitlines())
@@ -239,38 +992,88 @@ class PartsInfo:
     def resolve_specifier(
         self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str, align_to: AlignTo
     ) -> ty.Tuple[ty.Dict[Part, str], ty.Dict[Part, ty.Dict[str, Quantity]], ty.Dict[Part, str], ty.Dict[Part, Quantity], ty.Dict[str, Quantity]]:
-        parameters: ty.Dict[str, Quantity] = {}
+        return _copy_quantity_resolution(self._resolve_specifier_quantities(specifier, cap_desc, stabilizer_desc, switch_desc, align_to))
+
+    def _resolve_specifier_quantities(self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str, align_to: AlignTo):
+        switch_xya: ty.Dict[str, Quantity] = {
+            SPN_SWITCH_ANGLE: _quantity('0 deg'), SPN_SWITCH_X: _quantity('0 mm'), SPN_SWITCH_Y: _quantity('0 mm'),
+            SPN_STABILIZER_ANGLE: _quantity('0 deg'), SPN_STABILIZER_X: _quantity('0 mm'), SPN_STABILIZER_Y: _quantity('0 mm')}
+        return self._resolve_specifier(specifier, cap_desc, stabilizer_desc, switch_desc, align_to, self._collect_quantities, switch_xya)
+
+    def resolve_specifier_float(
+        self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str, align_to: AlignTo
+    ) -> ty.Tuple[ty.Dict[Part, str], ty.Dict[Part, ty.Dict[str, float]], ty.Dict[Part, str], ty.Dict[Part, float], ty.Dict[str, float]]:
+        '''
+        Same as resolve_specifier(), but the values are float in cm, rad or dimensionless.
+        The compatibility matrix answers instead if it covers the request.
+        '''
+        matrix = self.compatibility_matrix()
+        if matrix is not None:
+            resolution = matrix.resolution(specifier, cap_desc, stabilizer_desc, switch_desc, align_to)
+            if resolution is not None:
+                return _copy_resolution(resolution)
+        return self._resolve_specifier_float(specifier, cap_desc, stabilizer_desc, switch_desc, align_to)
+
+    def _resolve_specifier_float(
+        self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str, align_to: AlignTo
+    ) -> ty.Tuple[ty.Dict[Part, str], ty.Dict[Part, ty.Dict[str, float]], ty.Dict[Part, str], ty.Dict[Part, float], ty.Dict[str, float]]:
+        switch_xya = {n: 0. for n in [SPN_SWITCH_ANGLE, SPN_SWITCH_X, SPN_SWITCH_Y, SPN_STABILIZER_ANGLE, SPN_STABILIZER_X, SPN_STABILIZER_Y]}
+        return self._resolve_specifier(specifier, cap_desc, stabilizer_desc, switch_desc, align_to, self._collect_floats, switch_xya)
+
+    def resolve_many(self, requests: ty.Sequence[SpecifierRequest], as_float: bool = False) -> ty.List[ty.Tuple[ty.Dict, ty.Dict[Part, ty.Dict], ty.Dict, ty.Dict, ty.Dict]]:
+        '''
+        resolve_specifier() (resolve_specifier_float() if as_float) of each request, in the order of requests.
+        Same requests are resolved only once. The results don't share dicts nor quantities, so callers can modify them.
+        Raises the exception of the first failed request.
+        '''
+        unique, inverse = _dedup(requests)
+        resolve = self.resolve_specifier_float if as_float else self._resolve_specifier_quantities
+        copy_resolution = _copy_resolution if as_float else _copy_quantity_resolution
+        results = [resolve(*r) for r in unique]
+        return [copy_resolution(results[i]) for i in inverse]
+
+    def resolve_many_columns(self, requests: ty.Sequence[SpecifierRequest]):
+        '''
+        Same as resolve_many(requests, True), but in columns.
+        '''
+        unique, inverse = _dedup(requests)
+        results = [self.resolve_specifier_float(*r) for r in unique]
+        ii = np.array(inverse, dtype=np.intp)
+
+        def _column(values: ty.List[ty.Optional[float]]):
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)[ii]
+
+        part_filename = {p: [results[i][0][p] for i in inverse] for p in PARTS_WITH_COMPONENT}
+        part_placeholder = {p: [results[i][2][p] for i in inverse] for p in PARTS_WITH_COMPONENT}
+        part_parameters: ty.Dict[Part, ty.Dict[str, np.ndarray]] = {}
+        for p in PARTS_WITH_COMPONENT:
+            names = sorted(set(n for r in results for n in r[1][p].keys()))
+            part_parameters[p] = {n: _column([r[1][p].get(n) for r in results]) for n in names}
+        part_z_pos = {p: _column([r[3].get(p) for r in results]) for p in PARTS_WITH_COMPONENT}
+        switch_xya = {n: _column([r[4][n] for r in results]) for n in results[0][4].keys()} if len(results) > 0 else {}
+        return ResolvedColumns(part_filename, part_parameters, part_placeholder, part_z_pos, switch_xya, ii)
+
+    def _resolve_specifier(
+        self, specifier: str, cap_desc: str, stabilizer_desc: str, switch_desc: str, align_to: AlignTo,
+        collect: ty.Callable[[str, str], ty.Tuple[ty.Dict[str, _V], str]], switch_xya: ty.Dict[str, _V]
+    ) -> ty.Tuple[ty.Dict[Part, str], ty.Dict[Part, ty.Dict[str, _V]], ty.Dict[Part, str], ty.Dict[Part, _V], ty.Dict[str, _V]]:
+        parameters: ty.Dict[str, _V] = {}
         part_filename: ty.Dict[Part, str] = {}
         part_parameter_names: ty.Dict[Part, ty.List[str]] = {}
         part_placeholder: ty.Dict[Part, str] = {}
-        part_height_parameter: ty.Dict[Part, ty.Dict[str, Quantity]] = {}
-        switch_xya: ty.Dict[str, Quantity] = {
-            SPN_SWITCH_ANGLE: Quantity('0 deg'), SPN_SWITCH_X: Quantity('0 mm'), SPN_SWITCH_Y: Quantity('0 mm'),
-            SPN_STABILIZER_ANGLE: Quantity('0 deg'), SPN_STABILIZER_X: Quantity('0 mm'), SPN_STABILIZER_Y: Quantity('0 mm')}  # type: ignore
+        part_height_parameter: ty.Dict[Part, ty.Dict[str, _V]] = {}
         for desc, part in [(cap_desc, Part.Cap), (stabilizer_desc, Part.Stabilizer), (switch_desc, Part.Switch), (switch_desc, Part.PCB)]:
             try:
                 part_filename[part], part_parameter_names[part], path = self._resolve_parameters(specifier, desc, part)
             except ResolveParameterException as e:
                 if part == Part.Cap:
-                    raise SpecifierException(self.read_splitlines_file(self.parts_info_dir / e.path / AVAILABLE_FILENAME), specifier)
+                    raise SpecifierException(self._read_available(e.path), specifier)
                 else:
                     raise Exception(f'Wrong specifier: {specifier}')
-            if part == Part.Cap:
-                available = False
-                lines = []
-                for line in self.read_splitlines_file(self.parts_info_dir / path / AVAILABLE_FILENAME):
-                    lines.append(line)
-                    if re.match(r'^' + line + r'$', specifier) is not None:
-                        available = True
-                        break
-                if not available:
-                    raise SpecifierException(lines, specifier)
-            ps, ph = self._collect_parameters(specifier, path, {})
+            if part == Part.Cap and not self._is_available(path, specifier):
+                raise SpecifierException(list(self._read_available(path)), specifier)
+            qps, ph = collect(specifier, path)
             part_placeholder[part] = ph
-            try:
-                qps: ty.Dict[str, Quantity] = {n: Quantity(v) for n, v in ps.items()}  # type: ignore
-            except pint.errors.UndefinedUnitError as pe:
-                raise Exception('Bad value in parts info:' + str(pe))
             for n in [SPN_CAP_SB_HEIGHT, SPN_SWITCH_SB_HEIGHT, SPN_STABILIZER_SB_HEIGHT, SPN_SWITCH_BOTTOM_HEIGHT]:
                 if n in qps:
                     if part not in part_height_parameter:
@@ -291,7 +1094,7 @@ class PartsInfo:
             if n not in parameters:
                 raise Exception(f'Parts info lacks mandatory parameter: {n} about {p.name} of {cap_desc}, {switch_desc}.')
         travel_gap = parameters[SPN_STABILIZER_TRAVEL] - parameters[SPN_TRAVEL]
-        part_z_pos: ty.Dict[Part, Quantity] = {
+        part_z_pos: ty.Dict[Part, _V] = {
             Part.Cap: - part_height_parameter[Part.Cap][SPN_CAP_SB_HEIGHT],
             Part.Stabilizer: - part_height_parameter[Part.Stabilizer][SPN_STABILIZER_SB_HEIGHT] + travel_gap,
             Part.Switch: - part_height_parameter[Part.Switch][SPN_SWITCH_SB_HEIGHT],
@@ -301,7 +1104,7 @@ class PartsInfo:
             for p in part_z_pos.keys():
                 part_z_pos[p] += part_height_parameter[Part.Cap][SPN_CAP_SB_HEIGHT] + parameters[SPN_TRAVEL] - parameters[SPN_TOP_HEIGHT]  # type: ignore
 
-        part_parameters: ty.Dict[Part, ty.Dict[str, Quantity]] = {}
+        part_parameters: ty.Dict[Part, ty.Dict[str, _V]] = {}
         for part in PARTS_WITH_COMPONENT:
             part_parameters[part] = {}
             for n in set(part_parameter_names[part]) & set(parameters.keys()):
@@ -309,185 +1112,215 @@ class PartsInfo:
 
         return part_filename, part_parameters, part_placeholder, part_z_pos, switch_xya
 
+    def _read_available(self, path: str) -> ty.List[str]:
+        k = _index_key(path)
+        if k not in self.index.availables:
+            raise Exception(f'Wrong path: {path} doesn\'t have {AVAILABLE_FILENAME}.')
+        return self.index.availables[k]
+
+    def _available_matcher(self, path: str):
+        return _AvailableMatcher(self._read_available(path))
+
+    def _is_available(self, path: str, specifier: str) -> bool:
+        return self._available_matcher(path).match(specifier)
+
     def _read_mapping_from_desc(self, desc: str, part: Part) -> ty.Tuple[ty.List[_MappingRow], str]:
         for d, path in self.description_dict[part]:
             if d == desc:
-                mapping: ty.List[_MappingRow] = []
-                with open(self.parts_info_dir / path / MAPPING_FILENAME) as f:
-                    m = csv.reader(f, delimiter=",", doublequote=True, quotechar='"', skipinitialspace=True)
-                    for i, row in enumerate(m):
-                        if i == 0:
-                            if ','.join(row) != 'Specifier,filename,Parameter':
-                                raise Exception(f'Wrong file: {MAPPING_FILENAME} has wrong header.')
-                        else:
-                            mapping.append(_MappingRow(re.compile(row[0]), row[1], row[2].split()))
-                return mapping, path
+                k = _index_key(path)
+                if k not in self.index.mappings:
+                    raise Exception(f'Wrong path: {path} doesn\'t have {MAPPING_FILENAME}.')
+                return self.index.mappings[k], path
         raise Exception(f'Wrong description: {desc} about part: {part.name}')
 
-    @functools.lru_cache(maxsize=None)
     def _resolve_parameters(self, specifier: str, desc: str, part: Part):
         mapping, path = self._read_mapping_from_desc(desc, part)
         for m in mapping:
-            if m.specifier_pattern.search(specifier) is not None:
+            if re.search(m.specifier_pattern, specifier) is not None:
                 return m.filename, m.parameter_names, path
         raise ResolveParameterException(path)
 
-    @functools.lru_cache(maxsize=None)
-    def _list_csv_files(self, path: str) -> ty.List[ty.Tuple[str, ty.List[ty.List[str]]]]:
-        ret: ty.List[ty.Tuple[str, ty.List[ty.List[str]]]] = []
-        for p in (self.parts_info_dir / path).iterdir():
-            if p.is_file() and p.suffix == '.csv' and p.name != MAPPING_FILENAME and p.name != DESCRIPTION_FILENAME:
-                with open(p) as f:
-                    reader = csv.reader(f, delimiter=",", doublequote=True, quotechar='"', skipinitialspace=True)
-                    ret2: ty.List[ty.List[str]] = []
-                    for row in reader:
-                        ret2.append(list(row))
-                    ret.append((str(p), ret2))
-        return ret
+    def _list_csv_files(self, path: str) -> ty.List[_ParameterTable]:
+        k = _index_key(path)
+        if k not in self.index.csv_files:
+            raise Exception(f'Wrong path: {path} is not a directory.')
+        return self.index.csv_files[k]
 
-    def _collect_parameters_rec(self, specifier: str, path: str, parameters: ty.Dict[str, str]) -> ty.Dict[str, str]:
-        for p, reader in self._list_csv_files(path):
-            pns = []
-            for i, row in enumerate(reader):
-                if i == 0:
-                    if row[0] != 'Specifier':
-                        raise Exception(f'Wrong file: {p} has wrong header.')
-                    pns = row
-                else:
-                    if re.search(r'\b' + row[0] + r'\b', specifier) is not None:
-                        for n, v in zip(pns[1:], row[1:]):
-                            if n not in parameters:
-                                parameters[n] = v
-                        break
+    def _collect_parameters_rec(self, specifier: str, path: str) -> ty.Dict[str, ty.Tuple[str, ty.Optional[float]]]:
+        '''
+        {name: (value, parameter_to_float(value))}. Don't modify the returned dict. It is memoized.
+        '''
+        parameters: ty.Dict[str, ty.Tuple[str, ty.Optional[float]]] = {}
+        for t in self._list_csv_files(path):
+            i = t.matcher.first_match(specifier)
+            if i is not None:
+                for n, v, fv in zip(t.parameter_names, t.rows[i], t.float_rows[i]):
+                    if n not in parameters:
+                        parameters[n] = (v, fv)
         if path != '':
             parent, _ = os.path.split(path)
-            return self._collect_parameters_rec(specifier, parent, parameters)
-        else:
-            return parameters
+            for n, vfv in self._collect_parameters_rec(specifier, parent).items():
+                if n not in parameters:
+                    parameters[n] = vfv
+        return parameters
 
-    def _collect_parameters(self, specifier: str, path: str, parameters: ty.Dict[str, str]) -> ty.Tuple[ty.Dict[str, str], str]:
-        parameters = self._collect_parameters_rec(specifier, path, parameters)
+    def _collect_parameters(self, specifier: str, path: str) -> ty.Tuple[ty.Dict[str, str], str]:
+        parameters = {n: v for n, (v, _) in self._collect_parameters_rec(specifier, path).items()}
         ph = 'Placeholder'
         if 'Placeholder' in parameters:
             ph = parameters.pop('Placeholder')
         return parameters, ph
 
     def resolve_kle(self, kle_json_path: os.PathLike, image_output_dir: ty.Optional[os.PathLike]):
+        columns, min_xyu, max_xyu = self.resolve_kle_columns(kle_json_path, image_output_dir)
+        return columns.to_specs_ops_on_pn(), min_xyu, max_xyu
+
+    def resolve_kle_columns(self, kle_json_path: os.PathLike, image_output_dir: ty.Optional[os.PathLike], previous: ty.Optional[KleColumns] = None):
+        '''
+        Same as resolve_kle(), but the result is KleColumns instead of SpecsOpsOnPn.
+        previous is the result of the layout before editing. Its images of unchanged and moved keys are reused,
+        and only the other keys are scraped. If the keyboard metadata has been changed, all keys are scraped.
+        '''
+        import json5
         image_output_dir = None if image_output_dir is None else pathlib.Path(image_output_dir)
-        # op: OccurrenceParameter, pn: pattern name
-        specs_ops_on_pn: SpecsOpsOnPn = defaultdict(list)
-        vertices: ty.Set[ty.Tuple[float, float]] = set()
+        with open(kle_json_path, 'r', encoding='utf-8') as f:
+            rows = json5.loads(f.read())
+        kle_meta = _kle_meta(rows)
 
+        scraped: ty.Container[int]  # i_kle of the keys whose images are just scraped
         if image_output_dir is None:
             import pykle_serial as kle_serial
-            with open(kle_json_path, 'r', encoding='utf-8') as f:
-                json = f.read()
-            keyboard = kle_serial.parse(json)
-        else:
+            keyboard = kle_serial.deserialize(rows)
+            scraped = ()
+        elif previous is None or previous.image_output_dir is None or previous.kle_meta != kle_meta:
             from kle_scraper import scrape
             keyboard = scrape(kle_json_path, image_output_dir)
+            scraped = range(len(keyboard.keys)) if keyboard is not None else ()
+        else:
+            keyboard, scraped = _scrape_kle_incrementally(rows, image_output_dir, previous)
         if keyboard is None:
             raise Exception('Bad KLE file or image_output_dir.')
-        for i, k in enumerate(keyboard.keys):
-            inner_vertices: ty.Set[ty.Tuple[float, float]] = set()
-
-            def _add_inner_vertex(x: float, y: float, w: float, h: float):
-                inner_vertices.add((x, y))
-                inner_vertices.add((x + w, y))
-                inner_vertices.add((x + w, y + h))
-                inner_vertices.add((x, y + h))
-
-            specs: ty.List[str] = []
-            pattern_rotation = None
-            center_xu = 0  # unit
-            center_yu = 0  # unit
-            image_center_offset_u = (0., 0.)  # unit
-            image_whu = (0., 0.)  # unit
-            if len(k.profile) > 0:
-                specs.append(k.profile)
-            if k.stepped:
-                specs.append('Stepped')
-            wh = sorted([k.width, k.height])
-            if wh[0] == 1 and k.width2 == k.width and k.height == k.height2 and k.x2 == 0 and k.y2 == 0:
-                if k.height > k.width:
-                    pattern_rotation = Image.Transpose.ROTATE_90
-                w = wh[1]
-                if w == 1:
-                    if k.nub:
-                        specs.append('Homing')
-                if w >= 5:
-                    specs.append('Spacebar')
-                pattern_name = width_u_to_str(w)
-                specs.append(pattern_name)
-
-                center_xu = k.x + k.width / 2
-                center_yu = k.y + k.height / 2
-                image_center_offset_u = (0., 0.)
-                _add_inner_vertex(k.x, k.y, k.width, k.height)
-            else:
-                AREA_SIZE = 64
-                AREA_CENTER = AREA_SIZE // 2
-                area = np.zeros([AREA_SIZE, AREA_SIZE], np.bool_)
-                area[AREA_CENTER: AREA_CENTER + round(k.height * 4), AREA_CENTER:AREA_CENTER + round(k.width * 4)] = True
-                area[AREA_CENTER + round(k.y2 * 4): AREA_CENTER + round((k.height2 + k.y2) * 4),
-                     AREA_CENTER + round(k.x2 * 4):AREA_CENTER + round((k.width2 + k.x2) * 4)] = True
-
-                def _find():
-                    for pattern_name, pattern in KEY_AREA_PATTERN_DIC.items():
-                        rp = pattern
-                        for r in [None, Image.Transpose.ROTATE_270, Image.Transpose.ROTATE_180, Image.Transpose.ROTATE_90]:
-                            hit = np.all(sliding_window_view(area, rp.shape) == rp, (2, 3))
-                            if np.any(hit):
-                                hit_iy, hit_ix = np.argwhere(hit)[0]
-                                ca = np.copy(area)
-                                ca[hit_iy:hit_iy + rp.shape[0], hit_ix:hit_ix + rp.shape[1]] = False
-                                if np.any(ca):
-                                    continue
-                                y, x = (np.argwhere(hit)[0] - AREA_CENTER) / 4
-                                h = rp.shape[0] / 4
-                                w = rp.shape[1] / 4
-                                _add_inner_vertex(k.x + x, k.y + y, w, h)
-                                center_xu = k.x + x + w / 2
-                                center_yu = k.y + y + h / 2
-                                return pattern_name, r, (center_xu, center_yu), (k.x + k.width / 2 - center_xu, k.y + k.height / 2 - center_yu)
-                            rp = np.rot90(rp)
-                    raise Exception(f'Invalid key form: w:{k.width} w2:{k.width2} h:{k.height} h2:{k.height2} x:{k.x} y:{k.y} x2:{k.x2} y2:{k.y2} is invalid.')
-
-                pattern_name, pattern_rotation, (center_xu, center_yu), image_center_offset_u = _find()
-                specs = [pattern_name]
-            image_whu = (k.width, k.height)
-            image_path = None if image_output_dir is None else image_output_dir / f'{i}.png'
-            angle = k.rotation_angle  # clockwise degree
-            if pattern_rotation is not None:
-                if image_path is not None:
-                    image = Image.open(image_path)
-                    image = image.transpose(pattern_rotation)
-                    image.save(image_path)
-                angle += {
-                    Image.Transpose.ROTATE_270: -90,
-                    Image.Transpose.ROTATE_180: 180,
-                    Image.Transpose.ROTATE_90: 90
-                }[pattern_rotation]
-                rot_mat = np.array({
-                    Image.Transpose.ROTATE_90: [[0., 1.], [-1., 0.]],
-                    Image.Transpose.ROTATE_180: [[-1., 0.], [0., -1.]],
-                    Image.Transpose.ROTATE_270: [[0., -1.], [1., 0.]],
-                }[pattern_rotation])
-                image_center_offset_u = ty.cast(ty.Tuple[float, float], tuple(rot_mat @ np.array(image_center_offset_u)))
-                image_whu = image_whu if pattern_rotation == Image.Transpose.ROTATE_180 else (image_whu[1], image_whu[0])
-            if k.rotation_angle != 0:
-                orig_mat = np.array([[1., 0., -k.rotation_x], [0., 1., -k.rotation_y], [0., 0., 1.]])
-                trans_mat = np.array([[1., 0., k.rotation_x], [0., 1., k.rotation_y], [0., 0., 1.]])
-                r = k.rotation_angle * np.pi / 180
-                rot_mat = np.array([[np.cos(r), -np.sin(r), 0.], [np.sin(r), np.cos(r), 0.], [0., 0., 1.]])
-                center_xu, center_yu, _ = trans_mat @ rot_mat @ orig_mat @ np.array([center_xu, center_yu, 1.])
-                for vx, vy in inner_vertices:
-                    rvx, rvy, _ = trans_mat @ rot_mat @ orig_mat @ np.array([vx, vy, 1.])
-                    vertices.add((rvx, rvy))
-            else:
-                vertices |= inner_vertices
-            op = OccurrenceParameter((center_xu, center_yu), image_center_offset_u, image_whu, angle, k.labels, image_path, i)
-            specifier = ' '.join(specs)
-            specs_ops_on_pn[pattern_name].append((specifier, op))
-        vs = np.array(list(vertices))
-        return specs_ops_on_pn, tuple(np.min(vs, axis=0)), tuple(np.max(vs, axis=0))
+        keys = keyboard.keys
+        n_keys = len(keys)
+        kle_xy = np.array([[k.x, k.y] for k in keys], dtype=np.float64).reshape(n_keys, 2)
+        kle_wh = np.array([[k.width, k.height] for k in keys], dtype=np.float64).reshape(n_keys, 2)
+        kle_rotation = np.array([[k.rotation_x, k.rotation_y, k.rotation_angle] for k in keys], dtype=np.float64).reshape(n_keys, 3)
+
+        # Pattern stage: specifier, pattern and its rectangle in the key (before KLE rotation) of each key.
+        specifiers: ty.List[str] = []
+        pattern_names: ty.List[str] = []
+        pattern_rotations: ty.List[ty.Optional[Image.Transpose]] = []
+        pattern_xy = np.zeros((n_keys, 2), dtype=np.float64)  # relative to (k.x, k.y)
+        pattern_wh = kle_wh.copy()
+        for i, k in enumerate(keys):
+            kp = _key_pattern(k.profile, k.stepped, k.nub, k.width, k.height, k.width2, k.height2, k.x2, k.y2)
+            if kp is None:
+                raise Exception(f'Invalid key form: w:{k.width} w2:{k.width2} h:{k.height} h2:{k.height2} x:{k.x} y:{k.y} x2:{k.x2} y2:{k.y2} is invalid.')
+            specifier, pattern_name, pattern_rotation, p_xy, p_wh = kp
+            if p_xy is not None:
+                pattern_xy[i] = p_xy
+                pattern_wh[i] = p_wh
+            specifiers.append(specifier)
+            pattern_names.append(pattern_name)
+            pattern_rotations.append(pattern_rotation)
+
+        # Geometry stage: the whole keyboard at once.
+        pattern_origin = kle_xy + pattern_xy
+        center = pattern_origin + pattern_wh / 2
+        image_center_offset = kle_xy + kle_wh / 2 - center
+        corner_x = pattern_origin[:, [0]] + pattern_wh[:, [0]] * np.array([[0., 1., 1., 0.]])
+        corner_y = pattern_origin[:, [1]] + pattern_wh[:, [1]] * np.array([[0., 0., 1., 1.]])
+        # Points to be rotated by KLE rotation: center and four corners, in homogeneous coordinates.
+        points = np.stack([np.concatenate([center[:, [0]], corner_x], 1), np.concatenate([center[:, [1]], corner_y], 1), np.ones((n_keys, 5))], 1)
+        rotated = kle_rotation[:, 2] != 0
+        if np.any(rotated):
+            rotation = kle_rotation[rotated]
+            n_rotated = len(rotation)
+            orig_mat = np.tile(np.eye(3), (n_rotated, 1, 1))
+            orig_mat[:, :2, 2] = - rotation[:, :2]
+            trans_mat = np.tile(np.eye(3), (n_rotated, 1, 1))
+            trans_mat[:, :2, 2] = rotation[:, :2]
+            r = rotation[:, 2] * np.pi / 180
+            rot_mat = np.tile(np.eye(3), (n_rotated, 1, 1))
+            rot_mat[:, 0, 0] = np.cos(r)
+            rot_mat[:, 0, 1] = - np.sin(r)
+            rot_mat[:, 1, 0] = np.sin(r)
+            rot_mat[:, 1, 1] = np.cos(r)
+            points[rotated] = trans_mat @ rot_mat @ orig_mat @ points[rotated]
+        vertices = points[:, :2, 1:].transpose(0, 2, 1).reshape(-1, 2)
+        center = points[:, :2, 0]
+
+        angle = kle_rotation[:, 2].copy()
+        image_whu = kle_wh.copy()
+        image_rot_mat = {
+            Image.Transpose.ROTATE_90: np.array([[0., 1.], [-1., 0.]]),
+            Image.Transpose.ROTATE_180: np.array([[-1., 0.], [0., -1.]]),
+            Image.Transpose.ROTATE_270: np.array([[0., -1.], [1., 0.]]),
+        }
+        image_works: ty.List[ty.Tuple[pathlib.Path, Image.Transpose]] = []
+        for i, pattern_rotation in enumerate(pattern_rotations):
+            if pattern_rotation is None:
+                continue
+            if image_output_dir is not None and i in scraped:
+                image_works.append((image_output_dir / f'{i}.png', pattern_rotation))
+            angle[i] += {
+                Image.Transpose.ROTATE_270: -90,
+                Image.Transpose.ROTATE_180: 180,
+                Image.Transpose.ROTATE_90: 90
+            }[pattern_rotation]
+            image_center_offset[i] = image_rot_mat[pattern_rotation] @ image_center_offset[i]
+            if pattern_rotation != Image.Transpose.ROTATE_180:
+                image_whu[i] = image_whu[i, ::-1]
+        _transpose_images(image_works)
+
+        # op: OccurrenceParameter, pn: pattern name
+        order_on_pn: ty.Dict[str, ty.List[int]] = defaultdict(list)
+        for i, pattern_name in enumerate(pattern_names):
+            order_on_pn[pattern_name].append(i)
+        order: ty.List[int] = []
+        pattern_slices: ty.Dict[str, slice] = {}
+        for pattern_name, ii in order_on_pn.items():
+            pattern_slices[pattern_name] = slice(len(order), len(order) + len(ii))
+            order.extend(ii)
+        columns = np.zeros(n_keys, dtype=_kle_key_dtype())
+        columns['i_kle'] = order
+        columns['center_xyu'] = center[order]
+        columns['image_center_offset_u'] = image_center_offset[order]
+        columns['image_whu'] = image_whu[order]
+        columns['angle'] = angle[order]
+        kle_columns = KleColumns(columns, [specifiers[i] for i in order], [keys[i].labels for i in order], pattern_slices, image_output_dir, keys, kle_meta)
+        return kle_columns, tuple(np.min(vertices, axis=0)), tuple(np.max(vertices, axis=0))
+
+
+_PARTS_INFO_REGISTRY: ty.Dict[pathlib.Path, PartsInfo] = {}
+_PARTS_INFO_CHECKED: ty.Dict[pathlib.Path, float] = {}  # time.monotonic() of the last check
+
+
+def get_parts_info(parts_info_dir: ty.Union[os.PathLike, str], reload: bool = False):
+    '''
+    The shared PartsInfo of the directory in this process, so memoized resolutions survive across commands.
+    It is invalidated when a source file has been changed. The directories are checked at most once per PARTS_INFO_CHECK_INTERVAL,
+    so a file modified in place is noticed only if reload. reload checks every source file.
+    '''
+    key = pathlib.Path(parts_info_dir).resolve()
+    now = time.monotonic()
+    if key in _PARTS_INFO_REGISTRY:
+        pi = _PARTS_INFO_REGISTRY[key]
+        if reload or now - _PARTS_INFO_CHECKED[key] >= PARTS_INFO_CHECK_INTERVAL:
+            if pi.is_changed(reload):
+                pi.invalidate()
+            _PARTS_INFO_CHECKED[key] = time.monotonic()
+        return pi
+    pi = PartsInfo(key)
+    _PARTS_INFO_REGISTRY[key] = pi
+    _PARTS_INFO_CHECKED[key] = time.monotonic()
+    return pi
+
+
+def __getattr__(name: str):
+    # Module constants built at the first use.
+    if name == 'KEY_AREA_PATTERN_DIC':
+        return _key_area_pattern_dic()
+    if name == 'KLE_KEY_DTYPE':
+        return _kle_key_dtype()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,6 +1,10 @@
+import os
 import pathlib
+import shutil
 import sys
+import tempfile
 import unittest
+import unittest.mock
 import pickle
 
 CURRENT_DIR = pathlib.Path(__file__).parent.parent
@@ -62,7 +66,30 @@ class TestPartsResolver(unittest.TestCase):
             #     pickle.dump(result, f)
             with open(f'test_data/kle/{fn}.pkl', 'rb') as f:
                 oracle = pickle.load(f)
-            self.assertEqual(result, oracle)
+            self.assert_kle_resolution_almost_equal(result, oracle, fn)
+
+    def assert_kle_resolution_almost_equal(self, result, oracle, msg: str):
+        # Only the geometry of rotated keys can differ in the last bit from the oracles. Others should be exactly equal.
+        specs_ops_on_pn, min_xyu, max_xyu = result
+        o_specs_ops_on_pn, o_min_xyu, o_max_xyu = oracle
+        self.assertEqual(list(specs_ops_on_pn.keys()), list(o_specs_ops_on_pn.keys()), msg)
+        rotated = False
+        for pn, specs_ops in specs_ops_on_pn.items():
+            o_specs_ops = o_specs_ops_on_pn[pn]
+            self.assertEqual([s for s, _ in specs_ops], [s for s, _ in o_specs_ops], msg)
+            for (_, op), (_, o_op) in zip(specs_ops, o_specs_ops):
+                if o_op.angle == 0.:
+                    self.assertEqual(op, o_op, f'{msg}: {pn}')
+                    continue
+                rotated = True
+                for n in ['center_xyu', 'image_center_offset_u', 'image_whu', 'angle']:
+                    self.assertTrue(np.allclose(getattr(op, n), getattr(o_op, n), rtol=0., atol=1e-12), f'{msg}: {pn} {n}')
+                for n in ['legend', 'image_file_path', 'i_kle']:
+                    self.assertEqual(getattr(op, n), getattr(o_op, n), f'{msg}: {pn} {n}')
+        if rotated:
+            self.assertTrue(np.allclose(min_xyu, o_min_xyu, rtol=0., atol=1e-12) and np.allclose(max_xyu, o_max_xyu, rtol=0., atol=1e-12), msg)
+        else:
+            self.assertEqual((min_xyu, max_xyu), (o_min_xyu, o_max_xyu), msg)
 
     def test_resolve_specifier(self):
         pi = parts_resolver.PartsInfo(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME)
@@ -98,3 +125,379 @@ class TestPartsResolver(unittest.TestCase):
                 result = pi.resolve_specifier(specifier, 'DSA', 'Cherry-style plate mount', 'Choc V2', parts_resolver.AlignTo.TravelBottom)
                 if result is None:
                     raise Exception(f'The part is not available. specifier: {specifier}')
+
+    def test_parts_info_index(self):
+        with tempfile.TemporaryDirectory() as td:
+            pi_dir = pathlib.Path(td) / parts_resolver.PARTS_INFO_DIRNAME
+            shutil.copytree(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME, pi_dir, ignore=shutil.ignore_patterns(parts_resolver.INDEX_FILENAME))
+            pi = parts_resolver.PartsInfo(pi_dir)
+            self.assertTrue((pi_dir / parts_resolver.INDEX_FILENAME).exists())
+            self.assertEqual(list(pi_dir.glob('*.tmp')), [])
+            result = pi.resolve_specifier('R4 2u', 'OEM profile', 'Cherry-style plate mount', 'MX', parts_resolver.AlignTo.StemBottom)
+
+            with unittest.mock.patch.object(parts_resolver, 'compile_parts_info', side_effect=AssertionError('Index not used.')), \
+                    unittest.mock.patch.object(parts_resolver, '_source_signature', side_effect=AssertionError('Files checked.')):
+                pi = parts_resolver.PartsInfo(pi_dir)
+            self.assertEqual(result, pi.resolve_specifier('R4 2u', 'OEM profile', 'Cherry-style plate mount', 'MX', parts_resolver.AlignTo.StemBottom))
+            with open(pi_dir / parts_resolver.INDEX_FILENAME, 'rb') as f:
+                index = pickle.load(f)
+            self.assertIsInstance(index.mappings['mx_oem'][0].specifier_pattern, str)  # Not re.Pattern
+            self.assertIsNone(index.csv_files['mx_oem'][0].matcher.patterns)
+
+            # Modified in place: the directory mtime doesn't change, so only an explicit check notices it.
+            height_csv = pi_dir / 'mx_oem' / 'stem_bottom_height.csv'
+            st = height_csv.stat()
+            dir_st = height_csv.parent.stat()
+            with open(height_csv) as f:
+                text = f.read()
+            with open(height_csv, 'w') as f:
+                f.write(text.replace('1.2 mm', '2.2 mm'))
+            os.utime(height_csv, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+            os.utime(height_csv.parent, ns=(dir_st.st_atime_ns, dir_st.st_mtime_ns))
+            pi = parts_resolver.PartsInfo(pi_dir)
+            self.assertFalse(pi.is_changed(False))
+            self.assertTrue(pi.is_changed())
+            pi.invalidate()
+            _, _, _, part_z_pos, _ = pi.resolve_specifier('R4 2u', 'OEM profile', 'Cherry-style plate mount', 'MX', parts_resolver.AlignTo.StemBottom)
+            self.assertAlmostEqual((part_z_pos[parts_resolver.Part.Cap] - result[3][parts_resolver.Part.Cap]).m_as('mm'), -1.)
+
+            # Saved by renaming: the directory mtime changes.
+            with open(height_csv.with_suffix('.tmp'), 'w') as f:
+                f.write(text.replace('1.2 mm', '3.2 mm'))
+            os.replace(height_csv.with_suffix('.tmp'), height_csv)
+            os.utime(height_csv.parent, ns=(dir_st.st_atime_ns, dir_st.st_mtime_ns + 2_000_000_000))
+            pi = parts_resolver.PartsInfo(pi_dir)
+            _, _, _, part_z_pos, _ = pi.resolve_specifier('R4 2u', 'OEM profile', 'Cherry-style plate mount', 'MX', parts_resolver.AlignTo.StemBottom)
+            self.assertAlmostEqual((part_z_pos[parts_resolver.Part.Cap] - result[3][parts_resolver.Part.Cap]).m_as('mm'), -2.)
+
+    def test_specifier_matcher(self):
+        m = parts_resolver._SpecifierMatcher(['R1|R2', 'Homing', '.*u', '.*'])
+        self.assertEqual(m.first_match('Homing 1u'), 1)
+        self.assertEqual(m.first_match('R2 1u'), 0)
+        self.assertEqual(m.first_match('XR1 2u'), 2)  # r'\bR1|R2\b' is r'(\bR1)|(R2\b)'
+        self.assertEqual(m.first_match('XR2 2u'), 0)
+        self.assertEqual(m.first_match('Spacebar'), 3)
+        self.assertIsNone(parts_resolver._SpecifierMatcher(['1u']).first_match('11u'))
+        self.assertEqual(parts_resolver._SpecifierMatcher([r'(a)\1', 'b']).first_match('b aa'), 0)
+
+    def test_get_parts_info(self):
+        with tempfile.TemporaryDirectory() as td:
+            pi_dir = pathlib.Path(td) / parts_resolver.PARTS_INFO_DIRNAME
+            shutil.copytree(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME, pi_dir, ignore=shutil.ignore_patterns(parts_resolver.INDEX_FILENAME))
+            pi = parts_resolver.get_parts_info(pi_dir)
+            self.assertIs(pi, parts_resolver.get_parts_info(pi_dir / '..' / parts_resolver.PARTS_INFO_DIRNAME))
+            pi.resolve_pcb_wiring('1u', 'Choc V2')
+            self.assertGreater(pi._resolve_parameters.cache_info().currsize, 0)  # type: ignore
+
+            description_csv = pi_dir / parts_resolver.DESCRIPTION_FILENAME
+            with open(description_csv) as f:
+                text = f.read()
+            with open(description_csv, 'w') as f:
+                f.write(text.rstrip('\n') + '\nWiring,Choc V2 copy,wiring_choc_pcb\n')
+            self.assertTrue(pi.is_changed())
+            with unittest.mock.patch.object(parts_resolver, '_quick_signature', side_effect=AssertionError('Checked in the interval.')):
+                self.assertIs(pi, parts_resolver.get_parts_info(pi_dir))
+            self.assertIs(pi, parts_resolver.get_parts_info(pi_dir, reload=True))
+            self.assertFalse(pi.is_changed())
+            self.assertEqual(pi._resolve_parameters.cache_info().currsize, 0)  # type: ignore
+            self.assertEqual(pi.resolve_pcb_wiring('1u', 'Choc V2 copy'), pi.resolve_pcb_wiring('1u', 'Choc V2'))
+
+    def test_resolve_float(self):
+        pi = parts_resolver.PartsInfo(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME)
+
+        def to_float(q):
+            return q.m_as('rad') if q.is_compatible_with('rad') else q.m_as('cm')
+
+        for specifier in ['R4 2u', 'R2 Homing 1u', 'R1 Spacebar 625u', 'R3 Vertical 2u', 'ISO_Enter']:
+            part_filename, part_parameters, part_placeholder, part_z_pos, switch_xya = pi.resolve_specifier(
+                specifier, 'OEM profile', 'Cherry-style plate mount', 'Choc V2', parts_resolver.AlignTo.TravelBottom)
+            f_part_filename, f_part_parameters, f_part_placeholder, f_part_z_pos, f_switch_xya = pi.resolve_specifier_float(
+                specifier, 'OEM profile', 'Cherry-style plate mount', 'Choc V2', parts_resolver.AlignTo.TravelBottom)
+            self.assertEqual(part_filename, f_part_filename)
+            self.assertEqual(part_placeholder, f_part_placeholder)
+            for p, ps in part_parameters.items():
+                self.assertEqual({n: to_float(v) for n, v in ps.items()}, f_part_parameters[p])
+            for p, z in part_z_pos.items():
+                self.assertAlmostEqual(to_float(z), f_part_z_pos[p])
+            for n, v in switch_xya.items():
+                self.assertAlmostEqual(to_float(v), f_switch_xya[n])
+            self.assertEqual({n: to_float(v) for n, v in pi.resolve_decal(specifier, 'OEM profile').items()}, pi.resolve_decal_float(specifier, 'OEM profile'))
+
+        filename, params = pi.resolve_pcb_wiring('1u LED', 'Choc V2')
+        self.assertEqual((filename, {n: to_float(v) for n, v in params.items()}), pi.resolve_pcb_wiring_float('1u LED', 'Choc V2'))
+        self.assertEqual(parts_resolver.parameter_to_float('-0.5mm'), -0.05)
+        self.assertAlmostEqual(parts_resolver.parameter_to_float('1 inch'), 2.54)  # type: ignore
+        self.assertIsNone(parts_resolver.parameter_to_float('Placeholder_Bump'))
+
+    def test_resolve_many(self):
+        pi = parts_resolver.PartsInfo(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME)
+        descs = ('OEM profile', 'Cherry-style plate mount', 'MX', parts_resolver.AlignTo.StemBottom)
+        requests = [(s, ) + descs for s in ['R4 1u', 'R4 2u', 'R4 1u', 'ISO_Enter', 'R4 1u']]
+        results = pi.resolve_many(requests)  # type: ignore
+        self.assertEqual(len(results), len(requests))
+        for r, result in zip(requests, results):
+            self.assertEqual(result, pi.resolve_specifier(*r))
+        del results[0][3][parts_resolver.Part.Stabilizer]
+        self.assertIn(parts_resolver.Part.Stabilizer, results[2][3])
+
+        float_results = pi.resolve_many(requests, True)  # type: ignore
+        columns = pi.resolve_many_columns(requests)  # type: ignore
+        self.assertEqual(list(columns.unique_index), [0, 1, 0, 2, 0])
+        for i, (part_filename, part_parameters, part_placeholder, part_z_pos, switch_xya) in enumerate(float_results):
+            for p in parts_resolver.PARTS_WITH_COMPONENT:
+                self.assertEqual(columns.part_filename[p][i], part_filename[p])
+                self.assertEqual(columns.part_placeholder[p][i], part_placeholder[p])
+                self.assertEqual(columns.part_z_pos[p][i], part_z_pos[p])
+                for n, v in columns.part_parameters[p].items():
+                    if n in part_parameters[p]:
+                        self.assertEqual(v[i], part_parameters[p][n])
+                    else:
+                        self.assertTrue(np.isnan(v[i]))
+            for n, v in columns.switch_xya.items():
+                self.assertEqual(v[i], switch_xya[n])
+
+        wiring_requests = [('1u', 'Choc V2'), ('1u LED', 'Choc V2'), ('1u', 'Choc V2')]
+        self.assertEqual(pi.resolve_pcb_wiring_many(wiring_requests, True), [pi.resolve_pcb_wiring_float(*r) for r in wiring_requests])
+
+    def test_key_shape_index(self):
+        index = parts_resolver._key_shape_index()
+        iso = parts_resolver.KEY_AREA_PATTERN_DIC['ISO_Enter']
+        for k, r in enumerate([None, Image.Transpose.ROTATE_270, Image.Transpose.ROTATE_180, Image.Transpose.ROTATE_90]):
+            rp = np.rot90(iso, k)
+            self.assertEqual(index[rp.shape, np.packbits(rp).tobytes()], ('ISO_Enter', r))
+        one_u = parts_resolver.KEY_AREA_PATTERN_DIC['1u']
+        self.assertEqual(index[one_u.shape, np.packbits(one_u).tobytes()], ('1u', None))
+        two_u = parts_resolver.KEY_AREA_PATTERN_DIC['2u']
+        self.assertEqual(index[(8, 4), np.packbits(two_u.T).tobytes()], ('2u', Image.Transpose.ROTATE_270))
+
+    def test_resolve_kle_columns(self):
+        pi = parts_resolver.PartsInfo(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME)
+        columns, min_xyu, max_xyu = pi.resolve_kle_columns(pathlib.Path('test_data/kle/iso105.json'), None)
+        with open('test_data/kle/iso105.pkl', 'rb') as f:
+            specs_ops_on_pn, oracle_min_xyu, oracle_max_xyu = pickle.load(f)
+        self.assertEqual((min_xyu, max_xyu), (oracle_min_xyu, oracle_max_xyu))
+        self.assertEqual(columns.to_specs_ops_on_pn(), specs_ops_on_pn)
+        self.assertEqual(len(columns.keys), sum(len(specs_ops) for specs_ops in specs_ops_on_pn.values()))
+        iso_enter = columns.on_pattern('ISO_Enter')
+        self.assertIs(iso_enter.base, columns.keys)
+        self.assertEqual(len(iso_enter), 1)
+        _, op = specs_ops_on_pn['ISO_Enter'][0]
+        self.assertEqual(tuple(iso_enter[0]['center_xyu']), op.center_xyu)
+        self.assertEqual(pickle.loads(pickle.dumps(columns)).to_specs_ops_on_pn(), specs_ops_on_pn)
+
+    def test_resolve_kle_incrementally(self):
+        import json
+        pi = parts_resolver.PartsInfo(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME)
+        with open('test_data/kle/iso105.json', 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+        with tempfile.TemporaryDirectory() as td:
+            old_dir, new_dir = pathlib.Path(td) / 'old', pathlib.Path(td) / 'new'
+            old_dir.mkdir()
+            previous, _, _ = pi.resolve_kle_columns(pathlib.Path('test_data/kle/iso105.json'), None)
+            previous.image_output_dir = old_dir
+            for i in range(len(previous.kle_keys)):
+                (old_dir / f'{i}.png').write_bytes(str(i).encode())
+
+            rows[0][0] = 'Escape'
+            del rows[0][3]  # F2
+            kle_json_path = pathlib.Path(td) / 'edited.json'
+            with open(kle_json_path, 'w', encoding='utf-8') as f:
+                json.dump(rows, f)
+
+            scraped_keys = []
+
+            def scrape_keys(rows, keys, ii, image_output_dir):
+                scraped_keys.extend(ii)
+                for i in ii:
+                    (image_output_dir / f'{i}.png').write_bytes(b'scraped')
+
+            with unittest.mock.patch.object(parts_resolver, '_scrape_keys', side_effect=scrape_keys):
+                columns, min_xyu, max_xyu = pi.resolve_kle_columns(kle_json_path, new_dir, previous)
+            oracle, oracle_min_xyu, oracle_max_xyu = pi.resolve_kle_columns(kle_json_path, None)
+
+            diff = parts_resolver.diff_kle_keys(previous.kle_keys, columns.kle_keys)
+            self.assertEqual(diff.added, [0])
+            self.assertEqual(diff.removed, [0, 2])
+            self.assertEqual(diff.moved, [(i, i - 1) for i in range(3, 16)])
+            self.assertEqual(diff.unchanged, [(1, 1)] + [(i, i - 1) for i in range(16, 105)])
+            self.assertEqual(scraped_keys, [0])
+            self.assertEqual((new_dir / '0.png').read_bytes(), b'scraped')
+            for i_old, i_new in diff.moved + diff.unchanged:
+                self.assertEqual((new_dir / f'{i_new}.png').read_bytes(), str(i_old).encode())
+            self.assertEqual((min_xyu, max_xyu), (oracle_min_xyu, oracle_max_xyu))
+            self.assertTrue(np.array_equal(columns.keys, oracle.keys))
+
+            # Other keyboard metadata, so the keys can look different. All keys are scraped.
+            import kle_scraper
+            import pykle_serial as kle_serial
+            previous.kle_meta = {'backcolor': '#000000'}
+            scraped_keys.clear()
+
+            def scrape(kle_json_path, image_output_dir):
+                with open(kle_json_path, 'r', encoding='utf-8') as f:
+                    keyboard = kle_serial.parse(f.read())
+                for i in range(len(keyboard.keys)):
+                    Image.new('RGBA', (2, 1)).save(image_output_dir / f'{i}.png')
+                return keyboard
+
+            with unittest.mock.patch.object(parts_resolver, '_scrape_keys', side_effect=scrape_keys), \
+                    unittest.mock.patch.object(kle_scraper, 'scrape', side_effect=scrape) as m:
+                pi.resolve_kle_columns(kle_json_path, new_dir, previous)
+            self.assertEqual(m.call_count, 1)
+            self.assertEqual(scraped_keys, [])
+            self.assertNotEqual((new_dir / '1.png').read_bytes(), b'1')
+
+    def test_reduced_kle_rows(self):
+        import json
+        import json5
+        import pykle_serial as kle_serial
+        inherited = [
+            {'backcolor': '#222222', 'css': '.keycap { font-family: serif; }'},
+            [{'a': 0, 'f': 5, 'f2': 2, 'c': '#ff0000', 't': '#00ff00\n#0000ff', 'p': 'DSA', 'sm': 'cherry'}, 'A\nB\nC', {'a': 7, 'fa': [1, 2, 3]}, 'D\nE\nF'],
+            [{'a': 4, 'g': True, 'p': ''}, 'G\nH\n\n\nI', {'x': 0.5, 'n': True, 'd': True}, 'J', 'J2'],
+            [{'r': 15, 'rx': 3, 'ry': 1, 'y': -0.5, 'a': 6, 't': '#123456'}, 'K\nL', {'w': 1.5, 'l': True, 'w2': 1, 'x2': 0.5, 'h2': 2}, 'M', 'N'],
+        ]
+        layouts = [inherited]
+        for fn in sorted(pathlib.Path('test_data/kle').glob('*.json')):
+            with open(fn, 'r', encoding='utf-8') as f:
+                layouts.append(json5.load(f))
+        rng = np.random.default_rng(0)
+        for rows in layouts:
+            keys = kle_serial.deserialize(rows).keys
+            n = len(keys)
+            for ii in [list(range(n)), [], list(range(0, n, 2)), list(range(1, n, 2)), [int(i) for i in rng.permutation(n)[:n // 3]]]:
+                ii_file, reduced_rows = parts_resolver._reduced_kle_rows(rows, keys, ii)
+                self.assertEqual(ii_file, sorted(ii))
+                self.assertEqual(parts_resolver._kle_meta(reduced_rows), parts_resolver._kle_meta(rows))
+                reduced_keys = kle_serial.deserialize(json.loads(json.dumps(reduced_rows))).keys
+                self.assertEqual(len(reduced_keys), len(ii))
+                for i, rk in zip(ii_file, reduced_keys):
+                    k = keys[i]
+                    self.assertAlmostEqual(rk.x, k.x)
+                    self.assertAlmostEqual(rk.y, k.y)
+                    rk.x, rk.y = k.x, k.y
+                    self.assertEqual(rk, k)
+
+    def test_transpose_images(self):
+        rotations = [Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_180, Image.Transpose.ROTATE_270] * 3
+        with tempfile.TemporaryDirectory() as td:
+            works = []
+            oracles = []
+            for i, r in enumerate(rotations):
+                image = Image.new('RGB', (20 + i, 10), color=(i * 20, 0, 0))
+                image.putpixel((0, 0), (0, 255, 0))
+                image_path = pathlib.Path(td) / f'{i}.png'
+                image.save(image_path)
+                works.append((image_path, r))
+                oracles.append(image.transpose(r))
+            parts_resolver._transpose_images(works)
+            for (image_path, _), oracle in zip(works, oracles):
+                with Image.open(image_path) as image:
+                    self.assertIsNone(ImageChops.difference(image, oracle).getbbox())
+
+    def test_compatibility_matrix(self):
+        from p2ppcb_parts_resolver import compatibility
+        self.assertEqual(compatibility.expand_available('R[1-3] (1|2)u'), ['R1 1u', 'R1 2u', 'R2 1u', 'R2 2u', 'R3 1u', 'R3 2u'])
+        self.assertIsNone(compatibility.expand_available(r'\d*u'))
+        with unittest.mock.patch.object(compatibility, 'sre_parse', None):
+            self.assertIsNone(compatibility.expand_available('R[1-3] (1|2)u'))
+        with tempfile.TemporaryDirectory() as td:
+            pi_dir = pathlib.Path(td) / parts_resolver.PARTS_INFO_DIRNAME
+            shutil.copytree(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME, pi_dir,
+                            ignore=shutil.ignore_patterns(parts_resolver.INDEX_FILENAME, compatibility.COMPATIBILITY_FILENAME))
+            pi = parts_resolver.PartsInfo(pi_dir)
+            self.assertIsNone(pi.is_compatible('R4 2u', 'OEM profile', 'Cherry-style plate mount', 'MX'))
+            matrix = compatibility.compile_compatibility_matrix(pi_dir, 1, ['R4 2u', '2u', 'R2 Homing 1u'])
+            compatibility.save_compatibility_matrix(matrix, pi_dir)
+
+            pi = parts_resolver.PartsInfo(pi_dir)
+            self.assertTrue(pi.is_compatible('R4 2u', 'OEM profile', 'Cherry-style plate mount', 'MX'))
+            self.assertFalse(pi.is_compatible('2u', 'OEM profile', 'Cherry-style plate mount', 'MX'))
+            self.assertIsNone(pi.is_compatible('R3 2u', 'OEM profile', 'Cherry-style plate mount', 'MX'))
+            self.assertEqual(pi.compatible_specifiers('DSA', 'Costar', 'MX'), ['2u'])
+            self.assertEqual(pi.compatible_specifiers('OEM profile', 'Costar', 'MX'), ['R4 2u', 'R2 Homing 1u'])
+            result = pi._resolve_specifier_float('R2 Homing 1u', 'OEM profile', 'Costar', 'MX', parts_resolver.AlignTo.TravelBottom)
+            with unittest.mock.patch.object(pi, '_resolve_specifier_float', side_effect=AssertionError('Matrix not used.')):
+                self.assertEqual(pi.resolve_specifier_float('R2 Homing 1u', 'OEM profile', 'Costar', 'MX', parts_resolver.AlignTo.TravelBottom), result)
+
+            description_csv = pi_dir / parts_resolver.DESCRIPTION_FILENAME
+            with open(description_csv) as f:
+                text = f.read()
+            with open(description_csv, 'w') as f:
+                f.write(text.rstrip('\n') + '\nWiring,Choc V2 copy,wiring_choc_pcb\n')
+            self.assertIsNone(parts_resolver.PartsInfo(pi_dir).compatibility_matrix())
+
+    def test_available_matcher(self):
+        m = parts_resolver._AvailableMatcher(['R[1234] 1u', 'R1|R2 2u', 'Homing 1u'])
+        self.assertIsNotNone(m.combined)
+        self.assertTrue(m.match('R3 1u'))
+        self.assertFalse(m.match('R5 1u'))
+        self.assertTrue(m.match('R1 3u'))  # r'^R1|R2 2u$' is r'(^R1)|(R2 2u$)'
+        self.assertTrue(m.match('R2 2u'))
+        self.assertFalse(m.match('Homing 1u X'))
+        self.assertFalse(parts_resolver._AvailableMatcher([]).match(''))
+        m = parts_resolver._AvailableMatcher([r'(a)\1', 'b'])
+        self.assertIsNone(m.combined)
+        self.assertTrue(m.match('aa'))
+        self.assertTrue(m.match('b'))
+
+        pi = parts_resolver.PartsInfo(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME)
+        with self.assertRaises(parts_resolver.SpecifierException) as cm:
+            pi.resolve_specifier('R5 1u', 'OEM profile', 'Cherry-style plate mount', 'MX', parts_resolver.AlignTo.StemBottom)
+        self.assertEqual(cm.exception.available_specifiers, pi._read_available('mx_oem'))
+        self.assertIsNot(cm.exception.available_specifiers, pi._read_available('mx_oem'))
+
+    def test_lazy_import(self):
+        import subprocess
+        env = dict(os.environ, PYTHONPATH=str(CURRENT_DIR))
+        code = 'import sys, p2ppcb_parts_resolver.resolver; print(" ".join(sorted(sys.modules)))'
+        cp = subprocess.run([sys.executable, '-c', code], cwd=CURRENT_DIR, env=env, capture_output=True, text=True, check=True)
+        modules = cp.stdout.split()
+        for heavy in ['numpy', 'pint', 'PIL']:
+            self.assertNotIn(heavy, modules)
+        # Module constants are still there.
+        self.assertIn('ISO_Enter', parts_resolver.KEY_AREA_PATTERN_DIC)
+        self.assertIn('center_xyu', parts_resolver.KLE_KEY_DTYPE.names)
+
+    @unittest.skipUnless(os.environ.get('P2PPCB_BENCHMARK'), 'Benchmark. Set P2PPCB_BENCHMARK=1 to run.')
+    def test_import_time(self):
+        import subprocess
+        env = dict(os.environ, PYTHONPATH=str(CURRENT_DIR))
+        cp = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import p2ppcb_parts_resolver.resolver'],
+                            cwd=CURRENT_DIR, env=env, capture_output=True, text=True, check=True)
+        cumulative_us = {}
+        for line in cp.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            cumulative_us[name.strip()] = int(cumulative)
+        t = cumulative_us['p2ppcb_parts_resolver.resolver'] / 1000
+        self.assertLess(t, 250., f'import p2ppcb_parts_resolver.resolver took {t:.1f} ms.')
+
+    def test_quantity(self):
+        q = parts_resolver.quantity('1.93 mm')
+        self.assertIsNot(parts_resolver.quantity('1.93 mm'), q)
+        self.assertEqual(parts_resolver.quantity('1.93 mm'), q)
+        self.assertIs(q._REGISTRY, parts_resolver.unit_registry())
+        self.assertAlmostEqual(parts_resolver.magnitude_as(q, 'cm'), q.m_as('cm'), places=15)
+        a = parts_resolver.unit_registry().Quantity(np.array([1., 2.]), 'mm')
+        np.testing.assert_allclose(parts_resolver.magnitude_as(a, 'cm'), a.m_as('cm'), rtol=1e-15)
+        t = parts_resolver.unit_registry().Quantity(20., 'degC')
+        self.assertEqual(parts_resolver.magnitude_as(t, 'kelvin'), t.m_as('kelvin'))
+        with self.assertRaises(parts_resolver.pint.DimensionalityError):
+            parts_resolver.magnitude_as(q, 'rad')
+        self.assertAlmostEqual(parts_resolver.quantity_to_float(q), q.m_as('cm'), places=15)
+        self.assertAlmostEqual(parts_resolver.quantity_to_float(parts_resolver.quantity('90 deg')), parts_resolver.quantity('90 deg').m_as('rad'), places=15)
+        self.assertEqual(parts_resolver.quantity_to_float(parts_resolver.quantity('3')), 3)
+        self.assertIsNone(parts_resolver.quantity_to_float(parts_resolver.quantity('1 s')))
+
+        pi = parts_resolver.PartsInfo(PARTS_DATA_DIR / parts_resolver.PARTS_INFO_DIRNAME)
+        args = ('R2 Homing 1u', 'OEM profile', 'Cherry-style plate mount', 'MX', parts_resolver.AlignTo.TravelBottom)
+        first = pi.resolve_specifier(*args)
+        z_pos = {p: parts_resolver.magnitude_as(z, 'cm') for p, z in first[3].items()}
+        del first[1][parts_resolver.Part.Cap]
+        with unittest.mock.patch.object(parts_resolver.unit_registry(), 'Quantity', side_effect=AssertionError('pint used.')):
+            second = pi.resolve_specifier(*args)
+            self.assertEqual({p: parts_resolver.magnitude_as(z, 'cm') for p, z in second[3].items()}, z_pos)
+        self.assertIn(parts_resolver.Part.Cap, second[1])
+        self.assertIsNot(second[3][parts_resolver.Part.Switch], pi.resolve_specifier(*args)[3][parts_resolver.Part.Switch])